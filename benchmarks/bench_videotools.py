@@ -0,0 +1,374 @@
+"""
+Throughput benchmarks for the main videotools functions, using synthetic inputs.
+
+Inputs are generated with ffmpeg's testsrc2 (video) and sine (audio) sources, so
+every machine benchmarks the same content and no stimulus files are needed. Each
+benchmark is timed from start to finish, and the frames in its output and bytes it
+wrote are used to work out frames per second. Results are printed along with the
+change since the last run of the same benchmark, and appended to a history file
+(one JSON object per run; by default history.jsonl in the work directory) for
+comparing runs over time.
+
+Usage:
+    python benchmarks/bench_videotools.py [--quick] [--only PATTERN] [--engines overlay,xstack]
+        [--work DIR] [--history FILE] [--repeat N]
+
+--quick uses shorter, smaller inputs and fewer grid sizes, for checking that the
+benchmarks still run. Generated inputs are kept in the work directory and reused.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import platform
+import subprocess as sp
+
+this_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(this_path))
+import videotools as vt  # noqa: E402
+
+RESOLUTIONS = [(640, 360), (1280, 720), (1920, 1080)]
+GRID_SIZES = [2, 3, 4, 5, 6]
+FRAME_RATE = 30
+
+
+def synthetic_video(workDir, width, height, duration, frequency=440):
+    """Path to a testsrc2 + sine test video, generated if it doesn't exist yet.
+
+    Encoded with -bitexact flags so that the same ffmpeg version makes identical
+    files."""
+    path = os.path.join(
+        workDir,
+        "inputs",
+        "testsrc2_{}x{}_{}s_{}hz.mp4".format(width, height, duration, frequency),
+    )
+    if not os.path.exists(path):
+        vt.make_sure_path_exists(os.path.dirname(path))
+        sp.check_call(
+            [
+                "ffmpeg",
+                "-y",
+                "-v",
+                "error",
+                "-f",
+                "lavfi",
+                "-i",
+                "testsrc2=size={}x{}:rate={}:duration={}".format(
+                    width, height, FRAME_RATE, duration
+                ),
+                "-f",
+                "lavfi",
+                "-i",
+                "sine=frequency={}:sample_rate=44100:duration={}".format(
+                    frequency, duration
+                ),
+                "-fflags",
+                "+bitexact",
+                "-flags:v",
+                "+bitexact",
+                "-flags:a",
+                "+bitexact",
+                "-c:v",
+                "libx264",
+                "-pix_fmt",
+                "yuv420p",
+                "-c:a",
+                "aac",
+                "-shortest",
+                path,
+            ]
+        )
+    return path
+
+
+def output_stats(outDir, mainOutput):
+    """(frames in mainOutput, total bytes of all files in outDir)."""
+    nBytes = 0
+    for (dirpath, dirnames, filenames) in os.walk(outDir):
+        nBytes += sum(os.path.getsize(os.path.join(dirpath, f)) for f in filenames)
+    frames = None
+    if mainOutput and os.path.exists(mainOutput):
+        frames = vt.get_video_details(mainOutput, "nframes", useCache=False)
+    return (frames, nBytes)
+
+
+def make_benchmarks(workDir, quick, engines):
+    """List of (name, params, function) benchmarks. Each function takes an empty
+    output directory and returns the path of its main output (or None). A
+    benchmark may have a fourth item, a setup function called the same way
+    before each timed run."""
+    duration = 2 if quick else 5
+    resolutions = RESOLUTIONS[:2] if quick else RESOLUTIONS
+    gridSizes = GRID_SIZES[:2] if quick else GRID_SIZES
+    benchmarks = []
+
+    for (width, height) in resolutions:
+        params = {"width": width, "height": height, "duration": duration}
+        src = synthetic_video(workDir, width, height, duration)
+        (shortname, ext) = os.path.splitext(os.path.basename(src))
+
+        benchmarks.append(
+            (
+                "make_mp4",
+                params,
+                lambda out, src=src, shortname=shortname: (
+                    vt.make_mp4(src, out),
+                    os.path.join(out, shortname + "_compressed.mp4"),
+                )[1],
+            )
+        )
+        benchmarks.append(
+            (
+                "make_webm",
+                params,
+                lambda out, src=src, shortname=shortname: (
+                    vt.make_webm(src, out),
+                    os.path.join(out, shortname + "_compressed.webm"),
+                )[1],
+            )
+        )
+        benchmarks.append(
+            (
+                "make_web_exports",
+                params,
+                lambda out, src=src: vt.make_web_exports(src, out)[0],
+            )
+        )
+
+    (width, height) = RESOLUTIONS[0]
+    params = {"width": width, "height": height, "duration": duration}
+    left = synthetic_video(workDir, width, height, duration, frequency=440)
+    right = synthetic_video(workDir, width, height, duration, frequency=660)
+    benchmarks.append(
+        (
+            "makeSideBySide",
+            params,
+            lambda out: (
+                vt.makeSideBySide(left, right, "left", os.path.join(out, "sbs.mp4")),
+                os.path.join(out, "sbs.mp4"),
+            )[1],
+        )
+    )
+    for mode in ["copy", "reencode"]:
+        benchmarks.append(
+            (
+                "concat_mp4s",
+                dict(params, mode=mode, clips=3),
+                lambda out, mode=mode: (
+                    vt.concat_mp4s(
+                        os.path.join(out, "concat.mp4"), [left, right, left], mode=mode
+                    ),
+                    os.path.join(out, "concat.mp4"),
+                )[1],
+            )
+        )
+
+    # Collage tiles are small so that a 6x6 grid is still a plausible size
+    tile = synthetic_video(workDir, 320, 180, duration)
+    for engine in engines:
+        for n in gridSizes:
+            benchmarks.append(
+                (
+                    "make_collage",
+                    {
+                        "engine": engine,
+                        "grid": "{0}x{0}".format(n),
+                        "duration": duration,
+                    },
+                    lambda out, n=n, engine=engine: (
+                        vt.make_collage(
+                            os.path.dirname(tile),
+                            [os.path.basename(tile)] * (n * n),
+                            n,
+                            os.path.join(out, "collage"),
+                            True,
+                            0,
+                            engine=engine,
+                        ),
+                        os.path.join(out, "collage.mp4"),
+                    )[1],
+                )
+            )
+
+    probePaths = [
+        synthetic_video(workDir, w, h, duration) for (w, h) in resolutions
+    ] + [left, right, tile]
+
+    def probe_all(out, useCache, method):
+        for path in probePaths:
+            vt.get_video_details(
+                path,
+                ["duration", "width", "height", "nframes"],
+                useCache=useCache,
+                method=method,
+            )
+
+    for (useCache, method) in [(False, "fast"), (False, "packets")]:
+        benchmarks.append(
+            (
+                "get_video_details",
+                {"files": len(probePaths), "useCache": useCache, "method": method},
+                lambda out, useCache=useCache, method=method: probe_all(
+                    out, useCache, method
+                ),
+            )
+        )
+
+    # With the cache, time probing and storing the results (cold) separately from
+    # just looking them up (warm). Earlier benchmarks fill the cache, so it's
+    # cleared first either way.
+    def clear_cache(out):
+        vt.get_probe_cache().clear()
+
+    def fill_cache(out):
+        clear_cache(out)
+        probe_all(out, True, "fast")
+
+    for (cache, setup) in [("cold", clear_cache), ("warm", fill_cache)]:
+        benchmarks.append(
+            (
+                "get_video_details",
+                {
+                    "files": len(probePaths),
+                    "useCache": True,
+                    "cache": cache,
+                    "method": "fast",
+                },
+                lambda out: probe_all(out, True, "fast"),
+                setup,
+            )
+        )
+    return benchmarks
+
+
+def environment():
+    try:
+        commit = (
+            sp.check_output(
+                ["git", "rev-parse", "--short", "HEAD"],
+                cwd=os.path.dirname(this_path),
+                stderr=sp.DEVNULL,
+            )
+            .decode("utf-8")
+            .strip()
+        )
+    except (sp.CalledProcessError, OSError):
+        commit = None
+    ffmpegVersion = (
+        sp.check_output(["ffmpeg", "-version"]).decode("utf-8").splitlines()[0]
+    )
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "host": socket.gethostname(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+        "ffmpeg": ffmpegVersion,
+    }
+
+
+def previous_results(historyPath):
+    """Dict mapping (name, params) to the most recent result in the history file."""
+    previous = {}
+    if os.path.exists(historyPath):
+        with open(historyPath) as f:
+            for line in f:
+                if line.strip():
+                    for result in json.loads(line)["results"]:
+                        key = (
+                            result["name"],
+                            json.dumps(result["params"], sort_keys=True),
+                        )
+                        previous[key] = result
+    return previous
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--quick", action="store_true")
+    parser.add_argument("--only", help="only run benchmarks whose name contains this")
+    parser.add_argument("--engines", default="overlay,xstack,numpy")
+    parser.add_argument("--work", default=os.path.join(this_path, "_work"))
+    parser.add_argument(
+        "--history", help="default: history.jsonl in the work directory"
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=1, help="runs of each; best is kept"
+    )
+    args = parser.parse_args()
+    if args.history is None:
+        args.history = os.path.join(args.work, "history.jsonl")
+
+    engines = args.engines.split(",")
+    if "numpy" in engines:
+        try:
+            import numpy  # noqa: F401
+        except ImportError:
+            print("numpy not installed; skipping the numpy collage engine")
+            engines.remove("numpy")
+
+    # A probe cache of our own, so that benchmarks don't use or fill the user's
+    vt.make_sure_path_exists(args.work)
+    vt.set_probe_cache(vt.ProbeCache(os.path.join(args.work, "probe_cache.sqlite")))
+    vt.set_build_manifest(None)
+
+    previous = previous_results(args.history)
+    run = {"environment": environment(), "quick": args.quick, "results": []}
+
+    for benchmark in make_benchmarks(args.work, args.quick, engines):
+        (name, params, func) = benchmark[:3]
+        setup = benchmark[3] if len(benchmark) > 3 else None
+        if args.only and args.only not in name:
+            continue
+        outDir = os.path.join(args.work, "output")
+        best = None
+        for iRepeat in range(args.repeat):
+            shutil.rmtree(outDir, ignore_errors=True)
+            vt.make_sure_path_exists(outDir)
+            if setup is not None:
+                setup(outDir)
+            start = time.perf_counter()
+            mainOutput = func(outDir)
+            seconds = time.perf_counter() - start
+            if best is None or seconds < best:
+                best = seconds
+        (frames, nBytes) = output_stats(outDir, mainOutput)
+        result = {
+            "name": name,
+            "params": params,
+            "seconds": round(best, 4),
+            "frames": frames,
+            "fps": round(frames / best, 2) if frames else None,
+            "bytes": nBytes,
+        }
+        run["results"].append(result)
+
+        last = previous.get((name, json.dumps(params, sort_keys=True)))
+        change = ""
+        if last:
+            change = "  ({:+.0%} speed vs previous run)".format(
+                last["seconds"] / best - 1
+            )
+        print(
+            "{:18s} {:60s} {:8.2f} s {:>9s} fps {:>10d} B{}".format(
+                name,
+                json.dumps(params, sort_keys=True),
+                best,
+                "{:.1f}".format(result["fps"]) if result["fps"] else "-",
+                nBytes,
+                change,
+            )
+        )
+
+    shutil.rmtree(os.path.join(args.work, "output"), ignore_errors=True)
+    with open(args.history, "a") as f:
+        f.write(json.dumps(run) + "\n")
+    print("Results appended to {}".format(args.history))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,7 @@ This file will not run as-is - it is just intended to provide reference commands
 """
 
 import os
+import itertools
 from videotools import *
 
 this_path = os.path.dirname(os.path.abspath(__file__))
@@ -68,60 +69,72 @@ sp.call(
 # for particular stimuli!
 
 
-def combineVideos(croppedVideoDir, sidebysideDir, regularOrderDict, whichVersions, minimal=False):
-    '''Generate all versions of side-by-side videos needed for Lookit physics study.
-    i.e. A / B, flippedA / B, A / flippedB, flippedA / flippedB.'''
-
-    make_sure_path_exists(sidebysideDir)
-    commands = ["""[0:v]setpts=PTS-STARTPTS,pad=iw*3:ih:color=white[a];[1:v]setpts=PTS-STARTPTS[z];[a][z]overlay=x=2*w:repeatlast=1:shortest=1:eof_action=repeat[out]""", \
-                """[0:v]setpts=PTS-STARTPTS,hflip,pad=iw*3:ih:color=white[b];[1:v]setpts=PTS-STARTPTS[z];[b][z]overlay=x=2*w:repeatlast=1:shortest=1:eof_action=repeat[out]""", \
-                """[0:v]setpts=PTS-STARTPTS,pad=iw*3:ih:color=white[b];[1:v]setpts=PTS-STARTPTS[z];[z]hflip[c];[b][c]overlay=x=2*w:repeatlast=1:shortest=1:eof_action=repeat[out]""", \
-                """[0:v]setpts=PTS-STARTPTS,hflip,pad=iw*3:ih:color=white[b];[1:v]setpts=PTS-STARTPTS[z];[z]hflip[c];[b][c]overlay=x=2*w:repeatlast=1:shortest=1:eof_action=repeat[out]"""]
-    suffixes = ['NN', 'RN', 'NR', 'RR']
-
-    allfiles = os.listdir(croppedVideoDir)
-
-    for iVid1, video1 in enumerate(allfiles):
-        (shortname1, ext1) = os.path.splitext(video1)
-        if not(os.path.isdir(os.path.join(croppedVideoDir, video1))) and ext1 == VIDEXT:
-            for iVid2 in range(len(allfiles)):
-                if iVid2 == iVid1:
-                    continue
-                if minimal and iVid2 <= iVid1:
-                    continue
-                else:
-                    video2 = allfiles[iVid2]
-                    (shortname2, ext2) = os.path.splitext(video2)
-                    if not(os.path.isdir(os.path.join(croppedVideoDir, video2))) and ext2 == VIDEXT:
-                        labels = [parse_video_filename(v, regularOrderDict) for v in [video1, video2]]
-                        if labels[0][0] == labels[1][0] and \
-                            labels[0][2] == labels[1][2] and \
-                            labels[0][3] == labels[1][3] and \
-                            labels[0][4] == labels[1][4]:
+def combineVideos(
+    croppedVideoDir,
+    sidebysideDir,
+    regularOrderDict,
+    whichVersions,
+    minimal=False,
+    jobs=1,
+):
+    """Generate all versions of side-by-side videos needed for Lookit physics study.
+    i.e. A / B, flippedA / B, A / flippedB, flippedA / flippedB.
 
+    All versions of a pair are made by one ffmpeg process, and up to jobs pairs
+    are processed at once."""
 
-                            outfilenameBase = 'sbs_' + labels[0][0] + '_' + labels[0][1] + '_' + labels[1][1] + '_'  + \
-                                labels[0][2] + '_' + labels[0][3] + '_' + labels[0][4] + '_'
+    make_sure_path_exists(sidebysideDir)
+    suffixes = ["NN", "RN", "NR", "RR"]
+
+    # Group videos by everything but outcome; only videos in the same group are paired
+    index = StimulusIndex(croppedVideoDir, regularOrderDict, extensions=[VIDEXT])
+    groups = index.groupby("event", "object", "camera", "background")
+
+    pairs = []
+    for ((event, object, camera, background), videos) in groups.items():
+        pairIter = (
+            itertools.combinations(videos, 2)
+            if minimal
+            else itertools.permutations(videos, 2)
+        )
+        for (video1, video2) in pairIter:
+            outfilenameBase = (
+                "sbs_"
+                + event
+                + "_"
+                + video1.outcome
+                + "_"
+                + video2.outcome
+                + "_"
+                + object
+                + "_"
+                + camera
+                + "_"
+                + background
+                + "_"
+            )
+            outputs = {
+                suffix: os.path.join(sidebysideDir, outfilenameBase + suffix + ".mp4")
+                for suffix in suffixes
+                if suffix in whichVersions
+            }
+            if not outputs:
+                continue
+            pairs.append(
+                (
+                    outfilenameBase,
+                    lambda v1=video1, v2=video2, o=outputs: make_side_by_side_variants(
+                        v1.path, v2.path, o
+                    ),
+                )
+            )
 
-                            for iVid in range(len(commands)):
-                                if suffixes[iVid] in whichVersions:
-                                    sp.call(["ffmpeg", "-i", os.path.join(croppedVideoDir, video1), \
-                                                   "-i", os.path.join(croppedVideoDir, video2), \
-                                                   "-filter_complex", \
-                                                   commands[iVid], \
-                                                "-map", """[out]""", "-loglevel", "error", \
-                                                os.path.join(sidebysideDir, outfilenameBase + suffixes[iVid] + '.mp4')])
+    run_jobs(pairs, jobs)
 
 def flipVideos(rawVideoDir, origVideoDir, unflippedOrderDict):
-    vidLengths = {
-        "apple": 66,
-        "cup": 86,
-        "lotion": 68,
-        "orangeball": 76,
-        "spray": 90,
-        "whiteball": 64,
-    }
-    fadeFrames = 10
+    """Make "up" (flipped vertically) and "down" versions of each raw "down" video,
+    fading in from and out to blue. Both are made from one decode of the raw video."""
+    fadeParams = (10, "0x009EFC")
 
     make_sure_path_exists(origVideoDir)
     for f in os.listdir(rawVideoDir):
@@ -135,53 +148,17 @@ def flipVideos(rawVideoDir, origVideoDir, unflippedOrderDict):
                 if outcome == "up":
                     continue
 
-                sp.call(
-                    [
-                        "ffmpeg",
-                        "-i",
-                        os.path.join(rawVideoDir, f),
-                        "-vf",
-                        """vflip,fade=type=in:start_frame=1:nb_frames={}:color=0x009EFC,fade=type=out:start_frame={}:color=0x009EFC""".format(
-                            fadeFrames, vidLengths[object] - fadeFrames
-                        ),
-                        "-loglevel",
-                        "error",
-                        os.path.join(
-                            origVideoDir,
-                            event
-                            + "_up_"
-                            + object
-                            + "_"
-                            + background
-                            + "_"
-                            + camera
-                            + ".mp4",
-                        ),
-                    ]
-                )
-                sp.call(
-                    [
-                        "ffmpeg",
-                        "-i",
-                        os.path.join(rawVideoDir, f),
-                        "-vf",
-                        """fade=type=in:start_frame=1:nb_frames={}:color=0x009EFC,fade=type=out:start_frame={}:color=0x009EFC""".format(
-                            fadeFrames, vidLengths[object] - fadeFrames
-                        ),
-                        "-loglevel",
-                        "error",
-                        os.path.join(
-                            origVideoDir,
-                            event
-                            + "_down_"
-                            + object
-                            + "_"
-                            + background
-                            + "_"
-                            + camera
-                            + ".mp4",
-                        ),
-                    ]
+                outfilename = {
+                    which: os.path.join(
+                        origVideoDir,
+                        event + "_" + which + "_" + object + "_" + background + "_" + camera + ".mp4",
+                    )
+                    for which in ["up", "down"]
+                }
+                make_flip_variants(
+                    os.path.join(rawVideoDir, f),
+                    {"V": outfilename["up"], "N": outfilename["down"]},
+                    fadeParams,
                 )
     return 0
 
@@ -210,6 +187,18 @@ def cropVideos(
     """
 
     make_sure_path_exists(croppedVideoDir)
+
+    # Probe all the videos at once up front; later lookups hit the probe cache
+    if originalSizes and not originalSizes == "*" and not cropByName:
+        probe_many(
+            [
+                os.path.join(origVideoDir, f)
+                for f in os.listdir(origVideoDir)
+                if os.path.splitext(f)[1] in ORIGEXT
+            ],
+            ["height", "width"],
+        )
+
     for f in os.listdir(origVideoDir):
         if not (os.path.isdir(os.path.join(origVideoDir, f))):
             (shortname, ext) = os.path.splitext(f)
@@ -230,7 +219,6 @@ def cropVideos(
                     if len(which) == 3 and not (object, event, outcome) == which:
                         continue
 
-                    timecropCommand = []
                     doTimeCrop = False
                     if timecrop:
                         for (ID, s, e, pS, pE) in timecrop:
@@ -240,15 +228,7 @@ def cropVideos(
                                 padStart = pS
                                 padEnd = pE
                                 doTimeCrop = True
-                        if doTimeCrop:
-                            if not startTime == -1:
-                                timecropCommand = ["-ss", str(startTime)]
-                                if not endTime == -1:
-                                    timecropCommand = timecropCommand + [
-                                        "-t",
-                                        str(endTime - startTime),
-                                    ]
-                        else:
+                        if not doTimeCrop:
                             warnings.warn("No time cropping for this video")
 
                 if cropByName:
@@ -266,163 +246,43 @@ def cropVideos(
                         else:
                             cropStr = """scale=640:-2"""
 
-                cropStr = cropStr + ",setpts=PTS-STARTPTS"
-
                 if doTimeCrop:
-                    croppedVid = os.path.join(
-                        croppedVideoDir, shortname + "_middle.mp4"
+                    # Trim, pad, crossfade and fade in a single ffmpeg process
+                    time_crop_video(
+                        os.path.join(origVideoDir, f),
+                        os.path.join(croppedVideoDir, shortname + ".mp4"),
+                        startTime,
+                        endTime,
+                        padStart,
+                        padEnd,
+                        cropStr,
+                        doCrossFade,
+                        fadeParams,
                     )
-                    croppedVidFinal = os.path.join(croppedVideoDir, shortname + ".mp4")
-                else:
-                    croppedVid = os.path.join(croppedVideoDir, shortname + ".mp4")
-                    croppedVidFinal = croppedVid
-
-                command = (
-                    ["ffmpeg", "-i", os.path.join(origVideoDir, f), "-vf", cropStr]
-                    + timecropCommand
-                    + ["-loglevel", "error", croppedVid]
-                )
-
-                sp.call(command)
-
-                if doTimeCrop:
-                    firstImg = os.path.join(croppedVideoDir, shortname + "_first.png")
-                    lastImg = os.path.join(croppedVideoDir, shortname + "_last.png")
-                    firstVid = os.path.join(croppedVideoDir, shortname + "_first.mp4")
-                    lastVid = os.path.join(croppedVideoDir, shortname + "_last.mp4")
-
-                    sp.call(
-                        [
-                            "ffmpeg",
-                            "-i",
-                            croppedVid,
-                            "-vframes",
-                            "1",
-                            "-f",
-                            "image2",
-                            firstImg,
-                            "-loglevel",
-                            "error",
-                        ]
-                    )
-                    [nF, dur, x, y] = get_video_details(
-                        croppedVid, ["nframes", "vidduration", "width", "height"]
-                    )
-                    sp.call(
-                        [
-                            "ffmpeg",
-                            "-i",
-                            croppedVid,
-                            "-vf",
-                            "select='eq(n,{})'".format(nF - 1),
-                            "-vframes",
-                            "1",
-                            "-f",
-                            "image2",
-                            lastImg,
-                            "-loglevel",
-                            "error",
-                        ]
-                    )
-                    sp.call(
-                        [
-                            "ffmpeg",
-                            "-loop",
-                            "1",
-                            "-i",
-                            firstImg,
-                            "-t",
-                            str(padStart),
-                            firstVid,
-                            "-loglevel",
-                            "error",
-                        ]
-                    )
-                    sp.call(
-                        [
-                            "ffmpeg",
-                            "-loop",
-                            "1",
-                            "-i",
-                            lastImg,
-                            "-t",
-                            str(padEnd),
-                            lastVid,
-                            "-loglevel",
-                            "error",
-                        ]
-                    )
-
-                    if not doCrossFade:
-                        concat_mp4s(croppedVidFinal, [firstVid, croppedVid, lastVid])
-
-                    else:
-                        unfaded = os.path.join(
-                            croppedVideoDir, shortname + "_beforecrossfade.mp4"
-                        )
-                        concat_mp4s(unfaded, [croppedVid, lastVid])
-                        # see crossfade advice at http://superuser.com/a/778967
-                        sp.call(
-                            [
-                                "ffmpeg",
-                                "-i",
-                                unfaded,
-                                "-i",
-                                firstVid,
-                                "-f",
-                                "lavfi",
-                                "-i",
-                                "color=white:s={}x{}".format(int(x), int(y)),
-                                "-filter_complex",
-                                "[0:v]format=pix_fmts=yuva420p,fade=t=out:st={}:d={}:alpha=1,setpts=PTS-STARTPTS[va0];\
-                            [1:v]format=pix_fmts=yuva420p,fade=t=in:st=0:d={}:alpha=1,setpts=PTS-STARTPTS+{}/TB[va1];\
-                            [2:v]scale={}x{},trim=duration={}[over];\
-                            [over][va0]overlay=format=yuv420[over1];\
-                            [over1][va1]overlay=format=yuv420[outv]".format(
-                                    dur + padEnd,
-                                    padEnd,
-                                    padEnd,
-                                    dur,
-                                    int(x),
-                                    int(y),
-                                    dur + padStart + padEnd,
-                                ),
-                                "-vcodec",
-                                "libx264",
-                                "-map",
-                                "[outv]",
-                                croppedVidFinal,
-                                "-loglevel",
-                                "error",
-                            ]
-                        )
-                        os.remove(unfaded)
-
-                    os.remove(firstImg)
-                    os.remove(lastImg)
-                    os.remove(firstVid)
-                    os.remove(lastVid)
-                    os.remove(croppedVid)
+                    continue
 
+                cropStr = cropStr + ",setpts=PTS-STARTPTS"
                 if fadeParams:
                     (fadeFrames, fadeColor) = fadeParams
-                    nF = get_video_details(croppedVidFinal, "nframes")
-                    unfaded = os.path.join(croppedVideoDir, shortname + "_unfaded.mp4")
-                    os.rename(croppedVidFinal, unfaded)
-
-                    sp.call(
-                        [
-                            "ffmpeg",
-                            "-i",
-                            unfaded,
-                            "-vf",
-                            """fade=type=in:start_frame=1:nb_frames={}:color={},fade=type=out:start_frame={}:color={}""".format(
-                                fadeFrames, fadeColor, nF - fadeFrames, fadeColor
-                            ),
-                            "-loglevel",
-                            "error",
-                            croppedVidFinal,
-                        ]
+                    [dur, frameRate] = get_video_details(
+                        os.path.join(origVideoDir, f), ["vidduration", "framerate"]
+                    )
+                    cropStr = (
+                        cropStr
+                        + ","
+                        + fade_filter(fadeFrames, fadeColor, dur, frameRate)
                     )
 
-                    os.remove(unfaded)
\ No newline at end of file
+                croppedVid = os.path.join(croppedVideoDir, shortname + ".mp4")
+                command = [
+                    "ffmpeg",
+                    "-i",
+                    os.path.join(origVideoDir, f),
+                    "-vf",
+                    cropStr,
+                    "-loglevel",
+                    "error",
+                    croppedVid,
+                ]
+
+                sp.call(command)
\ No newline at end of file
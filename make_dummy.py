@@ -4,7 +4,7 @@ Useful approach if you want to set up counterbalancing etc. ahead of actually ha
 """
 
 import os
-import subprocess as sp
+from videotools import make_dummies, StimulusSpace, ordered_pairs
 
 events = [
     "table",
@@ -84,77 +84,22 @@ dummy_path = os.path.join(this_path, "example_output")
 blank = os.path.join(this_path, "example_input", "black.mp4")
 doEvents = ["fall", "stay", "same", "salience"]
 
+space = StimulusSpace(
+    ["event", "outcomes", "object", "camera", "background", "flip"],
+    dummy_path,
+    prefix="sbs_",
+)
 for (iEvent, event) in enumerate(events):
-    if event in doEvents:
-        for (iOut1, outcome1) in enumerate(outcomes[iEvent]):
-            for outcome2 in outcomes[iEvent][(iOut1 + 1) :]:
-                for object in objects[iEvent]:
-                    for cam in cams[iEvent]:
-                        for bg in bgs[iEvent]:
-                            for flip in flips[iEvent]:
-                                shortname = (
-                                    "sbs_"
-                                    + event
-                                    + "_"
-                                    + outcome1
-                                    + "_"
-                                    + outcome2
-                                    + "_"
-                                    + object
-                                    + "_"
-                                    + cam
-                                    + "_"
-                                    + bg
-                                    + "_"
-                                    + flip
-                                )
-                                fname = os.path.join(dummy_path, shortname + ".mp4")
-                                sp.call(
-                                    [
-                                        "ffmpeg",
-                                        "-i",
-                                        blank,
-                                        "-ar",
-                                        "22050",
-                                        "-q:v",
-                                        "1",
-                                        "-vf",
-                                        "drawtext='fontfile=/Library/Fonts/Arial Black.ttf:text='"
-                                        + shortname
-                                        + "':fontsize=40:fontcolor=white:x=100:y=40'",
-                                        fname,
-                                    ]
-                                )
-                                shortname = (
-                                    "sbs_"
-                                    + event
-                                    + "_"
-                                    + outcome2
-                                    + "_"
-                                    + outcome1
-                                    + "_"
-                                    + object
-                                    + "_"
-                                    + cam
-                                    + "_"
-                                    + bg
-                                    + "_"
-                                    + flip
-                                )
-                                fname = os.path.join(dummy_path, shortname + ".mp4")
-                                sp.call(
-                                    [
-                                        "ffmpeg",
-                                        "-i",
-                                        blank,
-                                        "-ar",
-                                        "22050",
-                                        "-q:v",
-                                        "1",
-                                        "-vf",
-                                        "drawtext='fontfile=/Library/Fonts/Arial Black.ttf:text='"
-                                        + shortname
-                                        + "':fontsize=40:fontcolor=white:x=100:y=40'",
-                                        fname,
-                                    ]
-                                )
+    space.add_block(
+        event=[event],
+        outcomes=ordered_pairs(outcomes[iEvent]),
+        object=objects[iEvent],
+        camera=cams[iEvent],
+        background=bgs[iEvent],
+        flip=flips[iEvent],
+    )
+space = space.restrict(event=doEvents)
+print("Making {} dummy videos".format(len(space)))
+
+# Each ffmpeg process decodes the blank video once and writes 20 labeled videos
+make_dummies(dummy_path, blank, space, labelsPerProcess=20, jobs=os.cpu_count())
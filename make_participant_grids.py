@@ -14,41 +14,10 @@ input_path = os.path.join(this_path, "example_input")
 # Where to put collages that are created
 output_path = os.path.join(this_path, "example_output")
 
-participantDirs = [
-    os.path.join(input_path, d)
-    for d in os.listdir(input_path)
-    if os.path.isdir(os.path.join(input_path, d))
-]
-
-for partDir in participantDirs:
-
-    vids = [
-        f
-        for f in os.listdir(partDir)
-        if (not (os.path.isdir(os.path.join(partDir, f))) and f[-4:] == ".mp4")
-    ]
-
-    collageName = os.path.split(partDir)[1]
-
-    if len(vids):
-
-        print("Making " + collageName)
-        print(vids)
-
-        doSound = True
-        make_collage(
-            partDir,
-            vids,
-            min(4, len(vids)),
-            os.path.join(output_path, collageName),
-            doSound,
-            0,
-            vidHeight=480
-        )
-
-        print("Exporting compressed")
-        make_mp4(
-            os.path.join(output_path, collageName + ".mp4"),
-            output_path,
-            width=min(1920, 480 * len(vids)),
-        )
+# Grids are made at most 1920 px wide, several participants at a time. Participants
+# whose videos haven't changed since their grid was made are skipped (see
+# output_path/participant_grids.manifest.json).
+for (collageName, seconds) in build_participant_grids(
+    input_path, output_path, jobs=os.cpu_count() or 1, target_width=1920
+):
+    print("{}: {:.1f} s".format(collageName, seconds))
@@ -0,0 +1,38 @@
+"""
+Run videotools jobs from a render queue (see RenderQueue in videotools.py).
+
+Start one of these on each machine that should help with a build, pointing at the
+same queue file:
+
+    python render_worker.py /shared/stimuli/queue.sqlite --idle-timeout 60
+
+Jobs are added to the queue from a separate script, e.g.
+
+    queue = RenderQueue("/shared/stimuli/queue.sqlite")
+    for vid in vids:
+        queue.submit("make_mp4", [vid, "/shared/stimuli/mp4"], {"width": 640})
+"""
+
+import argparse
+from videotools import RenderQueue, RenderWorker
+
+parser = argparse.ArgumentParser(description="Run jobs from a videotools render queue")
+parser.add_argument("queue", help="path to the queue's SQLite file")
+parser.add_argument("--name", help="worker name (default hostname:pid)")
+parser.add_argument("--manifest", help="build manifest to use for this worker")
+parser.add_argument("--max-jobs", type=int, help="stop after this many jobs")
+parser.add_argument(
+    "--idle-timeout",
+    type=float,
+    default=0,
+    help="seconds to wait for new jobs once the queue is empty",
+)
+args = parser.parse_args()
+
+worker = RenderWorker(RenderQueue(args.queue), name=args.name, manifest=args.manifest)
+nJobs = worker.run(maxJobs=args.max_jobs, idleTimeout=args.idle_timeout)
+counts = worker.queue.counts()
+print(
+    "Ran {} jobs. Queue: {queued} queued, {running} running, {done} done, "
+    "{failed} failed".format(nJobs, **counts)
+)
@@ -0,0 +1,77 @@
+import os
+import sys
+
+import pytest
+
+# videotools.py isn't installed as a package; import it from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import videotools as vt  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def isolated_state(tmp_path):
+    """Use a fresh probe cache and no build manifest in each test."""
+    vt.set_probe_cache(vt.ProbeCache(str(tmp_path / "probe_cache.sqlite")))
+    previousManifest = vt.get_build_manifest()
+    vt.set_build_manifest(None)
+    yield
+    vt.set_probe_cache(None)
+    vt.set_build_manifest(previousManifest)
+
+
+def write_file(path, contents="x"):
+    """Write contents to path (creating its directory); return the path as a str."""
+    os.makedirs(os.path.dirname(str(path)), exist_ok=True)
+    with open(str(path), "w") as f:
+        f.write(contents)
+    return str(path)
+
+
+class RecordingRunner(vt.FFmpegRunner):
+    """FFmpegRunner that records commands instead of running them."""
+
+    def __init__(self):
+        super().__init__()
+        self.commands = []
+
+    def run(self, command, outputs, label, check=True):
+        self.commands.append(command)
+        return 0
+
+
+@pytest.fixture
+def runner():
+    recording = RecordingRunner()
+    vt.set_ffmpeg_runner(recording)
+    yield recording
+    vt.set_ffmpeg_runner(None)
+
+
+def fake_probe(duration=3.0, audio=True):
+    """Stand-in for probe_video returning ffprobe output for a short video."""
+    streams = [
+        {
+            "codec_type": "video",
+            "width": 640,
+            "height": 480,
+            "duration": str(duration),
+            "nb_frames": str(int(duration * 30)),
+            "r_frame_rate": "30/1",
+            "avg_frame_rate": "30/1",
+        }
+    ]
+    if audio:
+        streams.append({"codec_type": "audio", "duration": str(duration)})
+    output = {
+        "format": {"duration": str(duration), "bit_rate": "1000", "start_time": "0"},
+        "streams": streams,
+    }
+    return lambda vidPath, kind="streams", useCache=True: output
+
+
+def touch_later(path, contents):
+    """Rewrite path so that its mtime differs from before."""
+    mtime = os.stat(path).st_mtime_ns
+    write_file(path, contents)
+    os.utime(path, ns=(mtime + 10 ** 9, mtime + 10 ** 9))
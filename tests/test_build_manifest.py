@@ -0,0 +1,101 @@
+import os
+
+import videotools as vt
+from conftest import touch_later, write_file
+
+
+def test_manifest_fresh_only_after_record(tmp_path):
+    source = write_file(tmp_path / "a.mp4", "in")
+    output = write_file(tmp_path / "b.mp4", "out")
+    manifest = vt.BuildManifest(str(tmp_path / "manifest.json"))
+    recipe = ["ffmpeg", "-i", source, output]
+    assert not manifest.is_fresh(recipe, [source], [output])
+    manifest.record(recipe, [source], [output])
+    assert manifest.is_fresh(recipe, [source], [output])
+    # Saved and reloaded
+    reloaded = vt.BuildManifest(str(tmp_path / "manifest.json"))
+    assert reloaded.is_fresh(recipe, [source], [output])
+
+
+def test_manifest_stale_when_recipe_changes(tmp_path):
+    source = write_file(tmp_path / "a.mp4", "in")
+    output = write_file(tmp_path / "b.mp4", "out")
+    manifest = vt.BuildManifest(str(tmp_path / "manifest.json"))
+    manifest.record(["ffmpeg", "-i", source, output], [source], [output])
+    assert not manifest.is_fresh(
+        ["ffmpeg", "-i", source, "-vf", "hflip", output], [source], [output]
+    )
+
+
+def test_manifest_stale_when_input_or_output_changes(tmp_path):
+    source = write_file(tmp_path / "a.mp4", "in")
+    output = write_file(tmp_path / "b.mp4", "out")
+    manifest = vt.BuildManifest(str(tmp_path / "manifest.json"))
+    recipe = ["ffmpeg", "-i", source, output]
+
+    manifest.record(recipe, [source], [output])
+    touch_later(source, "new input")
+    assert not manifest.is_fresh(recipe, [source], [output])
+
+    manifest.record(recipe, [source], [output])
+    touch_later(output, "edited by hand")
+    assert not manifest.is_fresh(recipe, [source], [output])
+
+    manifest.record(recipe, [source], [output])
+    os.remove(output)
+    assert not manifest.is_fresh(recipe, [source], [output])
+
+
+def test_manifest_content_hash_ignores_touch(tmp_path):
+    source = write_file(tmp_path / "a.mp4", "in")
+    output = write_file(tmp_path / "b.mp4", "out")
+    manifest = vt.BuildManifest(str(tmp_path / "manifest.json"), hashContent=True)
+    recipe = ["ffmpeg", "-i", source, output]
+    manifest.record(recipe, [source], [output])
+    assert manifest.is_fresh(recipe, [source], [output])
+    touch_later(source, "changed")
+    assert not manifest.is_fresh(recipe, [source], [output])
+
+
+def test_run_ffmpeg_skips_fresh_outputs(tmp_path):
+    source = write_file(tmp_path / "a.mp4", "in")
+    output = write_file(tmp_path / "b.mp4", "out")
+    manifest = vt.BuildManifest(str(tmp_path / "manifest.json"))
+    # The command would fail if it were run
+    command = ["ffmpeg-that-does-not-exist", "-i", source, output]
+    manifest.record(command, [source], [output])
+    vt.set_build_manifest(manifest)
+    assert vt.run_ffmpeg(command, [output]) == 0
+
+
+def test_manifest_saves_are_throttled_and_batched(tmp_path):
+    path = str(tmp_path / "manifest.json")
+    source = write_file(tmp_path / "a.mp4", "in")
+    outputs = [write_file(tmp_path / "out{}.mp4".format(i)) for i in range(3)]
+    manifest = vt.BuildManifest(path, saveInterval=60)
+
+    # The first record is saved straight away, later ones wait
+    manifest.record(["ffmpeg", "0"], [source], outputs[:1])
+    manifest.record(["ffmpeg", "1"], [source], outputs[1:2])
+    assert list(vt.BuildManifest(path).entries) == [os.path.abspath(outputs[0])]
+    manifest.flush()
+    assert len(vt.BuildManifest(path).entries) == 2
+
+    manifest.saveInterval = 0
+    with manifest.batch():
+        manifest.record(["ffmpeg", "2"], [source], outputs[2:])
+        assert len(vt.BuildManifest(path).entries) == 2
+    reloaded = vt.BuildManifest(path)
+    assert reloaded.is_fresh(["ffmpeg", "2"], [source], outputs[2:])
+
+
+def test_unsaved_manifest_changes_are_saved_at_exit(tmp_path):
+    path = str(tmp_path / "manifest.json")
+    source = write_file(tmp_path / "a.mp4", "in")
+    output = write_file(tmp_path / "b.mp4", "out")
+    manifest = vt.BuildManifest(path, saveInterval=60)
+    manifest.record(["ffmpeg", "0"], [source], [output])
+    manifest.record(["ffmpeg", "1"], [source], [output])
+    del manifest
+    vt._flush_manifests()
+    assert vt.BuildManifest(path).is_fresh(["ffmpeg", "1"], [source], [output])
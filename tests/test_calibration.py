@@ -0,0 +1,57 @@
+import pytest
+
+import videotools as vt
+
+
+def test_calibration_videos_share_one_decode(tmp_path, runner):
+    outDir = str(tmp_path)
+    outpaths = vt.make_calibration_videos(
+        "ag.mp4",
+        outDir,
+        size=100,
+        segmentDuration=2,
+        targets=[{"format": "webm", "width": 50}],
+    )
+    assert list(outpaths) == ["LR", "RL"]
+    [command] = runner.commands
+    assert command[:4] == ["ffmpeg", "-y", "-i", "ag.mp4"]
+    assert command[5].split(";") == [
+        "[0:v]trim=duration=2,setpts=PTS-STARTPTS,"
+        "pad=width=100:height=100:x=(ow-iw)/2:y=(oh-ih)/2:color=white,split=2[sL][sR]",
+        "[sL]pad=width=iw*3:height=ih:x=iw*0:y=0:color=white,split=2[L0][L1]",
+        "[sR]pad=width=iw*3:height=ih:x=iw*2:y=0:color=white,split=2[R0][R1]",
+        "[L0][R0]concat=n=2:v=1:a=0,split=2[o0_0][o0_1]",
+        "[o0_1]scale=50:-2[e0_0]",
+        "[R1][L1]concat=n=2:v=1:a=0,split=2[o1_0][o1_1]",
+        "[o1_1]scale=50:-2[e1_0]",
+    ]
+    mapped = [
+        (command[i + 1], next(a for a in command[i + 2 :] if a.startswith(outDir)))
+        for (i, arg) in enumerate(command)
+        if arg == "-map"
+    ]
+    assert mapped == [
+        ("[o0_0]", outpaths["LR"][0]),
+        ("[e0_0]", outpaths["LR"][1]),
+        ("[o1_0]", outpaths["RL"][0]),
+        ("[e1_0]", outpaths["RL"][1]),
+    ]
+
+
+def test_calibration_single_order_and_position(tmp_path, runner):
+    vt.make_calibration_videos("ag.mp4", str(tmp_path), positions="C", targets=[])
+    [command] = runner.commands
+    assert command[5].split(";") == [
+        "[0:v]trim=duration=5.0,setpts=PTS-STARTPTS,"
+        "pad=width=640:height=640:x=(ow-iw)/2:y=(oh-ih)/2:color=white[sC]",
+        "[sC]pad=width=iw*3:height=ih:x=iw*1:y=0:color=white[C0]",
+        "[C0]concat=n=1:v=1:a=0[o0_0]",
+    ]
+
+
+def test_calibration_rejects_unknown_positions(tmp_path, runner):
+    with pytest.raises(ValueError):
+        vt.make_calibration_videos("ag.mp4", str(tmp_path), positions="LX")
+    with pytest.raises(ValueError):
+        vt.make_calibration_videos("ag.mp4", str(tmp_path), orders=["LC"])
+    assert runner.commands == []
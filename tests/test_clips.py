@@ -0,0 +1,50 @@
+import videotools as vt
+
+
+def test_compile_single_clip():
+    clip = vt.Clip("a.mp4", audio=False).hflip()
+    assert vt.compile_clips([clip.export("out.mp4")]) == [
+        "ffmpeg",
+        "-i",
+        "a.mp4",
+        "-filter_complex",
+        "[0:v]hflip[v1]",
+        "-map",
+        "[v1]",
+        "out.mp4",
+    ]
+
+
+def test_compile_shared_input_is_decoded_once_and_split():
+    clip = vt.Clip("a.mp4", audio=False)
+    command = vt.compile_clips(
+        [clip.hflip().export("o1.mp4"), clip.export("o2.mp4", width=320)]
+    )
+    assert command == [
+        "ffmpeg",
+        "-i",
+        "a.mp4",
+        "-filter_complex",
+        "[0:v]split=2[v0_0][v0_1];[v0_0]hflip[v1];[v0_1]scale=320:-2[v2]",
+        "-map",
+        "[v1]",
+        "o1.mp4",
+        "-map",
+        "[v2]",
+        "o2.mp4",
+    ]
+
+
+def test_compile_overlay_of_two_inputs():
+    left = vt.Clip("a.mp4", audio=False).pad("iw*2", "ih")
+    right = vt.Clip("b.mp4", audio=False)
+    command = vt.compile_clips(
+        [left.overlay_with(right, x="w", audio=None).export("sbs.webm", format="webm")]
+    )
+    assert command[:5] == ["ffmpeg", "-i", "a.mp4", "-i", "b.mp4"]
+    assert command[6] == (
+        "[0:v]pad=width=iw*2:height=ih:x=0:y=0:color=black[v1];"
+        "[v1][1:v]overlay=x=w:y=0:eof_action=repeat:shortest=0[v3]"
+    )
+    assert command[-3:] == ["-pix_fmt", "yuv420p", "sbs.webm"]
+    assert "libvpx" in command
@@ -0,0 +1,159 @@
+import pytest
+
+import videotools as vt
+
+
+def test_color_to_rgb():
+    assert vt.color_to_rgb("White") == (255, 255, 255)
+    assert vt.color_to_rgb("navy") == (0, 0, 128)
+    assert vt.color_to_rgb("0x102030") == (16, 32, 48)
+    assert vt.color_to_rgb("#a0b0c0") == (160, 176, 192)
+    for color in ["chartreuse", "#fff", "0x10203040", "0xGGHHII", "102030"]:
+        with pytest.raises(ValueError, match="Unrecognized color"):
+            vt.color_to_rgb(color)
+
+
+def tile(path, x, y, filters=()):
+    return {
+        "path": path,
+        "x": x,
+        "y": y,
+        "width": 320,
+        "height": 200,
+        "filters": list(filters),
+    }
+
+
+def test_xstack_filter_full_grid():
+    layout = {
+        "width": 650,
+        "height": 200,
+        "fillColor": "black",
+        "tiles": [tile("a.mp4", 0, 0), tile("b.mp4", 330, 0, ["scale=320:200"])],
+    }
+    assert vt.xstack_filter(layout) == (
+        "[0:v]format=yuv420p,setpts=PTS-STARTPTS[t0];"
+        "[1:v]scale=320:200,format=yuv420p,setpts=PTS-STARTPTS[t1];"
+        "[t0][t1]xstack=inputs=2:layout=0_0|330_0:fill=black[stacked];"
+        "[stacked]null[out]"
+    )
+
+
+def test_xstack_filter_pads_out_gaps():
+    layout = {
+        "width": 650,
+        "height": 410,
+        "fillColor": "white",
+        "tiles": [
+            tile("a.mp4", 0, 0),
+            tile(None, 330, 0),
+            tile("c.mp4", 0, 210),
+            tile(None, 330, 210),
+        ],
+    }
+    assert vt.xstack_filter(layout) == (
+        "[0:v]format=yuv420p,setpts=PTS-STARTPTS[t0];"
+        "[1:v]format=yuv420p,setpts=PTS-STARTPTS[t1];"
+        "[t0][t1]xstack=inputs=2:layout=0_0|0_210:fill=white[stacked];"
+        "[stacked]pad=650:410:0:0:color=white[out]"
+    )
+
+
+class StubProcessRunner(vt.FFmpegRunner):
+    """Runs a shell command in place of each ffmpeg process that is started, the
+    decoders' in turn and then the encoder's."""
+
+    def __init__(self, decoders, encoder):
+        super().__init__(sinks=[self.record])
+        self.scripts = list(decoders) + [encoder]
+        self.stats = []
+
+    def record(self, stats):
+        self.stats.append(stats)
+
+    def start(self, command, outputs=(), label="ffmpeg", **popenArgs):
+        script = self.scripts.pop(0)
+        return super().start(["sh", "-c", script], outputs, label, **popenArgs)
+
+
+def numpy_layout():
+    pytest.importorskip("numpy")
+    tiles = [tile("a.mp4", 0, 0), tile("b.mp4", 2, 0)]
+    for t in tiles:
+        (t["width"], t["height"]) = (2, 2)
+    return {
+        "width": 4,
+        "height": 2,
+        "frameRate": 30,
+        "fillColor": "black",
+        "tiles": tiles,
+    }
+
+
+def test_numpy_collage_kills_and_waits_for_every_process(tmp_path):
+    # The first video has three 2x2 rgb24 frames; the second never ends
+    runner = StubProcessRunner(
+        ["head -c 36 /dev/zero", "cat /dev/zero"], "cat > '{}'".format(tmp_path / "out")
+    )
+    vt.set_ffmpeg_runner(runner)
+    vt.compose_collage_numpy(numpy_layout(), "out.mp4")
+    assert (tmp_path / "out").stat().st_size == 3 * 4 * 2 * 3
+    assert len(runner.stats) == 3
+    assert runner.stats[-1].returnCode == 0
+
+
+def test_numpy_collage_reports_encoder_failure(tmp_path):
+    runner = StubProcessRunner(["cat /dev/zero", "cat /dev/zero"], "exit 3")
+    vt.set_ffmpeg_runner(runner)
+    with pytest.raises(vt.sp.CalledProcessError):
+        vt.compose_collage_numpy(numpy_layout(), "out.mp4")
+    assert len(runner.stats) == 3
+    assert runner.stats[-1].returnCode == 3
+
+
+def test_collage_mixes_sound_in_the_video_filter_graph(runner):
+    vt.make_collage("/v", ["a.mp4", "b.mp4", "c.mp4"], 2, "/o/col", True, 0)
+    [command] = runner.commands
+    assert command[:8] == [
+        "ffmpeg",
+        "-y",
+        "-i",
+        "/v/a.mp4",
+        "-i",
+        "/v/b.mp4",
+        "-i",
+        "/v/c.mp4",
+    ]
+    filterStr = command[command.index("-filter_complex") + 1]
+    assert filterStr.endswith(
+        "eof_action=repeat[out];"
+        "[0:a][1:a][2:a]amix=inputs=3:duration=first:dropout_transition=3[aout]"
+    )
+    assert command[command.index("-filter_complex") + 2 :] == [
+        "-map",
+        "[out]",
+        "-map",
+        "[aout]",
+        "-c:v",
+        "libx264",
+        "-c:a",
+        "libfdk_aac",
+        "-shortest",
+        "/o/col.mp4",
+    ]
+
+
+def test_collage_with_temp_files_mixes_sound_separately():
+    plan = vt._collage_steps(
+        "/v", ["a.mp4", "b.mp4"], 2, "/o/col", True, [], False, "overlay", True, "black"
+    )
+    assert not plan["mixSound"]
+    (silent, sound, mux) = plan["steps"]
+    assert "amix" not in silent[silent.index("-filter_complex") + 1]
+    assert sound[-3:] == [
+        "-filter_complex",
+        "amix=inputs=2:duration=first:dropout_transition=3",
+        "/o/col.wav",
+    ]
+    assert mux[-1] == "/o/col.mp4"
+    assert plan["intermediates"] == [silent[-1], sound[-1]]
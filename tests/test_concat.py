@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+import videotools as vt
+from conftest import write_file
+
+
+def h264_probe(**changes):
+    stream = {
+        "codec_type": "video",
+        "codec_name": "h264",
+        "profile": "High",
+        "level": 30,
+        "width": 640,
+        "height": 480,
+        "pix_fmt": "yuv420p",
+        "sample_aspect_ratio": "1:1",
+        "field_order": "progressive",
+        "time_base": "1/15360",
+        "r_frame_rate": "30/1",
+        "extradata_size": 46,
+        "extradata_hash": "MD5:eba29b1f2123207435574dcb5782d9f7",
+    }
+    stream.update(changes)
+    return {"format": {"duration": "1.0"}, "streams": [stream]}
+
+
+def test_streams_match_identical_streams():
+    assert vt._streams_match([h264_probe(), h264_probe()])
+
+
+@pytest.mark.parametrize(
+    "changes",
+    [
+        {"level": 40},
+        {"sample_aspect_ratio": "4:3"},
+        {"field_order": "tt"},
+        {"color_primaries": "bt709"},
+        {"extradata_hash": "MD5:00000000000000000000000000000000"},
+    ],
+)
+def test_streams_match_compares_level_aspect_color_and_extradata(changes):
+    assert not vt._streams_match([h264_probe(), h264_probe(**changes)])
+
+
+def test_streams_match_in_doubt_without_extradata_hash():
+    # e.g. probes cached before the hash was requested
+    stale = h264_probe()
+    del stale["streams"][0]["extradata_hash"]
+    assert not vt._streams_match([stale, stale])
+    # Streams without extradata at all (e.g. VP9) can still match
+    stale["streams"][0]["extradata_size"] = 0
+    assert vt._streams_match([stale, stale])
+
+
+def test_streams_match_needs_video():
+    audioOnly = {"format": {}, "streams": [{"codec_type": "audio"}]}
+    assert not vt._streams_match([h264_probe(), audioOnly])
+
+
+@pytest.mark.parametrize(
+    ("second", "copied"), [(h264_probe(), True), (h264_probe(level=40), False)]
+)
+def test_auto_concat_copies_only_matching_streams(
+    tmp_path, runner, monkeypatch, second, copied
+):
+    vids = [write_file(tmp_path / "a.mp4"), write_file(tmp_path / "b.mp4")]
+    probes = {vids[0]: h264_probe(), vids[1]: second}
+    monkeypatch.setattr(
+        vt,
+        "probe_video",
+        lambda vidPath, kind="streams", useCache=True: probes[vidPath],
+    )
+    concatPath = str(tmp_path / "out.mp4")
+    assert vt.concat_mp4s(concatPath, vids) == 0
+    [command] = runner.commands
+    assert ("concat" in command and "copy" in command) == copied
+    assert ("-filter_complex" in command) == (not copied)
+
+
+def test_async_auto_concat_reencodes_on_probe_error(tmp_path, monkeypatch):
+    vids = [write_file(tmp_path / "a.mp4"), write_file(tmp_path / "b.mp4")]
+    commands = []
+
+    async def fake_aprobe_video(vidPath, kind="streams", useCache=True):
+        raise ValueError("bad ffprobe output")
+
+    async def fake_arun_ffmpeg(command, outputs, **kwargs):
+        commands.append(command)
+        return 0
+
+    monkeypatch.setattr(vt, "aprobe_video", fake_aprobe_video)
+    monkeypatch.setattr(vt, "arun_ffmpeg", fake_arun_ffmpeg)
+    asyncio.run(vt.aconcat_mp4s(str(tmp_path / "out.mp4"), vids))
+    assert "-filter_complex" in commands[0]
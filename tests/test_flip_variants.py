@@ -0,0 +1,62 @@
+import pytest
+
+import videotools as vt
+
+
+def test_flip_variants_warn_rather_than_raise():
+    class FailingRunner(vt.FFmpegRunner):
+        def run(self, command, outputs, label, check=True):
+            return 1
+
+    vt.set_ffmpeg_runner(FailingRunner())
+    try:
+        with pytest.warns(UserWarning):
+            returnCode = vt.make_flip_variants("a.mp4", {"N": "n.mp4", "VH": "vh.mp4"})
+        assert returnCode == 1
+    finally:
+        vt.set_ffmpeg_runner(None)
+
+
+def test_flip_variants_fade_once_then_split(runner, monkeypatch):
+    monkeypatch.setattr(
+        vt,
+        "get_video_details",
+        lambda vidPath, whichAttr, useCache=True, method="auto": [4.0, 25.0],
+    )
+    outputs = {"N": "n.mp4", "V": "v.mp4", "VH": "vh.mp4"}
+    vt.make_flip_variants("a.mp4", outputs, fadeParams=(10, "black"))
+    [command] = runner.commands
+    assert command[:4] == ["ffmpeg", "-i", "a.mp4", "-filter_complex"]
+    assert command[4].split(";") == [
+        "[0:v]setpts=PTS-STARTPTS,"
+        "fade=type=in:st=0.04:d=0.4:color=black,"
+        "fade=type=out:st=3.6:d=0.4:color=black,"
+        "split=3[s0][s1][s2]",
+        "[s0]null[out0]",
+        "[s1]vflip[out1]",
+        "[s2]vflip,hflip[out2]",
+    ]
+    assert command[command.index("error") + 1 :] == [
+        "-map",
+        "[out0]",
+        "-map",
+        "0:a?",
+        "n.mp4",
+        "-map",
+        "[out1]",
+        "-map",
+        "0:a?",
+        "v.mp4",
+        "-map",
+        "[out2]",
+        "-map",
+        "0:a?",
+        "vh.mp4",
+    ]
+
+
+def test_single_flip_variant_without_audio(runner):
+    vt.make_flip_variants("a.mp4", {"H": "h.mp4"}, audio=False)
+    [command] = runner.commands
+    assert command[4] == "[0:v]setpts=PTS-STARTPTS[s0];[s0]hflip[out0]"
+    assert command[-3:] == ["-map", "[out0]", "h.mp4"]
@@ -0,0 +1,28 @@
+import pytest
+
+import videotools as vt
+from conftest import write_file
+
+
+def test_participant_grids_pass_manifest_without_setting_it(tmp_path, monkeypatch):
+    write_file(tmp_path / "videos" / "p1" / "a.mp4")
+    write_file(tmp_path / "videos" / "p1" / "b.mp4")
+    calls = []
+    monkeypatch.setattr(vt, "get_video_details", lambda path, attr: 640.0)
+    monkeypatch.setattr(
+        vt, "make_collage", lambda *args, **kwargs: calls.append(kwargs)
+    )
+    vt.build_participant_grids(str(tmp_path / "videos"), str(tmp_path / "grids"))
+    assert len(calls) == 1
+    assert calls[0]["vidWidth"] == 640
+    assert calls[0]["manifest"].path == str(
+        tmp_path / "grids" / "participant_grids.manifest.json"
+    )
+    assert vt.get_build_manifest() is None
+
+
+def test_participant_grids_fail_when_first_video_cant_be_probed(tmp_path, monkeypatch):
+    write_file(tmp_path / "videos" / "p1" / "a.mp4")
+    monkeypatch.setattr(vt, "get_video_details", lambda path, attr: -1)
+    with pytest.raises(ValueError):
+        vt.build_participant_grids(str(tmp_path / "videos"), str(tmp_path / "grids"))
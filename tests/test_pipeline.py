@@ -0,0 +1,98 @@
+import os
+
+import pytest
+
+import videotools as vt
+
+pytestmark = pytest.mark.skipif(not vt.can_use_fifos(), reason="needs named pipes")
+
+
+class ShellRunner(vt.FFmpegRunner):
+    """Runs ["ffmpeg", script, args...] as sh -c script with those args ($1, ...),
+    recording the commands."""
+
+    def __init__(self):
+        super().__init__()
+        self.commands = []
+
+    def run(self, command, outputs, label, check=True):
+        self.commands.append(command)
+        script = [arg for arg in command[1:] if arg != "-y"]
+        return super().run(
+            ["sh", "-c", script[0], "sh"] + script[1:], outputs, label, check
+        )
+
+
+@pytest.fixture
+def shell():
+    runner = ShellRunner()
+    vt.set_ffmpeg_runner(runner)
+    yield runner
+    vt.set_ffmpeg_runner(None)
+
+
+def pipeline(tmp_path, producer, consumer):
+    fifo = vt.fifo_path(str(tmp_path / "out.txt"), "part.nut")
+    out = str(tmp_path / "out.txt")
+    commands = [["ffmpeg", producer, fifo], ["ffmpeg", consumer, fifo, out]]
+    return (commands, [out], [fifo])
+
+
+def test_pipeline_streams_through_a_private_fifo(tmp_path, shell):
+    (commands, outputs, fifos) = pipeline(
+        tmp_path, 'printf hello > "$1"', 'cat "$1" > "$2"'
+    )
+    assert vt.run_pipeline(commands, outputs, fifos) == 0
+    assert open(outputs[0]).read() == "hello"
+    pipe = shell.commands[0][-1]
+    assert pipe != fifos[0] and pipe in shell.commands[1]
+    assert not os.path.exists(os.path.dirname(pipe))
+
+
+def test_pipeline_unblocks_producer_when_consumer_fails(tmp_path, shell):
+    # The producer would wait forever to open the pipe that nothing reads
+    (commands, outputs, fifos) = pipeline(tmp_path, 'printf hello > "$1"', "exit 3")
+    with pytest.raises(vt.sp.CalledProcessError) as error:
+        vt.run_pipeline(commands, outputs, fifos)
+    assert error.value.returncode == 3
+    assert not os.path.exists(os.path.dirname(shell.commands[0][-1]))
+
+
+def test_pipeline_unblocks_consumer_when_producer_fails(tmp_path, shell):
+    (commands, outputs, fifos) = pipeline(tmp_path, "exit 2", 'cat "$1" > "$2"')
+    with pytest.raises(vt.sp.CalledProcessError) as error:
+        vt.run_pipeline(commands, outputs, fifos)
+    assert error.value.returncode == 2
+
+
+def test_pipeline_accepts_producer_cut_off_after_consumer_ends(tmp_path, shell):
+    (commands, outputs, fifos) = pipeline(
+        tmp_path, 'yes > "$1"; sleep 0.2; exit 1', 'head -c 6 "$1" > "$2"'
+    )
+    assert vt.run_pipeline(commands, outputs, fifos) == 0
+    assert open(outputs[0]).read() == "y\ny\ny\n"
+
+
+def test_stream_concat_pipes_parts_into_the_concat_filter(tmp_path, runner):
+    concatPath = str(tmp_path / "out.mp4")
+    sources = [["ffmpeg", "-i", "a.mp4"], ["ffmpeg", "-i", "b.mp4", "-vf", "hflip"]]
+    vt.stream_concat(concatPath, sources)
+    (producers, consumer) = (runner.commands[:2], runner.commands[2])
+    pipes = [producer[-1] for producer in producers]
+    assert [producer[-4:-1] for producer in producers] == [["ffv1", "-f", "nut"]] * 2
+    assert consumer[:6] == ["ffmpeg", "-y", "-i", pipes[0], "-i", pipes[1]]
+    assert consumer[-1] == concatPath
+    assert len(set(os.path.dirname(pipe) for pipe in pipes)) == 1
+    assert not os.path.exists(os.path.dirname(pipes[0]))
+
+
+def test_stream_concat_manifest_ignores_private_fifo_dirs(tmp_path, runner):
+    manifest = vt.BuildManifest(str(tmp_path / "manifest.json"))
+    vt.set_build_manifest(manifest)
+    concatPath = str(tmp_path / "out.mp4")
+    sources = [["ffmpeg", "-i", "a.mp4"], ["ffmpeg", "-i", "b.mp4"]]
+    # The recording runner doesn't make the output
+    open(concatPath, "w").close()
+    vt.stream_concat(concatPath, sources)
+    vt.stream_concat(concatPath, sources)
+    assert len(runner.commands) == 3
@@ -0,0 +1,61 @@
+import asyncio
+
+import videotools as vt
+from conftest import fake_probe
+
+
+def test_probe_many_reports_bad_output_per_file(monkeypatch):
+    good = fake_probe()("good.mp4")
+    outputs = {
+        "good.mp4": good,
+        "no_size.mp4": {"format": good["format"], "streams": [{"codec_type": "video"}]},
+        "no_format.mp4": {"streams": good["streams"]},
+    }
+    monkeypatch.setattr(
+        vt,
+        "probe_video",
+        lambda vidPath, kind="streams", useCache=True: outputs[vidPath],
+    )
+    results = vt.probe_many(list(outputs), ["width", "duration"], workers=2)
+    assert results["good.mp4"].ok
+    assert results["good.mp4"].values == {"width": 640.0, "duration": 3.0}
+    for path in ["no_size.mp4", "no_format.mp4"]:
+        assert results[path].values == {"width": -1, "duration": -1}
+        assert not results[path].ok
+        assert path in results[path].errors[0]
+
+
+def test_fast_frame_count_falls_back_to_format_duration(monkeypatch):
+    # As for webm and mkv, where streams don't give their duration or frame count
+    webm = fake_probe(duration=2.0)("a.webm")
+    for stream in webm["streams"]:
+        del stream["duration"]
+        stream.pop("nb_frames", None)
+    monkeypatch.setattr(
+        vt, "probe_video", lambda vidPath, kind="streams", useCache=True: webm
+    )
+    assert vt.get_video_details("a.webm", "nframes", method="fast") == 60.0
+    assert vt.frames_from_probe(webm["streams"][0], "fast") is None
+
+
+def test_sync_and_async_count_packets_without_header_count(monkeypatch):
+    header = fake_probe()("a.mkv")
+    del header["streams"][0]["nb_frames"]
+    packets = {"streams": [{"codec_type": "video", "nb_read_packets": "42"}]}
+    probes = {"streams": header, "count_packets": packets}
+    kinds = []
+
+    def fake_probe_video(vidPath, kind="streams", useCache=True):
+        kinds.append(kind)
+        return probes[kind]
+
+    async def fake_aprobe_video(vidPath, kind="streams", useCache=True):
+        return fake_probe_video(vidPath, kind, useCache)
+
+    monkeypatch.setattr(vt, "probe_video", fake_probe_video)
+    monkeypatch.setattr(vt, "aprobe_video", fake_aprobe_video)
+    assert vt.get_video_details("a.mkv", "nframes") == 42.0
+    assert asyncio.run(vt.aget_video_details("a.mkv", "nframes")) == 42.0
+    assert kinds == ["streams", "count_packets"] * 2
+    # A header count is used as is
+    assert vt.get_video_details("a.mkv", "nframes", method="fast") == 90.0
@@ -0,0 +1,45 @@
+import time
+
+import videotools as vt
+from conftest import touch_later, write_file
+
+
+def test_probe_cache_round_trip_and_staleness(tmp_path):
+    video = write_file(tmp_path / "a.mp4", "video")
+    cache = vt.ProbeCache(str(tmp_path / "cache.sqlite"))
+    assert cache.get(video, "streams") is None
+    cache.put(video, "streams", {"streams": [{"codec_type": "video"}]})
+    assert cache.get(video, "streams") == {"streams": [{"codec_type": "video"}]}
+    assert cache.get(video, "count_frames") is None
+    touch_later(video, "another video")
+    assert cache.get(video, "streams") is None
+
+
+def test_probe_cache_evicts_least_recently_used(tmp_path):
+    cache = vt.ProbeCache(str(tmp_path / "cache.sqlite"), maxEntries=2)
+    (a, b, c) = [write_file(tmp_path / (n + ".mp4"), n) for n in "abc"]
+    cache.put(a, "streams", {"name": "a"})
+    time.sleep(0.01)
+    cache.put(b, "streams", {"name": "b"})
+    time.sleep(0.01)
+    # Using a makes b the least recently used
+    assert cache.get(a, "streams") == {"name": "a"}
+    time.sleep(0.01)
+    cache.put(c, "streams", {"name": "c"})
+    assert cache.get(a, "streams") == {"name": "a"}
+    assert cache.get(b, "streams") is None
+    assert cache.get(c, "streams") == {"name": "c"}
+
+
+def test_probe_cache_skips_paths_that_are_not_local_files(tmp_path):
+    cache = vt.ProbeCache(str(tmp_path / "cache.sqlite"))
+    for path in ["https://example.com/a.mp4", str(tmp_path / "missing.mp4")]:
+        cache.put(path, "streams", {"name": "remote"})
+        assert cache.get(path, "streams") is None
+
+
+def test_probe_video_of_url_bypasses_cache(runner, monkeypatch):
+    output = b'{"format": {"duration": "2.5"}, "streams": []}'
+    monkeypatch.setattr(runner, "output", lambda args, label: output)
+    url = "https://example.com/a.mp4"
+    assert vt.get_video_details(url, "duration") == 2.5
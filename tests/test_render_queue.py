@@ -0,0 +1,185 @@
+import os
+import threading
+import time
+
+import pytest
+
+import videotools as vt
+from conftest import write_file
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return vt.RenderQueue(str(tmp_path / "queue.sqlite"))
+
+
+def test_resubmitting_gives_the_same_key(tmp_path, queue):
+    source = write_file(tmp_path / "in" / "a.mp4")
+    outDir = str(tmp_path / "out")
+    key = queue.submit("make_mp4", [source, outDir])
+    assert queue.submit("make_mp4", [source, outDir]) == key
+    assert queue.counts()["queued"] == 1
+
+
+def test_outputs_dont_change_the_key(tmp_path, queue):
+    source = write_file(tmp_path / "in" / "a.mp4")
+    outDir = str(tmp_path / "out")
+    key = queue.submit("make_mp4", [source, outDir])
+    # As if the job had run
+    write_file(os.path.join(outDir, "a_compressed.mp4"), "encoded")
+    assert queue.submit("make_mp4", [source, outDir]) == key
+
+
+def test_changing_an_input_changes_the_key(tmp_path, queue):
+    source = write_file(tmp_path / "in" / "a.mp4", "one")
+    outDir = str(tmp_path / "out")
+    key = queue.submit("make_mp4", [source, outDir])
+    write_file(source, "two")
+    assert queue.submit("make_mp4", [source, outDir]) != key
+
+
+def test_collage_inputs_are_relative_to_video_dir(tmp_path, queue):
+    videoDir = str(tmp_path / "clips")
+    write_file(os.path.join(videoDir, "c1.mp4"), "one")
+    write_file(os.path.join(videoDir, "c2.mp4"), "two")
+    args = [videoDir, ["c1.mp4", "c2.mp4"], 2, str(tmp_path / "grid"), False, 0]
+    key = queue.submit("make_collage", args)
+    write_file(os.path.join(videoDir, "c2.mp4"), "changed")
+    assert queue.submit("make_collage", args) != key
+
+
+def test_keyword_and_positional_arguments_hash_the_same_inputs(tmp_path, queue):
+    source = write_file(tmp_path / "in" / "a.mp4")
+    hashes = vt._job_input_hashes("make_mp4", [source, "out"], {})
+    assert (
+        vt._job_input_hashes("make_mp4", [], {"inputpath": source, "mp4dir": "out"})
+        == hashes
+    )
+    assert list(hashes) == [source]
+
+
+def test_unknown_operation_is_rejected(queue):
+    with pytest.raises(ValueError):
+        queue.submit("rm_rf", ["/"])
+
+
+def test_claim_takes_oldest_job_once(tmp_path, queue):
+    first = queue.submit("make_mp4", [write_file(tmp_path / "a.mp4"), "out"])
+    second = queue.submit("make_mp4", [write_file(tmp_path / "b.mp4"), "out"])
+    assert queue.claim("w1")[0] == first
+    assert queue.claim("w2")[0] == second
+    assert queue.claim("w3") is None
+    assert queue.job(first)["worker"] == "w1"
+    assert queue.job(first)["status"] == "running"
+
+
+def test_failed_job_is_retried_until_attempts_run_out(tmp_path, queue):
+    key = queue.submit(
+        "make_mp4", [write_file(tmp_path / "a.mp4"), "out"], maxAttempts=2
+    )
+    for attempt in range(2):
+        assert queue.claim("w")[0] == key
+        queue.fail(key, "w", "boom")
+    assert queue.claim("w") is None
+    job = queue.job(key)
+    assert (job["status"], job["attempts"], job["error"]) == ("failed", 2, "boom")
+
+    queue.retry_failed()
+    assert queue.claim("w")[0] == key
+
+
+def test_expired_lease_is_reclaimed(tmp_path):
+    queue = vt.RenderQueue(str(tmp_path / "queue.sqlite"), leaseSeconds=0.01)
+    key = queue.submit("make_mp4", [write_file(tmp_path / "a.mp4"), "out"])
+    assert queue.claim("dead worker")[0] == key
+    time.sleep(0.05)
+    assert queue.claim("w2")[0] == key
+    assert queue.job(key)["attempts"] == 2
+
+
+def test_expired_lease_respects_max_attempts(tmp_path):
+    queue = vt.RenderQueue(str(tmp_path / "queue.sqlite"), leaseSeconds=0.01)
+    key = queue.submit(
+        "make_mp4", [write_file(tmp_path / "a.mp4"), "out"], maxAttempts=2
+    )
+    for attempt in range(2):
+        assert queue.claim("crashing worker")[0] == key
+        time.sleep(0.05)
+    assert queue.claim("w") is None
+    assert queue.job(key)["status"] == "failed"
+    assert queue.counts() == {"queued": 0, "running": 0, "done": 0, "failed": 1}
+
+
+def test_complete_stores_result(tmp_path, queue):
+    key = queue.submit("make_mp4", [write_file(tmp_path / "a.mp4"), "out"])
+    queue.claim("w")
+    assert queue.complete(key, "w", result=[1, 2], metrics={"jobs": 1})
+    job = queue.job(key)
+    assert (job["status"], job["result"], job["metrics"]) == (
+        "done",
+        [1, 2],
+        {"jobs": 1},
+    )
+    assert queue.claim("w") is None
+
+
+def test_worker_runs_job_and_records_failure(tmp_path, queue):
+    vt.RENDER_OPS["test_op"] = lambda path: open(path, "w").write("made")
+    vt.RENDER_OP_INPUTS["test_op"] = lambda a: []
+    try:
+        good = queue.submit("test_op", [str(tmp_path / "made.txt")])
+        bad = queue.submit(
+            "test_op", [str(tmp_path / "missing" / "x.txt")], maxAttempts=1
+        )
+        worker = vt.RenderWorker(queue, name="w", manifest=str(tmp_path / "m.json"))
+        worker.run(idleTimeout=0, pollInterval=0.01)
+    finally:
+        del vt.RENDER_OPS["test_op"]
+        del vt.RENDER_OP_INPUTS["test_op"]
+    assert queue.job(good)["status"] == "done"
+    assert queue.job(bad)["status"] == "failed"
+    assert "FileNotFoundError" in queue.job(bad)["error"]
+
+
+def test_stale_worker_cant_record_outcome(tmp_path):
+    queue = vt.RenderQueue(str(tmp_path / "queue.sqlite"), leaseSeconds=0.01)
+    key = queue.submit("make_mp4", [write_file(tmp_path / "a.mp4"), "out"])
+    assert queue.claim("slow worker")[0] == key
+    time.sleep(0.05)
+    assert queue.claim("w2")[0] == key
+
+    # The slow worker finishing or failing doesn't change the new owner's job
+    assert not queue.complete(key, "slow worker", result="late")
+    assert not queue.fail(key, "slow worker", "late error")
+    assert not queue.renew(key, "slow worker")
+    job = queue.job(key)
+    assert (job["status"], job["worker"], job["result"]) == ("running", "w2", None)
+
+    assert queue.renew(key, "w2")
+    assert queue.complete(key, "w2", result="made")
+    assert queue.job(key)["result"] == "made"
+    # Once done, the job can't be completed or failed again
+    assert not queue.fail(key, "w2", "late error")
+    assert queue.job(key)["status"] == "done"
+
+
+def test_worker_renews_lease_during_long_job(tmp_path):
+    queue = vt.RenderQueue(str(tmp_path / "queue.sqlite"), leaseSeconds=0.1)
+    vt.RENDER_OPS["test_sleep"] = lambda seconds: time.sleep(seconds)
+    vt.RENDER_OP_INPUTS["test_sleep"] = lambda a: []
+    try:
+        key = queue.submit("test_sleep", [0.4])
+        worker = vt.RenderWorker(queue, name="w", manifest=str(tmp_path / "m.json"))
+        claimed = queue.claim("w")
+        # Another worker tries to take the job while it runs
+        thief = []
+        timer = threading.Timer(0.25, lambda: thief.append(queue.claim("thief")))
+        timer.start()
+        assert worker.run_job(*claimed)
+        timer.join()
+    finally:
+        del vt.RENDER_OPS["test_sleep"]
+        del vt.RENDER_OP_INPUTS["test_sleep"]
+    assert thief == [None]
+    job = queue.job(key)
+    assert (job["status"], job["worker"], job["attempts"]) == ("done", "w", 1)
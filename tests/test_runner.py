@@ -0,0 +1,133 @@
+import json
+import os
+import stat
+
+import videotools as vt
+
+PROGRESS = """frame=10
+fps=0.0
+out_time_us=400000
+speed=N/A
+progress=continue
+frame=50
+fps=25.5
+out_time_us=2000000
+speed=1.5x
+progress=end
+"""
+
+
+def fake_ffmpeg(tmp_path, stdout, returnCode=0):
+    """Executable that ignores its arguments, prints stdout and exits."""
+    script = tmp_path / "fake_ffmpeg"
+    (tmp_path / "stdout.txt").write_text(stdout)
+    script.write_text(
+        "#!/bin/sh\ncat '{}'\nexit {}\n".format(tmp_path / "stdout.txt", returnCode)
+    )
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    return str(script)
+
+
+def test_progress_reports_fill_in_stats(tmp_path):
+    stats = []
+    reports = []
+    runner = vt.FFmpegRunner(sinks=[stats.append], onProgress=reports.append)
+    command = [fake_ffmpeg(tmp_path, PROGRESS), "-i", "a.mp4", "b.mp4"]
+    assert runner.run(command, ["b.mp4"], label="test") == 0
+
+    assert [r["frame"] for r in reports] == ["10", "50"]
+    assert len(stats) == 1
+    s = stats[0]
+    # The command is reported without the -progress options
+    assert (s.label, s.command, s.outputs, s.returnCode) == (
+        "test",
+        command,
+        ["b.mp4"],
+        0,
+    )
+    assert (s.frames, s.fps, s.speed, s.outTime) == (50, 25.5, 1.5, 2.0)
+    assert s.wallTime > 0
+    assert s.cpuUser is not None and s.maxRSS
+
+
+def test_progress_options_are_added_unless_writing_to_stdout():
+    runner = vt.FFmpegRunner(progress=True)
+    assert runner.progress_command(["ffmpeg", "-i", "a.mp4", "b.mp4"]) == (
+        ["ffmpeg", "-progress", "pipe:1", "-nostats", "-i", "a.mp4", "b.mp4"],
+        True,
+    )
+    command = ["ffmpeg", "-i", "a.mp4", "-f", "rawvideo", "pipe:1"]
+    assert runner.progress_command(command) == (command, False)
+    assert vt.FFmpegRunner().progress_command(command[:3]) == (command[:3], False)
+
+
+def test_incomplete_progress_report_is_ignored(tmp_path):
+    stats = []
+    runner = vt.FFmpegRunner(sinks=[stats.append])
+    command = [fake_ffmpeg(tmp_path, "frame=5\nfps=12\n", returnCode=3), "b.mp4"]
+    assert runner.run(command, ["b.mp4"], check=False) == 3
+    assert (stats[0].returnCode, stats[0].frames, stats[0].fps) == (3, None, None)
+
+
+def test_fps_from_frames_when_ffmpeg_reports_none():
+    stats = vt.FFmpegJobStats("test", ["ffmpeg"], wallTime=2.0)
+    vt.FFmpegRunner().report(stats, {"frame": "60", "fps": "0.0"})
+    assert stats.fps == 30.0
+
+
+def test_json_lines_sink(tmp_path):
+    path = str(tmp_path / "logs" / "jobs.jsonl")
+    sink = vt.JsonLinesSink(path)
+    sink(vt.FFmpegJobStats("make_mp4", ["ffmpeg"], ["a.mp4"], wallTime=1.5))
+    sink(vt.FFmpegJobStats("make_webm", ["ffmpeg"], returnCode=1, frames=10))
+    lines = [json.loads(line) for line in open(path)]
+    assert [(l["label"], l["returnCode"], l["frames"]) for l in lines] == [
+        ("make_mp4", 0, None),
+        ("make_webm", 1, 10),
+    ]
+    assert lines[0]["outputs"] == ["a.mp4"] and "time" in lines[0]
+
+
+def test_prometheus_sink_keeps_totals_per_label(tmp_path):
+    path = str(tmp_path / "videotools.prom")
+    sink = vt.PrometheusTextfileSink(path, prefix="vt")
+    sink(
+        vt.FFmpegJobStats(
+            "make_mp4",
+            ["ffmpeg"],
+            wallTime=1.5,
+            cpuUser=2.0,
+            cpuSystem=0.5,
+            frames=100,
+            maxRSS=1000,
+        )
+    )
+    sink(vt.FFmpegJobStats("make_mp4", ["ffmpeg"], returnCode=1, wallTime=0.5))
+    sink(vt.FFmpegJobStats("make_webm", ["ffmpeg"], skipped=True))
+    lines = open(path).read().splitlines()
+    assert "# TYPE vt_jobs_total counter" in lines
+    assert "# TYPE vt_max_rss_bytes gauge" in lines
+    for line in [
+        'vt_jobs_total{label="make_mp4"} 2',
+        'vt_jobs_total{label="make_webm"} 1',
+        'vt_failures_total{label="make_mp4"} 1',
+        'vt_skipped_total{label="make_webm"} 1',
+        'vt_wall_seconds_total{label="make_mp4"} 2.0',
+        'vt_cpu_seconds_total{label="make_mp4"} 2.5',
+        'vt_frames_total{label="make_mp4"} 100',
+        'vt_max_rss_bytes{label="make_mp4"} 1000',
+    ]:
+        assert line in lines
+    assert not os.path.exists(path + ".tmp")
+
+
+def test_start_and_finish_report_a_process_with_its_own_pipes(tmp_path):
+    stats = []
+    runner = vt.FFmpegRunner(sinks=[stats.append])
+    running = runner.start(
+        [fake_ffmpeg(tmp_path, "raw frames")], label="decode", stdout=vt.sp.PIPE
+    )
+    assert running.proc.stdout.read() == b"raw frames"
+    running.proc.stdout.close()
+    assert runner.finish(running) is stats[0]
+    assert (stats[0].label, stats[0].returnCode, stats[0].frames) == ("decode", 0, None)
@@ -0,0 +1,52 @@
+import pytest
+
+import videotools as vt
+
+
+def test_side_by_side_variants_share_one_decode(runner):
+    outputs = {"NN": "nn.mp4", "RN": "rn.mp4", "NR": "nr.mp4"}
+    vt.make_side_by_side_variants("l.mp4", "r.mp4", outputs, whichAudio="right")
+    [command] = runner.commands
+    assert command[:6] == ["ffmpeg", "-y", "-i", "l.mp4", "-i", "r.mp4"]
+    filterStr = command[command.index("-filter_complex") + 1]
+    assert filterStr == (
+        "[0:v]setpts=PTS-STARTPTS,split=3[l0][l1][l2];"
+        "[1:v]setpts=PTS-STARTPTS,split=3[r0][r1][r2];"
+        "[l0]pad=iw*3:ih:color=white[a0];[r0]null[z0];[a0][z0]{overlay}[out0];"
+        "[l1]hflip,pad=iw*3:ih:color=white[a1];[r1]null[z1];[a1][z1]{overlay}[out1];"
+        "[l2]pad=iw*3:ih:color=white[a2];[r2]hflip[z2];[a2][z2]{overlay}[out2]"
+    ).format(overlay="overlay=x=2*w:repeatlast=1:shortest=1:eof_action=repeat")
+    assert command[command.index("error") + 1 :] == [
+        "-map",
+        "[out0]",
+        "-map",
+        "1:a:0",
+        "nn.mp4",
+        "-map",
+        "[out1]",
+        "-map",
+        "1:a:0",
+        "rn.mp4",
+        "-map",
+        "[out2]",
+        "-map",
+        "1:a:0",
+        "nr.mp4",
+    ]
+
+
+def test_single_side_by_side_variant_without_overwrite(runner):
+    vt.make_side_by_side_variants("l.mp4", "r.mp4", {"RR": "rr.mp4"}, overwrite=False)
+    [command] = runner.commands
+    assert "-y" not in command
+    filterStr = command[command.index("-filter_complex") + 1]
+    assert filterStr.startswith(
+        "[0:v]setpts=PTS-STARTPTS[l0];[1:v]setpts=PTS-STARTPTS[r0];"
+        "[l0]hflip,pad=iw*3:ih:color=white[a0];[r0]hflip[z0];"
+    )
+    assert command[-3:] == ["-map", "[out0]", "rr.mp4"]
+
+
+def test_side_by_side_rejects_unknown_variant(runner):
+    with pytest.raises(ValueError):
+        vt.make_side_by_side_variants("l.mp4", "r.mp4", {"NX": "nx.mp4"})
@@ -0,0 +1,59 @@
+import pytest
+
+import videotools as vt
+from conftest import write_file
+
+
+ORDER = {"event": 0, "outcome": 1, "object": 2, "camera": 3, "background": 4}
+
+
+def test_parse_video_filename():
+    assert vt.parse_video_filename("fall_near_duck_c1_b2.mp4", ORDER) == (
+        "fall",
+        "near",
+        "duck",
+        "c1",
+        "b2",
+    )
+    # Extra parts are ignored, and the order dict picks positions
+    order = {"object": 0, "event": 1, "outcome": 2, "background": 3, "camera": 4}
+    assert vt.parse_video_filename("duck_fall_near_b2_c1_take3", order) == (
+        "fall",
+        "near",
+        "duck",
+        "c1",
+        "b2",
+    )
+    with pytest.raises(ValueError):
+        vt.parse_video_filename("fall_near.mp4", ORDER)
+    with pytest.raises(ValueError):
+        vt.parse_video_filename("fall_near_duck_c1_b2.mp4", {"event": 0})
+
+
+def test_stimulus_index_lookup_and_groupby(tmp_path):
+    names = [
+        "fall_near_duck_c1_b1.mp4",
+        "fall_next_duck_c1_b1.mp4",
+        "fall_near_book_c1_b1.mp4",
+        "stay_near_duck_c2_b1.mov",
+    ]
+    for name in names:
+        write_file(tmp_path / name)
+    write_file(tmp_path / "notes.txt")
+    (tmp_path / "subdir.mp4").mkdir()
+    with pytest.warns(UserWarning):
+        write_file(tmp_path / "badname.mp4")
+        index = vt.StimulusIndex(str(tmp_path), ORDER)
+
+    assert len(index) == 4
+    assert index.unparsed == ["badname.mp4"]
+    ducks = index.lookup(event="fall", object="duck")
+    assert [r.outcome for r in ducks] == ["near", "next"]
+    assert ducks[0].path == str(tmp_path / "fall_near_duck_c1_b1.mp4")
+    assert index.lookup(event="roll") == []
+
+    groups = index.groupby("event", "object")
+    assert sorted(groups) == [("fall", "book"), ("fall", "duck"), ("stay", "duck")]
+    assert len(groups[("fall", "duck")]) == 2
+    with pytest.raises(ValueError):
+        index.groupby("colour")
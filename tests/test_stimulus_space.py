@@ -0,0 +1,81 @@
+import itertools
+import os
+
+import pytest
+
+import videotools as vt
+
+
+def make_space():
+    space = vt.StimulusSpace(["event", "outcomes", "object"], "/stimuli", prefix="sbs_")
+    space.add_block(
+        event=["fall", "stay"],
+        outcomes=vt.ordered_pairs(["near", "next", "over"]),
+        object=["duck", "book"],
+    )
+    space.add_block(event=["roll"], outcomes=[("up", "down")], object=["ball"])
+    return space
+
+
+def test_space_names_and_paths():
+    space = make_space()
+    first = space[0]
+    assert first.name == "sbs_fall_near_next_duck"
+    assert first.path == os.path.join("/stimuli", "sbs_fall_near_next_duck.mp4")
+    assert first.factors == {
+        "event": "fall",
+        "outcomes": ("near", "next"),
+        "object": "duck",
+    }
+
+
+def test_space_len_and_indexing_match_iteration():
+    space = make_space()
+    expected = [
+        ("fall", o, obj)
+        for o in vt.ordered_pairs(["near", "next", "over"])
+        for obj in ["duck", "book"]
+    ]
+    expected = (
+        [("fall",) + e[1:] for e in expected]
+        + [("stay",) + e[1:] for e in expected]
+        + [("roll", ("up", "down"), "ball")]
+    )
+    allSpecs = list(space)
+    assert len(space) == len(expected) == 25
+    assert [tuple(s.factors.values()) for s in allSpecs] == expected
+    # Mixed-radix indexing agrees with itertools.product order in every block
+    assert [space[i] for i in range(len(space))] == allSpecs
+    assert space[-1] == allSpecs[-1]
+    assert space[3:9] == allSpecs[3:9]
+    assert space[::5] == allSpecs[::5]
+    with pytest.raises(IndexError):
+        space[len(space)]
+
+
+def test_space_shards_cover_space_once():
+    space = make_space()
+    shards = [list(space.shard(i, 4)) for i in range(4)]
+    assert list(itertools.chain(*shards)) == list(space)
+    assert max(map(len, shards)) - min(map(len, shards)) <= 1
+    with pytest.raises(ValueError):
+        space.shard(4, 4)
+
+
+def test_space_restrict_is_lazy_and_filters_levels():
+    space = make_space()
+    restricted = space.restrict(event=["stay", "roll"], object=lambda o: o != "duck")
+    assert len(restricted) == 7
+    assert all(s.factors["object"] != "duck" for s in restricted)
+    assert {s.factors["event"] for s in restricted} == {"stay", "roll"}
+    assert len(space.restrict(object=["nothing"])) == 0
+    with pytest.raises(ValueError):
+        space.restrict(colour=["red"])
+
+
+def test_space_block_must_give_every_factor():
+    space = vt.StimulusSpace(["event", "object"])
+    with pytest.raises(ValueError):
+        space.add_block(event=["fall"])
+    with pytest.raises(ValueError):
+        space.add_block(event=["fall"], object=["duck"], colour=["red"])
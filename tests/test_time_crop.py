@@ -0,0 +1,8 @@
+import videotools as vt
+
+
+def test_fade_filter_uses_times():
+    assert vt.fade_filter(10, "white", 5.0, 25.0) == (
+        "fade=type=in:st=0.04:d=0.4:color=white,"
+        "fade=type=out:st=4.6:d=0.4:color=white"
+    )
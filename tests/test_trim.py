@@ -0,0 +1,91 @@
+import pytest
+
+import videotools as vt
+
+KEYFRAMES = [0.0, 2.0, 4.0, 6.0, 8.0]
+
+
+@pytest.fixture
+def tenSeconds(monkeypatch):
+    """A 10 s, 30 fps video with a keyframe every 2 s."""
+    monkeypatch.setattr(
+        vt,
+        "get_video_details",
+        lambda vidPath, whichAttr, useCache=True, method="auto": [10.0, 30.0],
+    )
+    monkeypatch.setattr(vt, "get_keyframe_times", lambda vidPath: KEYFRAMES)
+
+
+def trim(runner, *args, **kwargs):
+    kept = vt.trim_video("in.mp4", "out.mp4", *args, **kwargs)
+    [command] = runner.commands
+    inputArgs = command[1 : command.index("-i")]
+    copied = command[command.index("in.mp4") + 1 :][:2] == ["-c", "copy"]
+    return (kept, inputArgs, copied)
+
+
+@pytest.mark.parametrize(
+    ("start", "end", "inputArgs", "kept"),
+    [
+        (2.0, 6.0, ["-ss", "2.0", "-t", "4.0"], (2.0, 6.0)),
+        # To the end of the video, which needn't be a keyframe
+        (4.0, -1, ["-ss", "4.0"], (4.0, 10.0)),
+        (4.0, 9.99, ["-ss", "4.0"], (4.0, 10.0)),
+        # Within half a frame of a keyframe
+        (2.01, 5.99, ["-ss", "2.0", "-t", "4.0"], (2.0, 6.0)),
+    ],
+)
+def test_trim_on_keyframes_copies_streams(
+    runner, tenSeconds, start, end, inputArgs, kept
+):
+    assert trim(runner, start, end) == (kept, inputArgs, True)
+
+
+def test_trim_off_keyframes_reencodes_accurately(runner, tenSeconds):
+    (kept, args, copied) = trim(runner, 3.0, 5.0)
+    assert not copied
+    assert args == ["-ss", "3.0", "-t", "2.0"]
+    assert kept == (3.0, 5.0)
+
+
+def test_trim_needs_both_ends_on_keyframes_to_copy(runner, tenSeconds):
+    (kept, args, copied) = trim(runner, 2.0, 5.0)
+    assert not copied
+    assert kept == (2.0, 5.0)
+
+
+def test_trim_snaps_out_to_keyframes(runner, tenSeconds):
+    (kept, args, copied) = trim(runner, 3.0, 5.0, snap=True)
+    assert copied
+    assert args == ["-ss", "2.0", "-t", "4.0"]
+    assert kept == (2.0, 6.0)
+
+
+def test_inaccurate_trim_seeks_to_keyframe(runner, tenSeconds):
+    (kept, args, copied) = trim(runner, 3.0, 5.0, accurate=False)
+    assert not copied
+    assert args == ["-noaccurate_seek", "-ss", "3.0", "-t", "2.0"]
+
+
+def test_trim_rejects_empty_range(runner, tenSeconds):
+    for (start, end) in [(5.0, 5.0), (-1.0, 3.0), (10.0, -1)]:
+        with pytest.raises(ValueError, match="Invalid trim"):
+            vt.trim_video("in.mp4", "out.mp4", start, end)
+    assert runner.commands == []
+
+
+def test_keyframe_times_are_from_the_start_of_the_video(monkeypatch):
+    probes = {
+        "keyframes": {
+            "frames": [
+                {"pts_time": "1.5"},
+                {"best_effort_timestamp_time": "0.5"},
+                {"pkt_size": "10"},
+            ]
+        },
+        "streams": {"format": {"start_time": "0.5"}, "streams": []},
+    }
+    monkeypatch.setattr(
+        vt, "probe_video", lambda vidPath, kind="streams", useCache=True: probes[kind]
+    )
+    assert vt.get_keyframe_times("in.mp4") == [0.0, 1.0]
@@ -0,0 +1,145 @@
+import asyncio
+import os
+
+import videotools as vt
+from conftest import fake_probe, write_file
+
+
+def test_existing_output_kept_without_overwrite(tmp_path, runner):
+    source = write_file(tmp_path / "a.mp4")
+    write_file(tmp_path / "out" / "a_compressed.mp4")
+    vt.make_mp4(source, str(tmp_path / "out"), overwrite=False)
+    assert runner.commands == []
+
+
+def test_manifest_rebuilds_stale_output_without_overwrite(tmp_path, runner):
+    source = write_file(tmp_path / "a.mp4")
+    outpath = write_file(tmp_path / "out" / "a_compressed.mp4")
+    vt.set_build_manifest(vt.BuildManifest(str(tmp_path / "manifest.json")))
+
+    # Not in the manifest, so remade (with -y, as the output exists)
+    vt.make_mp4(source, str(tmp_path / "out"), overwrite=False)
+    assert len(runner.commands) == 1
+    assert runner.commands[0][:2] == ["ffmpeg", "-y"]
+    assert runner.commands[0][-1] == outpath
+
+    # Now up to date
+    vt.make_mp4(source, str(tmp_path / "out"), overwrite=False)
+    assert len(runner.commands) == 1
+
+
+def test_web_exports_manifest_rebuilds_stale_outputs(tmp_path, runner, monkeypatch):
+    monkeypatch.setattr(vt, "has_stream", lambda path, codecType: False)
+    source = write_file(tmp_path / "a.mp4")
+    for ext in ["mp4", "webm"]:
+        write_file(tmp_path / "out" / ("a_compressed." + ext))
+    assert vt.make_web_exports(source, str(tmp_path / "out"), overwrite=False)
+    assert runner.commands == []
+
+    vt.set_build_manifest(vt.BuildManifest(str(tmp_path / "manifest.json")))
+    vt.make_web_exports(source, str(tmp_path / "out"), overwrite=False)
+    assert len(runner.commands) == 1
+    assert (
+        os.path.join(str(tmp_path / "out"), "a_compressed.webm") in runner.commands[0]
+    )
+
+
+def test_overwrite_adds_y(tmp_path, runner, monkeypatch):
+    monkeypatch.setattr(vt, "has_stream", lambda path, codecType: True)
+    source = write_file(tmp_path / "a.mp4")
+    outDir = str(tmp_path / "out")
+    vt.make_mp4(source, outDir)
+    vt.make_webm(source, outDir)
+    vt.make_web_exports(source, outDir)
+    assert len(runner.commands) == 3
+    assert all(command[:2] == ["ffmpeg", "-y"] for command in runner.commands)
+
+    runner.commands.clear()
+    vt.make_web_exports(source, outDir, overwrite=False)
+    assert runner.commands[0][:2] == ["ffmpeg", "-i"]
+
+
+def test_prep_mp4_and_webm_overwrites_without_prompting(tmp_path, runner, monkeypatch):
+    monkeypatch.setattr(vt, "probe_video", fake_probe())
+    for name in ["a.mp4", "b.mov", "notes.txt"]:
+        write_file(tmp_path / "videos" / name)
+    write_file(tmp_path / "videos" / "mp4" / "a_compressed.mp4")
+    vt.prep_mp4_and_webm(str(tmp_path / "videos"), jobs=2)
+    assert len(runner.commands) == 2
+    assert all(command[:2] == ["ffmpeg", "-y"] for command in runner.commands)
+
+
+def test_make_dummies_overwrite(tmp_path, runner):
+    blank = write_file(tmp_path / "blank.mp4")
+    outDir = str(tmp_path / "dummies")
+    write_file(tmp_path / "dummies" / "b.mp4")
+    vt.make_dummies(outDir, blank, ["a", "b", "c"], labelsPerProcess=2, jobs=2)
+    assert len(runner.commands) == 2
+    assert all(command[:2] == ["ffmpeg", "-y"] for command in runner.commands)
+
+    runner.commands.clear()
+    vt.make_dummies(outDir, blank, ["a", "b", "c"], labelsPerProcess=2, overwrite=False)
+    outputs = [
+        arg for command in runner.commands for arg in command if arg.endswith(".mp4")
+    ]
+    assert outputs == [
+        blank,
+        os.path.join(outDir, "a.mp4"),
+        blank,
+        os.path.join(outDir, "c.mp4"),
+    ]
+
+
+def test_async_exports_forward_overwrite(tmp_path, monkeypatch):
+    source = write_file(tmp_path / "in" / "a.mov")
+    outDir = str(tmp_path / "out")
+    write_file(os.path.join(outDir, "a_compressed.mp4"))
+    calls = []
+
+    async def fake_arun_ffmpeg(command, outputs, **kwargs):
+        calls.append(kwargs.get("overwrite", False))
+        return 0
+
+    monkeypatch.setattr(vt, "arun_ffmpeg", fake_arun_ffmpeg)
+    monkeypatch.setattr(vt, "probe_video", fake_probe())
+    asyncio.run(vt.amake_mp4(source, outDir))
+    asyncio.run(vt.amake_web_exports(source, outDir, overwrite=True))
+    asyncio.run(vt.amake_mp4(source, outDir, overwrite=False))
+    assert calls == [True, True]
+
+
+def test_web_exports_scale_once_per_width_and_split(tmp_path, runner, monkeypatch):
+    monkeypatch.setattr(vt, "has_stream", lambda path, codecType: True)
+    source = write_file(tmp_path / "a.mp4")
+    outDir = str(tmp_path / "out")
+    targets = [
+        {"format": "mp4"},
+        {"format": "webm"},
+        {"format": "mp4", "width": 320, "suffix": "_small"},
+    ]
+    outpaths = vt.make_web_exports(source, outDir, targets)
+    [command] = runner.commands
+    assert command[command.index("-filter_complex") + 1].split(";") == [
+        "[0:v]split=2[w0][w1]",
+        "[w0]null,split=2[v0_0][v0_1]",
+        "[w1]scale=320:-2[v1_0]",
+        "[0:a]asplit=3[a0][a1][a2]",
+    ]
+    mapped = [
+        (command[i + 1], command[i + 3])
+        for (i, arg) in enumerate(command)
+        if arg == "-map" and command[i + 1].startswith("[v")
+    ]
+    assert mapped == [("[v0_0]", "[a0]"), ("[v0_1]", "[a1]"), ("[v1_0]", "[a2]")]
+    assert [arg for arg in command if arg.startswith(outDir)] == outpaths
+
+
+def test_single_web_export_needs_no_split(tmp_path, runner, monkeypatch):
+    monkeypatch.setattr(vt, "has_stream", lambda path, codecType: False)
+    source = write_file(tmp_path / "a.mp4")
+    vt.make_web_exports(
+        source, str(tmp_path / "out"), [{"format": "webm", "width": 200}]
+    )
+    [command] = runner.commands
+    assert command[command.index("-filter_complex") + 1] == "[0:v]scale=200:-2[v0_0]"
+    assert command.count("-map") == 1
@@ -1,36 +1,146 @@
 import os
+import re
+import sys
 import subprocess as sp
 import math
 import errno
 import warnings
 import shlex
 import json
+import hashlib
+import sqlite3
+import time
+import threading
+import socket
+import tempfile
+import asyncio
+import weakref
+import itertools
+import operator
+import contextvars
+import inspect
+import signal
+import atexit
+import contextlib
+from collections import namedtuple
+from functools import lru_cache, reduce
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import wait as _wait_futures
+from dataclasses import dataclass, field, asdict
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
 
 ORIGEXT = [".mov", ".mp4"]
 VIDEXT = ".mp4"
 
+# Where ffprobe results are cached between runs; override with the environment
+# variable VIDEOTOOLS_PROBE_CACHE or by calling set_probe_cache.
+PROBE_CACHE_PATH = os.environ.get(
+    "VIDEOTOOLS_PROBE_CACHE",
+    os.path.join(os.path.expanduser("~"), ".cache", "videotools", "probe_cache.sqlite"),
+)
+
+# ffprobe arguments for each kind of probe we cache. "streams" only reads headers;
+# "count_packets" reads (but does not decode) every packet; "count_frames" decodes
+# the whole file to count frames, so only use it if needed.
+# The stream probes include a hash of each stream's codec extradata (e.g. H.264
+# SPS/PPS), which must match for concat_mp4s to join videos without re-encoding
+PROBE_KINDS = {
+    "streams": "ffprobe -v quiet -show_format -print_format json -show_streams -show_data_hash md5",
+    "count_packets": "ffprobe -v quiet -show_format -print_format json -show_streams -show_data_hash md5 -count_packets",
+    "count_frames": "ffprobe -v quiet -show_format -print_format json -show_streams -show_data_hash md5 -count_frames",
+    # Decodes only the keyframes of the first video stream, to list their times
+    "keyframes": "ffprobe -v quiet -print_format json -select_streams v:0 -skip_frame nokey "
+    + "-show_entries frame=pts_time,best_effort_timestamp_time",
+}
+
+# Which probe is needed to count frames with each get_video_details method
+FRAME_COUNT_KINDS = {
+    "auto": "streams",
+    "fast": "streams",
+    "packets": "count_packets",
+    "exact": "count_frames",
+}
+
+
 def makeSideBySide(leftVideoPath, rightVideoPath, whichAudio, outputPath):
     """Simple utility for making paired left/right video for Halie :) 
     Each video takes up 1/3 of horizontal space, should be same size.
     whichAudio should be "left" or "right" to use audio from left or right video."""
-    audioChoice = "0" if whichAudio == "left" else "1"
-    sp.call(
-        [
-            "ffmpeg",
-            "-i",
-            leftVideoPath,
-            "-i",
-            rightVideoPath,
-            "-filter_complex",
-            """[0:v]setpts=PTS-STARTPTS,pad=iw*3:ih:color=white[a];[1:v]setpts=PTS-STARTPTS[z];[a][z]overlay=x=2*w:repeatlast=1:shortest=1:eof_action=repeat[out]""",
-            """-map""",
-            """[out]""",
-            """-map""",
-            audioChoice + ":a:0",
-            "-loglevel",
-            "error",
-            outputPath,
-        ]
+    return make_side_by_side_variants(
+        leftVideoPath, rightVideoPath, {"NN": outputPath}, whichAudio
+    )
+
+
+def make_side_by_side_variants(
+    leftVideoPath, rightVideoPath, outputs, whichAudio=None, overwrite=True
+):
+    """Make several flipped versions of a left/right video with one ffmpeg process.
+
+    Arguments:
+    leftVideoPath, rightVideoPath - full paths to the videos to put on the left and
+        right. As in makeSideBySide, each takes up 1/3 of horizontal space, and they
+        should be the same size.
+    outputs - dict mapping variants to the full paths of the videos to make. A
+        variant is two characters, for the left and right video in turn: N for
+        normal or R for reversed (flipped horizontally), e.g. 'NN', 'RN', 'NR', 'RR'.
+
+    Keyword arguments:
+    whichAudio - "left" or "right" to use audio from left or right video, or None
+        for no audio.
+    overwrite - whether to overwrite output videos that already exist.
+
+    Each input is decoded once and split between all the variants."""
+
+    variants = list(outputs.keys())
+    for variant in variants:
+        if len(variant) != 2 or any(c not in "NR" for c in variant):
+            raise ValueError("Unrecognized side-by-side variant {}".format(variant))
+    nOut = len(variants)
+
+    if nOut > 1:
+        filterStr = (
+            "[0:v]setpts=PTS-STARTPTS,split={}".format(nOut)
+            + "".join("[l{}]".format(i) for i in range(nOut))
+            + ";[1:v]setpts=PTS-STARTPTS,split={}".format(nOut)
+            + "".join("[r{}]".format(i) for i in range(nOut))
+            + ";"
+        )
+    else:
+        filterStr = "[0:v]setpts=PTS-STARTPTS[l0];[1:v]setpts=PTS-STARTPTS[r0];"
+
+    for (i, variant) in enumerate(variants):
+        leftFlip = "hflip," if variant[0] == "R" else ""
+        rightFlip = "hflip" if variant[1] == "R" else "null"
+        filterStr = filterStr + (
+            "[l{i}]{lf}pad=iw*3:ih:color=white[a{i}];[r{i}]{rf}[z{i}];"
+            + "[a{i}][z{i}]overlay=x=2*w:repeatlast=1:shortest=1:eof_action=repeat"
+            + "[out{i}];"
+        ).format(i=i, lf=leftFlip, rf=rightFlip)
+
+    command = [
+        "ffmpeg",
+        "-i",
+        leftVideoPath,
+        "-i",
+        rightVideoPath,
+        "-filter_complex",
+        filterStr[:-1],
+        "-loglevel",
+        "error",
+    ]
+    for (i, variant) in enumerate(variants):
+        command = command + ["-map", "[out{}]".format(i)]
+        if whichAudio:
+            audioChoice = "0" if whichAudio == "left" else "1"
+            command = command + ["-map", audioChoice + ":a:0"]
+        command = command + [outputs[variant]]
+
+    return run_ffmpeg(
+        command, [outputs[v] for v in variants], check=False, overwrite=overwrite
     )
 
 
@@ -44,413 +154,2973 @@ def make_sure_path_exists(path):
             raise
 
 
-def make_mp4(inputpath, mp4dir, width="original", overwrite=True, rate=1000):
-    """Export an mp4 version of a video for the web.
-    
-    Arguments:
-    inputpath - the full path to the video file to export
-    mp4dir - the directory where the new file should go
-    
-    Keyword arguments:
-    width - either 'original' to keep width of input file, or width in pixels
-    
-    The mp4 version will have the same filename as the input video + '_compressed',
-    with an mp4 extension. Aspect ratio is preserved if changing width."""
+class BuildManifest:
+    """Record of how each output file was made, used to skip work that is up to date.
 
-    (shortname, ext) = os.path.splitext(os.path.basename(inputpath))
-    command = [
-        "ffmpeg",
-        "-i",
-        inputpath,
-        "-c:v",
-        "libx264",
-        "-preset",
-        "slow",
-        "-b:v",
-        str(rate) + "k",
-        "-maxrate",
-        str(rate) + "k",
-        "-bufsize",
-        str(2 * rate) + "k",
-        "-c:a",
-        "libfdk_aac",
-        "-b:a",
-        "128k",
-    ]
-    if not (width == "original"):
-        command = command + ["-vf", "scale=" + str(width) + ":-2"]
+    For each output, the manifest stores the exact ffmpeg argument vector (or list of
+    vectors) used to make it, fingerprints of its input files (see file_fingerprint)
+    and a fingerprint of the output itself. An output is up to date if all of these
+    still match: changing an input, a parameter, or the output file itself causes
+    it to be rebuilt.
 
-    outpath = os.path.join(mp4dir, shortname + "_compressed.mp4")
-    if not (overwrite) and os.path.exists(outpath):
-        return
-    else:
-        sp.check_call(command + [outpath])
+    The manifest is saved as JSON at path. Rewriting it for every output would
+    make large builds slow, so changes are saved at most every saveInterval
+    seconds, at the end of a batch() block, on flush(), and when Python exits. If
+    the process is killed first, the outputs made since the last save are just
+    remade next time."""
 
+    def __init__(self, path, hashContent=False, saveInterval=5.0):
+        self.path = path
+        self.hashContent = hashContent
+        self.saveInterval = saveInterval
+        self._lock = threading.Lock()
+        self._unsaved = False
+        self._lastSave = 0.0
+        self._batches = 0
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+        else:
+            self.entries = {}
 
-def make_webm(inputpath, webmdir, width="original", overwrite=True, rate=1000):
-    """Export an webm version of a video for the web.
-    
-    Arguments:
-    inputpath - the full path to the video file to export
-    webmdir - the directory where the new file should go
-    
-    Keyword arguments:
-    width - either 'original' to keep width of input file, or width in pixels
-    
-    The webm version will have the same filename as the input video + '_compressed',
-    with an webm extension. Aspect ratio is preserved if changing width."""
+    def _fingerprints(self, paths):
+        return {
+            os.path.abspath(p): list(file_fingerprint(p, self.hashContent))
+            for p in paths
+        }
 
-    (shortname, ext) = os.path.splitext(os.path.basename(inputpath))
-    command = [
-        "ffmpeg",
-        "-i",
-        inputpath,
-        "-c:v",
-        "libvpx",
-        "-b:v",
-        str(rate) + "k",
-        "-maxrate",
-        str(rate) + "k",
-        "-bufsize",
-        str(2 * rate) + "k",
-        "-c:a",
-        "libvorbis",
-        "-b:a",
-        "128k",
-        "-speed",
-        "2",
-    ]
-    if not (width == "original"):
-        command = command + ["-vf", "scale=" + str(width) + ":-2"]
-    outpath = os.path.join(webmdir, shortname + "_compressed.webm")
-    if not (overwrite) and os.path.exists(outpath):
-        return
-    else:
-        sp.check_call(command + [outpath])
+    def is_fresh(self, recipe, inputs, outputs):
+        """Whether outputs were made by recipe from inputs as they are now."""
+        try:
+            inputPrints = self._fingerprints(inputs)
+            outputPrints = self._fingerprints(outputs)
+        except OSError:
+            return False
+        with self._lock:
+            for output in outputs:
+                entry = self.entries.get(os.path.abspath(output))
+                if entry is None or entry["recipe"] != json.loads(json.dumps(recipe)):
+                    return False
+                if entry["inputs"] != inputPrints:
+                    return False
+                if entry["output"] != outputPrints[os.path.abspath(output)]:
+                    return False
+        return True
 
+    def record(self, recipe, inputs, outputs):
+        """Note that outputs have just been made by recipe from inputs."""
+        inputPrints = self._fingerprints(inputs)
+        outputPrints = self._fingerprints(outputs)
+        with self._lock:
+            for output in outputs:
+                self.entries[os.path.abspath(output)] = {
+                    "recipe": recipe,
+                    "inputs": inputPrints,
+                    "output": outputPrints[os.path.abspath(output)],
+                }
+            self._unsaved = True
+            _unsavedManifests.add(self)
+            if not self._batches and time.time() - self._lastSave >= self.saveInterval:
+                self._save()
 
-def prep_mp4_and_webm(inputpath, width="original", overwrite=True):
-    """Export all video files in a directory to both webm and mp4 for the web.
-    
-    Arguments:
-    inputpath - the video directory to process
-    
-    Keyword arguments:
-    width - either 'original' to keep width of input file, or width in pixels (applied to 
-        all files)
-    
-    mp4 and webm versions will have the same filenames as the originals, but appropriate
-    extensions. Aspect ratio is preserved if changing width."""
+    @contextlib.contextmanager
+    def batch(self):
+        """Context manager that holds back saving until the block ends, e.g. around
+        a whole build."""
+        with self._lock:
+            self._batches += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._batches -= 1
+            if not self._batches:
+                self.flush()
 
-    if not (os.path.isdir(inputpath)):
-        raise ValueError("prep_mp4_and_webm requires a path to a directory with videos")
+    def flush(self):
+        """Save any changes not saved yet."""
+        with self._lock:
+            if self._unsaved:
+                self._save()
 
-    (parent, child) = os.path.split(inputpath)
-    webmdir = os.path.join(parent, child, "webm")
-    mp4dir = os.path.join(parent, child, "mp4")
+    def save(self):
+        """Save the manifest now."""
+        with self._lock:
+            self._save()
 
-    make_sure_path_exists(webmdir)
-    make_sure_path_exists(mp4dir)
+    def _save(self):
+        if os.path.dirname(self.path):
+            make_sure_path_exists(os.path.dirname(self.path))
+        tmpPath = self.path + ".tmp"
+        with open(tmpPath, "w") as f:
+            json.dump(self.entries, f, indent=1)
+        os.replace(tmpPath, self.path)
+        self._unsaved = False
+        self._lastSave = time.time()
+        _unsavedManifests.discard(self)
 
-    videoExts = [".mov", ".mp4", ".flv", ".webm", ".ogv", ".avi"]
-    for f in os.listdir(inputpath):
-        if not (os.path.isdir(os.path.join(inputpath, f))):
-            (shortname, ext) = os.path.splitext(f)
-            if ext in videoExts:
-                make_mp4(os.path.join(inputpath, f), mp4dir, width, overwrite)
-                make_webm(os.path.join(inputpath, f), webmdir, width, overwrite)
 
+# Manifests with changes not saved yet, which are saved when Python exits
+_unsavedManifests = set()
 
-def make_collage(
-    videoDir,
-    videoList,
-    nCols,
-    outPath,
-    doSound,
-    exportWidth,
-    vidHeight=[],
-    cropSquare=False,
-):
-    """Make a grid of videos (mp4 format).
-    
-    Arguments:
-    videoDir - directory where the input videos are (use '/' to just give full paths 
-        in videoList
-    videoList - list of videos to include in the grid. They will appear in reading order.
-        Videos should all be the same size! (But any aspect ratio is fine.)
-    nCols - number of columns for the grid. The number of rows will be set accordingly.
-    outPath - where to put the collage (full path and filename, excluding extension)
-    doSound - boolean, whether to include sound in the collage. 
-    exportWidth - 0 not to export, otherwise width in pixels of mp4 & webm to create
-    
-    If doing sound, this creates a few temporary files in the same directory as the final 
-    collage, named (if the final output is collage.mp4) collage_silent.mp4 and 
-    collage_sound.wav.
-    
-    Sizes of input videos is unchanged, so final collage size is (originalWidth * nCols) x 
-    (originalHeight * nRows). """
 
-    if doSound:
-        (outPathDir, outPathFname) = os.path.split(outPath)
-        outPathSilent = os.path.join(outPathDir, outPathFname + "_silent.mp4")
-        outPathSound = os.path.join(outPathDir, outPathFname + ".wav")
-    else:
-        outPathSilent = outPath + ".mp4"
+@atexit.register
+def _flush_manifests():
+    for manifest in list(_unsavedManifests):
+        manifest.flush()
 
-    outPath = outPath + ".mp4"
 
-    # Step 1: make a silent collage
+_buildManifest = None
 
-    nRows = int(math.ceil(len(videoList) / nCols))
 
-    inputList = []
-    for (iV, vidName) in enumerate(videoList):
-        inputList = inputList + ["-i", os.path.join(videoDir, vidName)]
+def set_build_manifest(manifest):
+    """Turn on incremental builds, using a BuildManifest or path to a manifest file.
 
-    command = ["ffmpeg"] + inputList
+    While a manifest is set, videotools functions skip any ffmpeg command whose
+    outputs are up to date according to the manifest (even if overwrite=True), and
+    otherwise overwrite stale outputs. Set to None to turn incremental builds off."""
+    global _buildManifest
+    if isinstance(manifest, str):
+        manifest = BuildManifest(manifest)
+    _buildManifest = manifest
 
-    border = 10
-    # In general, use 'ih' and 'h'; if heights vary, input here.
-    if vidHeight:
-        vidHeight = str(vidHeight)
-        vidHeightOverlay = vidHeight
-    else:
-        vidHeight = "ih"
-        vidHeightOverlay = "h"
-
-
-    filterStr = (
-        "[0:v]pad="
-        + str(border * (nCols - 1))
-        + "+"
-        + "iw*"
-        + str(nCols)
-        + ":"
-        + str(border * (nRows - 1))
-        + "+"
-        + vidHeight
-        + "*"
-        + str(nRows)
-        + "[x0];"
-    )
-    for iVid in range(1, len(videoList)):
-        if iVid == (len(videoList) - 1):
-            outStr = "[out]"
-        else:
-            outStr = "[x" + str(iVid) + "]"
-
-        thisY = iVid // nCols
-        thisX = iVid % nCols
-
-        if cropSquare:
-            filterStr = (
-                filterStr
-                + "["
-                + str(iVid)
-                + ":v]crop=iw:iw:0:0[y"
-                + str(iVid - 1)
-                + "];"
-            )
-
-            filterStr = (
-                filterStr
-                + "[x"
-                + str(iVid - 1)
-                + "][y"
-                + str(iVid - 1)
-                + "]overlay=x="
-                + str(border * (thisX))
-                + "+("
-                + str(thisX)
-                + "*w):y="
-                + str(border * (thisY))
-                + "+("
-                + str(thisY)
-                + "*"
-                + vidHeightOverlay
-                + "):repeatlast=1:shortest=0:eof_action=repeat"
-                + outStr
-                + ";"
-            )
-        else:
-            filterStr = (
-                filterStr
-                + "[x"
-                + str(iVid - 1)
-                + "]["
-                + str(iVid)
-                + ":v]overlay=x="
-                + str(border * (thisX))
-                + "+("
-                + str(thisX)
-                + "*w):y="
-                + str(border * (thisY))
-                + "+("
-                + str(thisY)
-                + "*"
-                + vidHeightOverlay
-                + "):repeatlast=1:shortest=0:eof_action=repeat"
-                + outStr
-                + ";"
-            )
-
-    command = command + [
-        "-filter_complex",
-        filterStr[:-1],
-        "-c:v",
-        "libx264",
-        "-map",
-        "[out]",
-        outPathSilent,
-    ]
 
-    sp.check_call(command)
+def get_build_manifest():
+    """Return the BuildManifest in use, or None if incremental builds are off."""
+    return _buildManifest
 
-    if doSound:
 
-        # Step 2: make sound mix
+def command_inputs(command):
+    """Files read by an ffmpeg command, i.e. the arguments to -i that are files."""
+    return [
+        command[iArg + 1]
+        for iArg in range(len(command) - 1)
+        if command[iArg] == "-i" and os.path.isfile(command[iArg + 1])
+    ]
 
-        filterStr = (
-            "amix=inputs="
-            + str(len(videoList))
-            + ":duration=first:dropout_transition=3"
-        )
 
-        command = ["ffmpeg"] + inputList + ["-filter_complex", filterStr, outPathSound]
+@dataclass
+class FFmpegJobStats:
+    """Measurements of one ffmpeg or ffprobe process, passed to FFmpegRunner sinks.
 
-        sp.check_call(command)
+    label: name of the stage that ran the command, by default the videotools
+        function that called run_ffmpeg
+    wallTime: seconds from starting the process until it exited
+    cpuUser, cpuSystem: CPU seconds used by the process (None if not available)
+    maxRSS: peak resident memory of the process in bytes (None if not available)
+    frames, fps, speed, outTime: from ffmpeg's -progress report: frames encoded,
+        encoding rate in frames per second, output seconds per wall-clock second,
+        and seconds of output written. None if there was no progress report.
+    skipped: whether the command wasn't run because its outputs were up to date"""
 
-        command = [
-            "ffmpeg",
-            "-i",
-            outPathSilent,
-            "-i",
-            outPathSound,
-            "-c:v",
-            "copy",
-            "-c:a",
-            "libfdk_aac",
-            "-shortest",
-            outPath,
-        ]
-        sp.check_call(command)
+    label: str
+    command: list
+    outputs: list = field(default_factory=list)
+    returnCode: int = 0
+    wallTime: float = 0.0
+    cpuUser: float = None
+    cpuSystem: float = None
+    maxRSS: int = None
+    frames: int = None
+    fps: float = None
+    speed: float = None
+    outTime: float = None
+    skipped: bool = False
 
-        # Clean up intermediate files
 
-        sp.call(["rm", outPathSilent])
-        sp.call(["rm", outPathSound])
+class JsonLinesSink:
+    """FFmpegRunner sink that appends each FFmpegJobStats to a file as a line of JSON."""
 
-    if exportWidth != 0:
-        (exportDir, baseFilename) = os.path.split(outPath)
-        exportDir = os.path.join(exportDir, "export")
-        make_sure_path_exists(exportDir)
-        make_mp4(outPath, exportDir, exportWidth, rate=2000)
-        make_webm(outPath, exportDir, exportWidth, rate=2000)
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            make_sure_path_exists(os.path.dirname(path))
 
+    def __call__(self, stats):
+        line = json.dumps(dict(asdict(stats), time=time.time()))
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(line + "\n")
 
-def make_dummies(outDir, blankVideoPath, vidNames):
-    """Make blank labeled videos.
-    
-    outDir: directory to put the blank videos in
-    blankVideoPath: full path to the mp4 video to use as the starting point
-    vidNames: array of video filenames (no extension). One mp4 video will be created for 
-        each; it will just be the blank video with the vidName written on it. """
 
-    make_sure_path_exists(outDir)
+class PrometheusTextfileSink:
+    """FFmpegRunner sink that keeps totals per label in a Prometheus textfile.
 
-    for vidName in vidNames:
+    The file is rewritten after every job, for node_exporter's textfile collector.
+    Metrics (each with a label="..." label): <prefix>_jobs_total,
+    <prefix>_failures_total, <prefix>_skipped_total, <prefix>_wall_seconds_total,
+    <prefix>_cpu_seconds_total, <prefix>_frames_total and <prefix>_max_rss_bytes."""
 
-        sp.call(
-            [
-                "ffmpeg",
-                "-i",
-                blankVideoPath,
-                "-ar",
-                "22050",
-                "-q:v",
-                "1",
-                "-vf",
-                "drawtext='fontfile=/Library/Fonts/Arial Black.ttf:text='"
-                + vidName
-                + "':fontsize=40:fontcolor=white:x=100:y=40'",
-                os.path.join(outDir, vidName),
-            ]
-        )
+    def __init__(self, path, prefix="videotools_ffmpeg"):
+        self.path = path
+        self.prefix = prefix
+        self.totals = {}
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            make_sure_path_exists(os.path.dirname(path))
 
+    def __call__(self, stats):
+        with self._lock:
+            totals = self.totals.setdefault(
+                stats.label,
+                {
+                    "jobs_total": 0,
+                    "failures_total": 0,
+                    "skipped_total": 0,
+                    "wall_seconds_total": 0.0,
+                    "cpu_seconds_total": 0.0,
+                    "frames_total": 0,
+                    "max_rss_bytes": 0,
+                },
+            )
+            totals["jobs_total"] += 1
+            totals["failures_total"] += int(stats.returnCode != 0)
+            totals["skipped_total"] += int(stats.skipped)
+            totals["wall_seconds_total"] += stats.wallTime
+            totals["cpu_seconds_total"] += (stats.cpuUser or 0) + (stats.cpuSystem or 0)
+            totals["frames_total"] += stats.frames or 0
+            totals["max_rss_bytes"] = max(totals["max_rss_bytes"], stats.maxRSS or 0)
 
-# function to find the resolution of the input video file
-# http://stackoverflow.com/a/34356719
-def findVideoResolution(pathToInputVideo):
-    cmd = "ffprobe -v quiet -print_format json -show_streams"
-    args = shlex.split(cmd)
-    args.append(pathToInputVideo)
-    # run the ffprobe process, decode stdout into utf-8 & convert to JSON
-    ffprobeOutput = sp.check_output(args).decode("utf-8")
-    ffprobeOutput = json.loads(ffprobeOutput)
+            lines = []
+            for metric in totals:
+                name = self.prefix + "_" + metric
+                metricType = "gauge" if metric == "max_rss_bytes" else "counter"
+                lines.append("# TYPE {} {}".format(name, metricType))
+                for (label, values) in sorted(self.totals.items()):
+                    lines.append(
+                        '{}{{label="{}"}} {}'.format(name, label, values[metric])
+                    )
+            tmpPath = self.path + ".tmp"
+            with open(tmpPath, "w") as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(tmpPath, self.path)
 
-    # find height and width
-    height = ffprobeOutput["streams"][0]["height"]
-    width = ffprobeOutput["streams"][0]["width"]
 
-    return height, width
+@dataclass
+class RunningProcess:
+    """A process started with FFmpegRunner.start, to be passed to
+    FFmpegRunner.finish once the caller is done with its pipes.
 
+    proc: the subprocess.Popen object
+    command, outputs, label: as reported in the process's FFmpegJobStats"""
 
-def concat_mp4s(concatPath, vidPaths):
-    """Concatenate a list of mp4s into a single new mp4, video only.
+    proc: object
+    command: list
+    outputs: list
+    label: str
+    startTime: float
+    childrenBefore: object = None
 
-    concatPath: full path to the desired new mp4 file, including
-        extension 
-    vidPaths: full paths to the videos to concatenate. 
-    
-    Videos will be concatenated in the order they appear in this list."""
 
-    concat = ["ffmpeg"]
-    inputList = ""
+class FFmpegRunner:
+    """Runs ffmpeg and ffprobe processes and reports how long and how hard they worked.
 
-    # If there are no files to concat, immediately return 0.
-    if not len(vidPaths):
-        return 0
+    sinks: list of functions that are each called with an FFmpegJobStats after every
+        process, e.g. JsonLinesSink, PrometheusTextfileSink or any callback
+    progress: whether to add -progress pipe:1 -nostats to ffmpeg commands to measure
+        frames, fps and speed. ffmpeg then no longer prints its status line. Default
+        is to do so if there are any sinks.
+    onProgress: optional function called with a dict of each -progress report
+        (keys such as frame, fps, out_time_us, speed) while ffmpeg runs
 
-    # Build the concatenate command
-    for (iVid, vid) in enumerate(vidPaths):
-        concat = concat + ["-i", vid]
-        inputList = inputList + "[{}:v:0]".format(iVid)
+    CPU time and peak memory are measured for each process with os.wait4. Where
+    that's not available, resource.getrusage(RUSAGE_CHILDREN) is used, which is only
+    accurate when one process runs at a time; on Windows they are not measured.
 
-    # Concatenate the videos. See https://trac.ffmpeg.org/wiki/Concatenate (concat filter)
-    # for more information about concatenation options and other approaches
-    concat = concat + [
-        "-filter_complex",
-        inputList + "concat=n={}:v=1:a=0".format(len(vidPaths)) + "[out]",
-        "-map",
-        "[out]",
-        concatPath,
-        "-loglevel",
-        "error",
-        "-c:v",
-        "libx264",
-        "-preset",
-        "slow",
-        "-b:v",
-        "1000k",
-        "-maxrate",
-        "1000k",
-        "-bufsize",
-        "2000k",
-    ]
+    All videotools functions run ffmpeg through the runner set with
+    set_ffmpeg_runner. Most use run and output; those that handle a process's
+    pipes themselves use start, kill and finish, and the async functions use
+    progress_command, progress_line and report. A custom runner can override any
+    of these public methods."""
 
-    sp.call(concat)
+    def __init__(self, sinks=None, progress=None, onProgress=None):
+        self.sinks = list(sinks or [])
+        self.progress = bool(self.sinks or onProgress) if progress is None else progress
+        self.onProgress = onProgress
 
+    def report(self, stats, progress=None):
+        """Pass stats to the sinks, first filling in frames, fps, speed and outTime
+        from progress, the last complete -progress report (if any)."""
+        if progress:
+            stats.frames = _progress_number(progress.get("frame"), int)
+            stats.fps = _progress_number(progress.get("fps"), float)
+            stats.speed = _progress_number(progress.get("speed", "").rstrip("x"), float)
+            outTime = _progress_number(progress.get("out_time_us"), int)
+            stats.outTime = outTime / 1e6 if outTime is not None else None
+            # ffmpeg's fps is an average over the whole run; prefer frames / wall
+            # time when ffmpeg finished too fast to report it
+            if not stats.fps and stats.frames and stats.wallTime:
+                stats.fps = stats.frames / stats.wallTime
+        for sink in self.sinks:
+            sink(stats)
 
-# function to find the resolution of the input video file
-# http://stackoverflow.com/a/34356719
-def get_video_details(vidPath, whichAttr):
-    """Uses ffprobe to retrieve details about a video.
+    def progress_command(self, command):
+        """(command to run, whether it reports progress on stdout).
 
-    get_video_details(vidPath, whichAttr)
+        If progress is on, ffmpeg is asked to write -progress reports to stdout;
+        pass each line of them to progress_line."""
+        # Don't mix progress reports into a video being written to stdout
+        progress = self.progress and not any(
+            arg in ("-", "pipe:", "pipe:1") for arg in command
+        )
+        if progress:
+            command = command[:1] + ["-progress", "pipe:1", "-nostats"] + command[1:]
+        return (command, progress)
 
-    vidPath: full path to video file
+    def progress_line(self, line, report):
+        """Add a line of -progress output to the dict report, calling onProgress
+        once a report is complete. Returns whether it's complete."""
+        (key, sep, value) = line.strip().partition("=")
+        if not sep:
+            return False
+        report[key] = value
+        if key == "progress" and self.onProgress is not None:
+            self.onProgress(report)
+        return key == "progress"
 
-    whichAttr: single attribute or list of attributes to retrieve. Options are:
+    def start(self, command, outputs=(), label="ffmpeg", **popenArgs):
+        """Start a process whose pipes the caller handles itself (popenArgs are
+        passed to subprocess.Popen). Returns a RunningProcess to pass to finish.
+
+        Unless popenArgs give stdin, it is /dev/null, so that ffmpeg can't stop to
+        ask a question (e.g. whether to overwrite an output) or read keys typed
+        into the terminal."""
+        popenArgs.setdefault("stdin", sp.DEVNULL)
+        childrenBefore = None
+        if resource is not None and not hasattr(os, "wait4"):
+            childrenBefore = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return RunningProcess(
+            sp.Popen(command, **popenArgs),
+            list(command),
+            list(outputs),
+            label,
+            time.time(),
+            childrenBefore,
+        )
+
+    def kill(self, running):
+        """Kill a process from start, leaving it for finish to wait for and measure.
+
+        (Popen.kill can reap a process that has already exited, after which finish
+        could no longer measure it.)"""
+        if hasattr(os, "wait4"):
+            # A process that has exited but not been waited for can still be
+            # signalled, so this can't hit another process that reused its pid
+            os.kill(running.proc.pid, signal.SIGKILL)
+        else:
+            running.proc.kill()
+
+    def finish(self, running, progress=None):
+        """Wait for a process from start to exit, measure it and report it (see
+        report). Returns its FFmpegJobStats."""
+        (proc, childrenBefore) = (running.proc, running.childrenBefore)
+        stats = FFmpegJobStats(running.label, running.command, running.outputs)
+        # ru_maxrss is in kilobytes, except on macOS where it's in bytes
+        rssUnit = 1 if sys.platform == "darwin" else 1024
+        if hasattr(os, "wait4"):
+            (pid, status, usage) = os.wait4(proc.pid, 0)
+            if os.WIFSIGNALED(status):
+                proc.returncode = -os.WTERMSIG(status)
+            else:
+                proc.returncode = os.WEXITSTATUS(status)
+            stats.cpuUser = usage.ru_utime
+            stats.cpuSystem = usage.ru_stime
+            stats.maxRSS = usage.ru_maxrss * rssUnit
+        else:
+            proc.wait()
+            if resource is not None and childrenBefore is not None:
+                # Peak memory here is the largest of any child process so far
+                after = resource.getrusage(resource.RUSAGE_CHILDREN)
+                stats.cpuUser = after.ru_utime - childrenBefore.ru_utime
+                stats.cpuSystem = after.ru_stime - childrenBefore.ru_stime
+                stats.maxRSS = after.ru_maxrss * rssUnit
+        stats.wallTime = time.time() - running.startTime
+        stats.returnCode = proc.returncode
+        self.report(stats, progress)
+        return stats
+
+    def run(self, command, outputs=(), label="ffmpeg", check=True):
+        """Run an ffmpeg command, measuring it.
+
+        Raises subprocess.CalledProcessError if check and ffmpeg fails; otherwise
+        returns the return code."""
+
+        (runCommand, progress) = self.progress_command(command)
+        latest = {}
+        if progress:
+            running = self.start(
+                runCommand, outputs, label, stdout=sp.PIPE, universal_newlines=True
+            )
+            report = {}
+            for line in running.proc.stdout:
+                if self.progress_line(line, report):
+                    (latest, report) = (report, {})
+            running.proc.stdout.close()
+        else:
+            running = self.start(runCommand, outputs, label)
+        # Report the command as given, without the -progress options
+        running.command = list(command)
+
+        stats = self.finish(running, latest)
+        if check and stats.returnCode:
+            raise sp.CalledProcessError(stats.returnCode, command)
+        return stats.returnCode
+
+    def output(self, command, label="ffprobe"):
+        """Run a command such as ffprobe, measuring it, and return its stdout.
+
+        Raises subprocess.CalledProcessError if the command fails."""
+        running = self.start(command, label=label, stdout=sp.PIPE)
+        out = running.proc.stdout.read()
+        running.proc.stdout.close()
+        stats = self.finish(running)
+        if stats.returnCode:
+            raise sp.CalledProcessError(stats.returnCode, command, output=out)
+        return out
+
+    def skipped(self, command, outputs, label="ffmpeg"):
+        """Report a command that wasn't run because its outputs were up to date."""
+        self.report(FFmpegJobStats(label, list(command), list(outputs), skipped=True))
+
+
+def _progress_number(value, kind):
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        return None
+
+
+_ffmpegRunner = FFmpegRunner()
+
+
+def set_ffmpeg_runner(runner):
+    """Set the FFmpegRunner used by all videotools functions. None restores the
+    default, which doesn't report anything."""
+    global _ffmpegRunner
+    _ffmpegRunner = runner if runner is not None else FFmpegRunner()
+
+
+def get_ffmpeg_runner():
+    """Return the FFmpegRunner in use."""
+    return _ffmpegRunner
+
+
+def run_ffmpeg(
+    command,
+    outputs,
+    inputs=None,
+    check=True,
+    incremental=True,
+    overwrite=False,
+    label=None,
+):
+    """Run an ffmpeg command, skipping it if its outputs are up to date.
+
+    command: full argument list, starting with "ffmpeg"
+    outputs: paths of the files the command makes
+    inputs: paths of the files the command reads. Defaults to the files given
+        with -i in command.
+    check: whether to raise subprocess.CalledProcessError if ffmpeg fails; otherwise
+        its return code is returned
+    incremental: whether to use the build manifest (see set_build_manifest), if
+        one is set
+    overwrite: whether to pass -y so that ffmpeg overwrites existing outputs
+        without asking. Functions with an overwrite argument pass it on here. -y is
+        always passed while a build manifest is set, so stale outputs are rebuilt
+        whatever overwrite is, and functions that keep existing outputs still remake
+        them when out of date. ffmpeg's stdin is /dev/null (see FFmpegRunner.start),
+        so processes running at once never wait for an answer either way.
+    label: name for this step in the runner's stats (see FFmpegRunner). Defaults
+        to the name of the calling function.
+
+    The command is run by the current FFmpegRunner (see set_ffmpeg_runner). If
+    check is False and ffmpeg fails, a warning is given.
+
+    Returns 0 if the command was skipped, otherwise the ffmpeg return code."""
+
+    manifest = get_build_manifest() if incremental else None
+    if inputs is None:
+        inputs = command_inputs(command)
+
+    if label is None:
+        label = sys._getframe(1).f_code.co_name
+    runner = get_ffmpeg_runner()
+
+    if manifest is not None and manifest.is_fresh(command, inputs, outputs):
+        runner.skipped(command, outputs, label)
+        return 0
+
+    # Stale outputs are rebuilt without ffmpeg prompting before overwriting
+    if overwrite or manifest is not None:
+        runCommand = command[:1] + ["-y"] + command[1:]
+    else:
+        runCommand = command
+
+    returnCode = runner.run(runCommand, outputs, label, check=check)
+    if returnCode:
+        warnings.warn(
+            "ffmpeg exited with code {} making {}".format(returnCode, outputs)
+        )
+
+    if manifest is not None and returnCode == 0:
+        manifest.record(command, inputs, outputs)
+    return returnCode
+
+
+def can_use_fifos():
+    """Whether named pipes (os.mkfifo) are available, e.g. not on Windows."""
+    return hasattr(os, "mkfifo")
+
+
+def fifo_path(outPath, name):
+    """Path for a named pipe carrying an intermediate stream for outPath.
+
+    Pipes go in the local temporary directory (not next to outPath, which may be on
+    a network filesystem), and are named after outPath so that the commands using
+    them are the same every time, as the build manifest needs. run_pipeline makes
+    each pipe in a new private directory instead (see _make_fifos), so pipelines
+    for the same outPath can run at once."""
+    digest = hashlib.sha256(os.path.abspath(outPath).encode("utf-8")).hexdigest()
+    return os.path.join(
+        tempfile.gettempdir(), "videotools-{}-{}".format(digest[:16], name)
+    )
+
+
+def _unblock_fifos(fifos):
+    """Open the other end of each named pipe briefly, so that a process stuck
+    opening one (because the process at the other end has died) can carry on."""
+    for path in fifos:
+        for flags in [os.O_RDONLY | os.O_NONBLOCK, os.O_WRONLY | os.O_NONBLOCK]:
+            try:
+                os.close(os.open(path, flags))
+            except OSError:
+                pass
+
+
+def _make_fifos(commands, fifos):
+    """Make the named pipes for one run of a pipeline in a new private temporary
+    directory, and point the commands at them.
+
+    Returns (commands, fifos, fifoDir) with each path in fifos replaced by the
+    pipe made for it, wherever it is an argument of a command."""
+    fifoDir = tempfile.mkdtemp(prefix="videotools-")
+    pipes = {
+        path: os.path.join(fifoDir, "{}-{}".format(iPipe, os.path.basename(path)))
+        for (iPipe, path) in enumerate(fifos)
+    }
+    for pipe in pipes.values():
+        os.mkfifo(pipe)
+    commands = [[pipes.get(arg, arg) for arg in command] for command in commands]
+    return (commands, list(pipes.values()), fifoDir)
+
+
+def _remove_fifos(fifos, fifoDir):
+    for path in fifos:
+        if os.path.lexists(path):
+            os.remove(path)
+    os.rmdir(fifoDir)
+
+
+def run_pipeline(commands, outputs, fifos, inputs=None, incremental=True):
+    """Run ffmpeg commands connected by named pipes, all at the same time.
+
+    commands: list of ffmpeg commands; earlier ones typically write to pipes that
+        later ones read from. Each command's last argument is its output.
+    outputs: paths of the final files made
+    fifos: paths of the named pipes the commands use (see fifo_path). Each run
+        makes its own pipes in a new temporary directory, in place of these paths,
+        and removes them afterwards.
+    inputs: files read, as for run_ffmpeg (default: -i arguments that are files)
+    incremental: whether to skip the pipeline if the build manifest says outputs
+        are up to date with respect to the whole list of commands
+
+    Intermediate streams never touch the disk, and later stages start work as soon
+    as earlier ones produce data. Streams written to pipes need a format that
+    doesn't seek back, e.g. -f nut or -f wav. The last command makes the outputs;
+    earlier commands may be cut off once it has read all it needs (e.g. because
+    of -shortest). If any command fails before then, subprocess.CalledProcessError
+    is raised once the others have stopped."""
+
+    manifest = get_build_manifest() if incremental else None
+    if inputs is None:
+        inputs = [i for command in commands for i in command_inputs(command)]
+    if manifest is not None and manifest.is_fresh(commands, inputs, outputs):
+        return 0
+
+    (runCommands, pipes, fifoDir) = _make_fifos(commands, fifos)
+
+    def run_step(command):
+        # -y since each pipe already exists when ffmpeg opens it for writing
+        try:
+            run_ffmpeg(
+                command,
+                [command[-1]],
+                incremental=False,
+                overwrite=True,
+                label="run_pipeline",
+            )
+        except sp.CalledProcessError as e:
+            return (time.time(), e)
+        return (time.time(), None)
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(commands)) as pool:
+            futures = [pool.submit(run_step, command) for command in runCommands]
+            remaining = set(futures)
+            while remaining:
+                (done, remaining) = _wait_futures(remaining, timeout=0.5)
+                if futures[-1].done() or any(
+                    f.result()[1] for f in futures if f.done()
+                ):
+                    _unblock_fifos(pipes)
+            results = [f.result() for f in futures]
+    finally:
+        _remove_fifos(pipes, fifoDir)
+
+    # Earlier commands stop with a broken pipe if the last one finishes before
+    # reading everything (e.g. with -shortest), which is fine
+    (finishTime, error) = results[-1]
+    if error is None:
+        errors = [e for (t, e) in results[:-1] if e is not None and t < finishTime]
+        error = errors[0] if errors else None
+    if error is not None:
+        raise error
+
+    if manifest is not None:
+        manifest.record(commands, inputs, outputs)
+    return 0
+
+
+def web_codec_args(fmt, rate=1000):
+    """ffmpeg output options for encoding a web video.
+
+    fmt: "mp4" (x264 + AAC) or "webm" (VP8 + Vorbis)
+    rate: video bitrate in kbps"""
+    rateArgs = [
+        "-b:v",
+        str(rate) + "k",
+        "-maxrate",
+        str(rate) + "k",
+        "-bufsize",
+        str(2 * rate) + "k",
+    ]
+    if fmt == "mp4":
+        return (
+            ["-c:v", "libx264", "-preset", "slow"]
+            + rateArgs
+            + ["-c:a", "libfdk_aac", "-b:a", "128k"]
+        )
+    elif fmt == "webm":
+        return (
+            ["-c:v", "libvpx"]
+            + rateArgs
+            + ["-c:a", "libvorbis", "-b:a", "128k", "-speed", "2"]
+        )
+    else:
+        raise ValueError("Unrecognized web video format {}".format(fmt))
+
+
+def web_export_command(
+    fmt, inputpath, outdir, width="original", rate=1000, threads=None
+):
+    """ffmpeg command used by make_mp4 and make_webm, and the path it writes to.
+
+    Returns (command, outpath)."""
+    (shortname, ext) = os.path.splitext(os.path.basename(inputpath))
+    command = ["ffmpeg", "-i", inputpath] + web_codec_args(fmt, rate)
+    if not (width == "original"):
+        command = command + ["-vf", "scale=" + str(width) + ":-2"]
+    if threads:
+        command = command + ["-threads", str(threads)]
+    outpath = os.path.join(outdir, shortname + "_compressed." + fmt)
+    return (command + [outpath], outpath)
+
+
+def make_mp4(
+    inputpath, mp4dir, width="original", overwrite=True, rate=1000, threads=None
+):
+    """Export an mp4 version of a video for the web.
+    
+    Arguments:
+    inputpath - the full path to the video file to export
+    mp4dir - the directory where the new file should go
+    
+    Keyword arguments:
+    width - either 'original' to keep width of input file, or width in pixels
+    overwrite - whether to remake the mp4 version if it already exists (see run_ffmpeg)
+    threads - number of threads ffmpeg may use, or None to let ffmpeg decide
+    
+    The mp4 version will have the same filename as the input video + '_compressed',
+    with an mp4 extension. Aspect ratio is preserved if changing width."""
+
+    (command, outpath) = web_export_command(
+        "mp4", inputpath, mp4dir, width, rate, threads
+    )
+    # With a manifest, run_ffmpeg decides whether an existing output is stale
+    if not (overwrite) and os.path.exists(outpath) and get_build_manifest() is None:
+        return
+    else:
+        run_ffmpeg(command, [outpath], overwrite=overwrite)
+
+
+def make_webm(
+    inputpath, webmdir, width="original", overwrite=True, rate=1000, threads=None
+):
+    """Export an webm version of a video for the web.
+    
+    Arguments:
+    inputpath - the full path to the video file to export
+    webmdir - the directory where the new file should go
+    
+    Keyword arguments:
+    width - either 'original' to keep width of input file, or width in pixels
+    overwrite - whether to remake the webm version if it already exists (see run_ffmpeg)
+    threads - number of threads ffmpeg may use, or None to let ffmpeg decide
+    
+    The webm version will have the same filename as the input video + '_compressed',
+    with an webm extension. Aspect ratio is preserved if changing width."""
+
+    (command, outpath) = web_export_command(
+        "webm", inputpath, webmdir, width, rate, threads
+    )
+    # With a manifest, run_ffmpeg decides whether an existing output is stale
+    if not (overwrite) and os.path.exists(outpath) and get_build_manifest() is None:
+        return
+    else:
+        run_ffmpeg(command, [outpath], overwrite=overwrite)
+
+
+def make_web_exports(inputpath, outdir, targets=None, overwrite=True, threads=None):
+    """Export several web versions of a video with a single ffmpeg process.
+
+    The input is decoded once, scaled once per distinct width, and split between
+    the encoders for all targets, rather than being decoded and scaled separately
+    for each output as make_mp4 and make_webm do.
+
+    Arguments:
+    inputpath - the full path to the video file to export
+    outdir - the directory where the new files should go
+
+    Keyword arguments:
+    targets - list of dicts describing the versions to make, with keys
+        format - "mp4" or "webm"
+        width - either 'original' (default) to keep width of input file, or width
+            in pixels
+        rate - video bitrate in kbps (default 1000)
+        dir - directory for this version (default outdir)
+        suffix - added to the input filename (default '_compressed', or
+            '_compressed_<width>' if targets have different widths)
+        Default is one mp4 and one webm at the original width.
+    overwrite - whether to remake versions that already exist (see run_ffmpeg)
+    threads - number of threads ffmpeg may use, or None to let ffmpeg decide
+
+    Returns a list of paths to the exported versions."""
+
+    (outpaths, todo) = _web_export_targets(inputpath, outdir, targets, overwrite)
+    if not todo:
+        return outpaths
+    command = _web_exports_command(
+        inputpath, todo, has_stream(inputpath, "audio"), threads
+    )
+    run_ffmpeg(command, [outpath for (target, outpath) in todo], overwrite=overwrite)
+    return outpaths
+
+
+def _web_export_targets(inputpath, outdir, targets, overwrite):
+    """Output paths for make_web_exports targets: (all paths, [(target, path)] to make)."""
+    if targets is None:
+        targets = [{"format": "mp4"}, {"format": "webm"}]
+    (shortname, ext) = os.path.splitext(os.path.basename(inputpath))
+
+    widths = []
+    for target in targets:
+        if target.get("width", "original") not in widths:
+            widths.append(target.get("width", "original"))
+
+    outpaths = []
+    todo = []
+    for target in targets:
+        width = target.get("width", "original")
+        if "suffix" in target:
+            suffix = target["suffix"]
+        elif len(widths) > 1:
+            suffix = "_compressed_" + str(width)
+        else:
+            suffix = "_compressed"
+        outpath = os.path.join(
+            target.get("dir", outdir), shortname + suffix + "." + target["format"]
+        )
+        outpaths.append(outpath)
+        # With a manifest, run_ffmpeg decides whether existing outputs are stale
+        if overwrite or get_build_manifest() is not None or not os.path.exists(outpath):
+            todo.append((target, outpath))
+
+    return (outpaths, todo)
+
+
+def _web_exports_command(inputpath, todo, hasAudio, threads):
+    """The make_web_exports command making each (target, path) in todo."""
+    # Scale once per width, then split each scaled stream between its encoders
+    todoWidths = []
+    for (target, outpath) in todo:
+        if target.get("width", "original") not in todoWidths:
+            todoWidths.append(target.get("width", "original"))
+    filters = []
+    if len(todoWidths) > 1:
+        filters.append(
+            "[0:v]split={}".format(len(todoWidths))
+            + "".join("[w{}]".format(iW) for iW in range(len(todoWidths)))
+        )
+        widthLabels = ["[w{}]".format(iW) for iW in range(len(todoWidths))]
+    else:
+        widthLabels = ["[0:v]"]
+
+    videoLabels = {}
+    for (iW, width) in enumerate(todoWidths):
+        scale = "null" if width == "original" else "scale=" + str(width) + ":-2"
+        nOut = len([t for (t, o) in todo if t.get("width", "original") == width])
+        if nOut > 1:
+            labels = ["[v{}_{}]".format(iW, iOut) for iOut in range(nOut)]
+            filters.append(
+                widthLabels[iW] + scale + ",split={}".format(nOut) + "".join(labels)
+            )
+        else:
+            labels = ["[v{}_0]".format(iW)]
+            filters.append(widthLabels[iW] + scale + labels[0])
+        videoLabels[width] = labels
+
+    if hasAudio and len(todo) > 1:
+        audioLabels = ["[a{}]".format(iOut) for iOut in range(len(todo))]
+        filters.append("[0:a]asplit={}".format(len(todo)) + "".join(audioLabels))
+    elif hasAudio:
+        audioLabels = ["0:a"]
+
+    command = ["ffmpeg", "-i", inputpath, "-filter_complex", ";".join(filters)]
+    for (iOut, (target, outpath)) in enumerate(todo):
+        videoLabel = videoLabels[target.get("width", "original")].pop(0)
+        command = command + ["-map", videoLabel]
+        if hasAudio:
+            command = command + ["-map", audioLabels[iOut]]
+        command = command + web_codec_args(target["format"], target.get("rate", 1000))
+        if threads:
+            command = command + ["-threads", str(threads)]
+        command = command + [outpath]
+    return command
+
+
+CALIBRATION_POSITIONS = {"L": 0, "C": 1, "R": 2}
+
+
+def make_calibration_videos(
+    source,
+    outDir,
+    positions=("L", "R"),
+    orders=None,
+    size=640,
+    segmentDuration=5.0,
+    color="white",
+    targets=None,
+    overwrite=True,
+    threads=None,
+):
+    """Make calibration videos where an attention-getter appears in several positions in turn.
+
+    The source video is shown in a square of size x size pixels, placed in the left,
+    center, or right third of a 3*size x size frame, for segmentDuration seconds at
+    each position. The source is decoded once; every order and all web versions are
+    made from it by a single ffmpeg process.
+
+    Arguments:
+    source - full path to the attention-getter video (centered in its square; it
+        should be at most size x size pixels)
+    outDir - directory for the calibration videos, named calibration_<order>.mp4
+
+    Keyword arguments:
+    positions - positions to use, from 'L', 'C', 'R'
+    orders - list of orders to make, each a string or list of positions, e.g.
+        ['LR', 'RL']. Default is every permutation of positions.
+    size - width and height of each third of the frame, in pixels
+    segmentDuration - time spent at each position, in seconds
+    color - background color
+    targets - list of web versions to make of each video; see make_web_exports.
+        Default is an mp4 in outDir/mp4 and a webm in outDir/webm, like
+        prep_mp4_and_webm makes.
+    overwrite - whether to remake orders whose videos all already exist
+    threads - number of threads ffmpeg may use, or None to let ffmpeg decide
+
+    Returns a dict mapping each order (as a string) to the list of paths made for
+    it, starting with the full-quality video."""
+
+    for position in positions:
+        if position not in CALIBRATION_POSITIONS:
+            raise ValueError("Unrecognized calibration position {}".format(position))
+    if orders is None:
+        orders = itertools.permutations(positions)
+    orders = ["".join(order) for order in orders]
+    for order in orders:
+        if not order or any(position not in positions for position in order):
+            raise ValueError(
+                "Order {} uses positions not in {}".format(order, positions)
+            )
+    if targets is None:
+        targets = [
+            {"format": "mp4", "dir": os.path.join(outDir, "mp4")},
+            {"format": "webm", "dir": os.path.join(outDir, "webm")},
+        ]
+
+    outpaths = {}
+    for order in orders:
+        name = "calibration_" + order
+        outpaths[order] = [os.path.join(outDir, name + VIDEXT)] + [
+            os.path.join(
+                target.get("dir", outDir),
+                name + target.get("suffix", "_compressed") + "." + target["format"],
+            )
+            for target in targets
+        ]
+    todo = [
+        order
+        for order in orders
+        if overwrite or not all(os.path.exists(p) for p in outpaths[order])
+    ]
+    if not todo:
+        return outpaths
+    for path in itertools.chain(*(outpaths[order] for order in todo)):
+        make_sure_path_exists(os.path.dirname(path))
+
+    # Square version of the source, split between the positions used
+    usedPositions = [p for p in positions if any(p in order for order in todo)]
+    filters = [
+        "[0:v]trim=duration={},setpts=PTS-STARTPTS,".format(segmentDuration)
+        + "pad=width={0}:height={0}:x=(ow-iw)/2:y=(oh-ih)/2:color={1}".format(
+            size, color
+        )
+        + (
+            ",split={}".format(len(usedPositions))
+            + "".join("[s{}]".format(p) for p in usedPositions)
+            if len(usedPositions) > 1
+            else "[s{}]".format(usedPositions[0])
+        )
+    ]
+
+    # Full-width version for each position, split between the orders using it
+    segmentLabels = {}
+    for position in usedPositions:
+        nUses = sum(order.count(position) for order in todo)
+        labels = ["[{}{}]".format(position, iUse) for iUse in range(nUses)]
+        filters.append(
+            "[s{0}]pad=width=iw*3:height=ih:x=iw*{1}:y=0:color={2}".format(
+                position, CALIBRATION_POSITIONS[position], color
+            )
+            + (",split={}".format(nUses) if nUses > 1 else "")
+            + "".join(labels)
+        )
+        segmentLabels[position] = labels
+
+    # Concatenate each order, then split between the full-quality and web versions
+    outputArgs = []
+    for (iOrder, order) in enumerate(todo):
+        labels = ["[o{}_{}]".format(iOrder, iOut) for iOut in range(len(targets) + 1)]
+        filters.append(
+            "".join(segmentLabels[position].pop(0) for position in order)
+            + "concat=n={}:v=1:a=0".format(len(order))
+            + (",split={}".format(len(labels)) if len(labels) > 1 else "")
+            + "".join(labels)
+        )
+        outputArgs = outputArgs + ["-map", labels[0], outpaths[order][0]]
+        for (iTarget, target) in enumerate(targets):
+            label = labels[iTarget + 1]
+            width = target.get("width", "original")
+            if width != "original":
+                scaled = "[e{}_{}]".format(iOrder, iTarget)
+                filters.append(label + "scale=" + str(width) + ":-2" + scaled)
+                label = scaled
+            outputArgs = (
+                outputArgs
+                + ["-map", label]
+                + web_codec_args(target["format"], target.get("rate", 1000))
+                + (["-threads", str(threads)] if threads else [])
+                + [outpaths[order][iTarget + 1]]
+            )
+
+    command = (
+        ["ffmpeg", "-i", source, "-filter_complex", ";".join(filters)]
+        + ["-loglevel", "error"]
+        + outputArgs
+    )
+    run_ffmpeg(
+        command,
+        list(itertools.chain(*(outpaths[order] for order in todo))),
+        overwrite=True,
+    )
+    return outpaths
+
+
+def run_jobs(jobs, nJobs=1):
+    """Run a list of jobs, up to nJobs at a time.
+
+    jobs: list of (label, function) pairs. Each function is called with no arguments;
+        they are started in the order given.
+
+    Returns a list of (label, seconds) pairs giving the wall time of each job, in the
+    order jobs finished. Exceptions raised by a job are re-raised once all jobs that
+    have already started are done."""
+
+    def timed(job):
+        (label, func) = job
+        startTime = time.time()
+        func()
+        return (label, time.time() - startTime)
+
+    if nJobs <= 1:
+        return [timed(job) for job in jobs]
+
+    # Each job just waits on its own ffmpeg process(es), so threads are enough to
+    # keep nJobs encodes running at once.
+    with ThreadPoolExecutor(max_workers=nJobs) as pool:
+        futures = [pool.submit(timed, job) for job in jobs]
+        return [future.result() for future in as_completed(futures)]
+
+
+def prep_mp4_and_webm(
+    inputpath, width="original", overwrite=True, jobs=1, threads_per_job=None
+):
+    """Export all video files in a directory to both webm and mp4 for the web.
+    
+    Arguments:
+    inputpath - the video directory to process
+    
+    Keyword arguments:
+    width - either 'original' to keep width of input file, or width in pixels (applied to 
+        all files)
+    overwrite - whether to remake versions that already exist (see run_ffmpeg)
+    jobs - number of ffmpeg encodes to run at once
+    threads_per_job - threads each ffmpeg encode may use. Defaults to the number of
+        CPUs divided by jobs if running several jobs, so that they don't compete
+        for cores; if jobs is 1, ffmpeg decides.
+    
+    mp4 and webm versions will have the same filenames as the originals, but appropriate
+    extensions. Aspect ratio is preserved if changing width.
+
+    Encodes are started longest video first, so that a long video does not end up
+    running alone at the end. Returns a list of (input name, seconds) pairs giving
+    the wall time of each encode."""
+
+    if not (os.path.isdir(inputpath)):
+        raise ValueError("prep_mp4_and_webm requires a path to a directory with videos")
+
+    (parent, child) = os.path.split(inputpath)
+    webmdir = os.path.join(parent, child, "webm")
+    mp4dir = os.path.join(parent, child, "mp4")
+
+    make_sure_path_exists(webmdir)
+    make_sure_path_exists(mp4dir)
+
+    if threads_per_job is None and jobs > 1:
+        threads_per_job = max(1, (os.cpu_count() or 1) // jobs)
+
+    videoExts = [".mov", ".mp4", ".flv", ".webm", ".ogv", ".avi"]
+    vidPaths = []
+    for f in os.listdir(inputpath):
+        if not (os.path.isdir(os.path.join(inputpath, f))):
+            (shortname, ext) = os.path.splitext(f)
+            if ext in videoExts:
+                vidPaths.append(os.path.join(inputpath, f))
+
+    # Longest first
+    durations = probe_many(vidPaths, "duration", workers=max(1, jobs))
+    vidPaths.sort(key=lambda v: durations[v].values["duration"], reverse=True)
+
+    # Each file is decoded once to make both the mp4 and webm versions
+    targets = [
+        {"format": "mp4", "width": width, "dir": mp4dir},
+        {"format": "webm", "width": width, "dir": webmdir},
+    ]
+    encodes = [
+        (
+            os.path.basename(vidPath),
+            lambda v=vidPath: make_web_exports(
+                v, mp4dir, targets, overwrite, threads=threads_per_job
+            ),
+        )
+        for vidPath in vidPaths
+    ]
+
+    return run_jobs(encodes, jobs)
+
+
+def make_collage(
+    videoDir,
+    videoList,
+    nCols,
+    outPath,
+    doSound,
+    exportWidth,
+    vidHeight=[],
+    cropSquare=False,
+    engine="overlay",
+    tempFiles=False,
+    fillColor="black",
+    dryRun=False,
+    intermediates="files",
+    vidWidth=None,
+    manifest=None,
+):
+    """Make a grid of videos (mp4 format).
+    
+    Arguments:
+    videoDir - directory where the input videos are (use '/' to just give full paths 
+        in videoList
+    videoList - list of videos to include in the grid. They will appear in reading order.
+        Videos should all be the same size! (But any aspect ratio is fine.) With the
+        xstack and numpy engines, videos of other sizes are scaled to fit, and
+        None leaves a gap in the grid.
+    nCols - number of columns for the grid. The number of rows will be set accordingly.
+    outPath - where to put the collage (full path and filename, excluding extension)
+    doSound - boolean, whether to include sound in the collage. 
+    exportWidth - 0 not to export, otherwise width in pixels of mp4 & webm to create
+
+    Keyword arguments:
+    vidHeight - height in pixels of each row of the grid; defaults to the height of
+        the videos
+    cropSquare - whether to crop videos to squares (taking the top of the video).
+        The overlay engine only crops videos after the first.
+    engine - how to put the grid together:
+        overlay - with a chain of ffmpeg overlay filters
+        xstack - with a single ffmpeg xstack filter, using tile positions worked
+            out in advance by plan_collage_layout. Much faster for large grids.
+            Requires ffmpeg 5.0 or later.
+        numpy - decode each video to raw frames and copy each frame into place in
+            a single numpy array, which is piped to one encoder. Requires numpy.
+            Scales better to large grids since each frame of the grid is built
+            with one copy per video rather than one copy of the whole grid per
+            video. Uses the same layout as xstack.
+    tempFiles - if doing sound, whether to make the silent collage and the sound
+        mix separately and then combine them, rather than mixing the sound in the
+        same ffmpeg process that makes the collage. Slower, but may help if the
+        single-process version runs into trouble.
+    fillColor - color of the borders and any gaps (xstack and numpy engines; the
+        numpy engine only knows the colors listed in color_to_rgb)
+    dryRun - if True, don't make the collage; instead return a dict with the
+        layout (see plan_collage_layout; None for the overlay engine) and the
+        list of commands that would be run.
+    intermediates - with tempFiles, "files" to write the silent collage and sound
+        mix to disk before combining them, or "fifo" to stream them to the final
+        step through named pipes, running all three steps at once (see
+        run_pipeline). Falls back to files where named pipes aren't available
+        and with the numpy engine. The final step then encodes the video rather
+        than copying it, so this only pays off with a few cores to spare.
+    vidWidth - width in pixels of each column of the grid; defaults to the width
+        of the first video. Videos are scaled to fit before they are put
+        together, so the grid can be made at its final size in one encode. If
+        vidHeight isn't given, rows keep the first video's aspect ratio. Needs
+        the xstack or numpy engine.
+    manifest - BuildManifest used to skip making the collage if it's up to date;
+        defaults to the one set with set_build_manifest, if any.
+    
+    If doing sound with tempFiles=True, this creates a few temporary files in the same
+    directory as the final collage, named (if the final output is collage.mp4)
+    collage_silent.mp4 and collage.wav.
+    
+    Sizes of input videos is unchanged, so final collage size is (originalWidth * nCols) x 
+    (originalHeight * nRows). """
+
+    plan = _collage_steps(
+        videoDir,
+        videoList,
+        nCols,
+        outPath,
+        doSound,
+        vidHeight,
+        cropSquare,
+        engine,
+        tempFiles,
+        fillColor,
+        intermediates,
+        vidWidth,
+    )
+    (steps, layout, outPath) = (plan["steps"], plan["layout"], plan["outPath"])
+
+    if dryRun:
+        return {"layout": layout, "commands": steps}
+
+    # Intermediate files are deleted, so check whether the collage is up to date
+    # based on the whole sequence of steps
+    if manifest is None:
+        manifest = get_build_manifest()
+    inputs = plan["inputs"]
+    if manifest is None or not manifest.is_fresh(steps, inputs, [outPath]):
+        if plan["fifos"]:
+            run_pipeline(steps, [outPath], plan["fifos"], inputs, incremental=False)
+        else:
+            for command in steps:
+                if command[0] == "videotools.compose_collage_numpy":
+                    compose_collage_numpy(layout, command[-1], plan["mixSound"])
+                    continue
+                run_ffmpeg(command, [command[-1]], incremental=False, overwrite=True)
+
+            # Clean up intermediate files
+            for intermediate in plan["intermediates"]:
+                os.remove(intermediate)
+
+        if manifest is not None:
+            manifest.record(steps, inputs, [outPath])
+
+    if exportWidth != 0:
+        (exportDir, baseFilename) = os.path.split(outPath)
+        exportDir = os.path.join(exportDir, "export")
+        make_sure_path_exists(exportDir)
+        make_web_exports(outPath, exportDir, _collage_export_targets(exportWidth))
+
+
+def _collage_steps(
+    videoDir,
+    videoList,
+    nCols,
+    outPath,
+    doSound,
+    vidHeight,
+    cropSquare,
+    engine,
+    tempFiles,
+    fillColor,
+    intermediates="files",
+    vidWidth=None,
+):
+    """Work out the commands make_collage runs; arguments are as for make_collage.
+
+    Returns a dict with the list of steps (commands), the layout (None for the
+    overlay engine), the input paths, the final outPath, the intermediate files
+    to delete afterwards, the named pipes connecting the steps if they are to be
+    run at the same time with run_pipeline, and whether sound is mixed in the
+    first step."""
+
+    if intermediates not in ["files", "fifo"]:
+        raise ValueError("Unrecognized intermediates {}".format(intermediates))
+    useFifos = (
+        doSound
+        and tempFiles
+        and intermediates == "fifo"
+        and engine != "numpy"
+        and can_use_fifos()
+    )
+    if useFifos:
+        # Lossless video and PCM sound in formats that can be written to a pipe
+        outPathSilent = fifo_path(outPath + ".mp4", "silent.nut")
+        outPathSound = fifo_path(outPath + ".mp4", "sound.wav")
+        silentArgs = ["-c:v", "ffv1", "-f", "nut"]
+    elif doSound and tempFiles:
+        (outPathDir, outPathFname) = os.path.split(outPath)
+        outPathSilent = os.path.join(outPathDir, outPathFname + "_silent.mp4")
+        outPathSound = os.path.join(outPathDir, outPathFname + ".wav")
+        silentArgs = ["-c:v", "libx264"]
+    else:
+        outPathSilent = outPath + ".mp4"
+        silentArgs = ["-c:v", "libx264"]
+
+    outPath = outPath + ".mp4"
+
+    if engine not in ["overlay", "xstack", "numpy"]:
+        raise ValueError("Unrecognized collage engine {}".format(engine))
+    vidPaths = [os.path.join(videoDir, v) if v else None for v in videoList]
+    presentPaths = [v for v in vidPaths if v]
+    if engine == "overlay" and len(presentPaths) < len(vidPaths):
+        raise ValueError("Gaps in the grid need the xstack or numpy engine")
+    if engine == "overlay" and vidWidth:
+        raise ValueError("Scaling videos to vidWidth needs the xstack or numpy engine")
+
+    # Step 1: make the collage (silent if using temporary files)
+
+    nRows = int(math.ceil(len(videoList) / nCols))
+
+    inputList = []
+    for vidPath in presentPaths:
+        inputList = inputList + ["-i", vidPath]
+
+    command = ["ffmpeg"] + inputList
+
+    border = 10
+    rowHeight = int(vidHeight) if vidHeight else None
+    layout = None
+    outputOptions = []
+    if engine == "overlay":
+        # In general, use 'ih' and 'h'; if heights vary, input here.
+        if vidHeight:
+            vidHeight = str(vidHeight)
+            vidHeightOverlay = vidHeight
+        else:
+            vidHeight = "ih"
+            vidHeightOverlay = "h"
+
+        filterStr = (
+            "[0:v]pad="
+            + str(border * (nCols - 1))
+            + "+"
+            + "iw*"
+            + str(nCols)
+            + ":"
+            + str(border * (nRows - 1))
+            + "+"
+            + vidHeight
+            + "*"
+            + str(nRows)
+            + "[x0];"
+        )
+        for iVid in range(1, len(videoList)):
+            if iVid == (len(videoList) - 1):
+                outStr = "[out]"
+            else:
+                outStr = "[x" + str(iVid) + "]"
+
+            thisY = iVid // nCols
+            thisX = iVid % nCols
+
+            if cropSquare:
+                filterStr = (
+                    filterStr
+                    + "["
+                    + str(iVid)
+                    + ":v]crop=iw:iw:0:0[y"
+                    + str(iVid - 1)
+                    + "];"
+                )
+
+                filterStr = (
+                    filterStr
+                    + "[x"
+                    + str(iVid - 1)
+                    + "][y"
+                    + str(iVid - 1)
+                    + "]overlay=x="
+                    + str(border * (thisX))
+                    + "+("
+                    + str(thisX)
+                    + "*w):y="
+                    + str(border * (thisY))
+                    + "+("
+                    + str(thisY)
+                    + "*"
+                    + vidHeightOverlay
+                    + "):repeatlast=1:shortest=0:eof_action=repeat"
+                    + outStr
+                    + ";"
+                )
+            else:
+                filterStr = (
+                    filterStr
+                    + "[x"
+                    + str(iVid - 1)
+                    + "]["
+                    + str(iVid)
+                    + ":v]overlay=x="
+                    + str(border * (thisX))
+                    + "+("
+                    + str(thisX)
+                    + "*w):y="
+                    + str(border * (thisY))
+                    + "+("
+                    + str(thisY)
+                    + "*"
+                    + vidHeightOverlay
+                    + "):repeatlast=1:shortest=0:eof_action=repeat"
+                    + outStr
+                    + ";"
+                )
+    else:
+        layout = plan_collage_layout(
+            vidPaths, nCols, rowHeight, cropSquare, border, fillColor, vidWidth
+        )
+        # The numpy engine doesn't use a filter graph for the video
+        filterStr = ""
+        if engine == "xstack":
+            filterStr = xstack_filter(layout) + ";"
+            # xstack holds finished videos' last frames until all have ended; end
+            # with the first video instead, like the overlay chain
+            outputOptions = ["-t", str(layout["duration"])]
+
+    mixSound = doSound and not tempFiles
+    if mixSound:
+        # Mix the sound in the same filter graph as the video
+        filterStr = (
+            filterStr
+            + "".join("[{}:a]".format(iVid) for iVid in range(len(presentPaths)))
+            + "amix=inputs="
+            + str(len(presentPaths))
+            + ":duration=first:dropout_transition=3[aout];"
+        )
+        command = command + [
+            "-filter_complex",
+            filterStr[:-1],
+            "-map",
+            "[out]",
+            "-map",
+            "[aout]",
+            "-c:v",
+            "libx264",
+            "-c:a",
+            "libfdk_aac",
+            "-shortest",
+        ]
+    else:
+        command = command + ["-filter_complex", filterStr[:-1]] + silentArgs
+        command = command + ["-map", "[out]"]
+    command = command + outputOptions + [outPathSilent]
+    if engine == "numpy":
+        # Not an ffmpeg command, but records how the collage was made
+        command = (
+            ["videotools.compose_collage_numpy"]
+            + inputList
+            + [json.dumps(layout, sort_keys=True), str(mixSound), outPathSilent]
+        )
+    steps = [command]
+
+    if doSound and tempFiles:
+
+        # Step 2: make sound mix
+
+        filterStr = (
+            "amix=inputs="
+            + str(len(presentPaths))
+            + ":duration=first:dropout_transition=3"
+        )
+
+        command = ["ffmpeg"] + inputList + ["-filter_complex", filterStr]
+        if useFifos:
+            command = command + ["-f", "wav"]
+        steps.append(command + [outPathSound])
+
+        # The piped video is lossless, so it's encoded here rather than copied
+        command = [
+            "ffmpeg",
+            "-i",
+            outPathSilent,
+            "-i",
+            outPathSound,
+            "-c:v",
+            "libx264" if useFifos else "copy",
+            "-c:a",
+            "libfdk_aac",
+            "-shortest",
+            outPath,
+        ]
+        steps.append(command)
+
+    if doSound and tempFiles and not useFifos:
+        intermediateFiles = [outPathSilent, outPathSound]
+    else:
+        intermediateFiles = []
+    return {
+        "steps": steps,
+        "layout": layout,
+        "inputs": presentPaths,
+        "outPath": outPath,
+        "intermediates": intermediateFiles,
+        "fifos": [outPathSilent, outPathSound] if useFifos else [],
+        "mixSound": mixSound,
+    }
+
+
+def _collage_export_targets(exportWidth):
+    return [
+        {"format": "mp4", "width": exportWidth, "rate": 2000},
+        {"format": "webm", "width": exportWidth, "rate": 2000},
+    ]
+
+
+def build_participant_grids(
+    root,
+    outDir,
+    jobs=1,
+    target_width=1920,
+    maxCols=4,
+    doSound=True,
+    engine="xstack",
+    manifest=None,
+):
+    """Make a grid of each participant's videos, e.g. for sharing with the lab.
+
+    Arguments:
+    root - directory with a subdirectory of mp4 videos per participant
+    outDir - where to put the grids, named for the subdirectories (e.g.
+        outDir/participant_1.mp4)
+
+    Keyword arguments:
+    jobs - number of participants to process at once
+    target_width - width in pixels of each grid (at most); tiles are scaled to
+        fit before the grid is put together, so each grid is encoded once, at
+        this size. Videos aren't scaled up.
+    maxCols - number of columns of the grid, if there are that many videos
+    doSound - whether to mix the videos' sound into the grid
+    engine - "xstack" or "numpy"; see make_collage
+    manifest - BuildManifest or path to one, used to skip participants whose
+        videos haven't changed since their grid was made. Defaults to the
+        manifest set with set_build_manifest if any, otherwise
+        outDir/participant_grids.manifest.json.
+
+    Returns a list of (participant, seconds) pairs as from run_jobs."""
+
+    make_sure_path_exists(outDir)
+    if manifest is None:
+        manifest = get_build_manifest() or os.path.join(
+            outDir, "participant_grids.manifest.json"
+        )
+    if isinstance(manifest, str):
+        manifest = BuildManifest(manifest)
+
+    def build(partDir, vids):
+        nCols = min(maxCols, len(vids))
+        # Column width that makes the grid target_width wide, borders included
+        firstWidth = get_video_details(os.path.join(partDir, vids[0]), "width")
+        if firstWidth <= 0:
+            raise ValueError(
+                "Couldn't read the width of {}".format(os.path.join(partDir, vids[0]))
+            )
+        vidWidth = min(int(firstWidth), (target_width - 10 * (nCols - 1)) // nCols)
+        vidWidth -= vidWidth % 2
+        make_collage(
+            partDir,
+            vids,
+            nCols,
+            os.path.join(outDir, os.path.basename(partDir)),
+            doSound,
+            0,
+            engine=engine,
+            vidWidth=vidWidth,
+            manifest=manifest,
+        )
+
+    grids = []
+    for d in sorted(os.listdir(root)):
+        partDir = os.path.join(root, d)
+        if not os.path.isdir(partDir):
+            continue
+        # Sorted, so that an unchanged set of videos gives an identical command
+        vids = sorted(
+            f
+            for f in os.listdir(partDir)
+            if os.path.splitext(f)[1] == ".mp4"
+            and not os.path.isdir(os.path.join(partDir, f))
+        )
+        if vids:
+            grids.append((d, lambda partDir=partDir, vids=vids: build(partDir, vids)))
+
+    with manifest.batch():
+        return run_jobs(grids, jobs)
+
+
+def plan_collage_layout(
+    vidPaths,
+    nCols,
+    vidHeight=None,
+    cropSquare=False,
+    border=10,
+    fillColor="black",
+    vidWidth=None,
+):
+    """Work out where each video goes in a grid, as used by make_collage.
+
+    vidPaths: full paths to the videos, in reading order; None leaves a gap
+    nCols, vidHeight, cropSquare, border, fillColor, vidWidth: see make_collage
+
+    Every cell of the grid is vidWidth wide (or as wide as the first video) and
+    vidHeight tall (or as tall as the first video, scaled to vidWidth, or square
+    if cropSquare). Videos that don't match
+    the cell size are scaled to fit inside it, keeping their aspect ratio, and
+    padded with fillColor. Returns a dict with the overall width and height of
+    the grid, nRows, nCols, border, fillColor, and the frameRate and duration of
+    the first video; and tiles, a list with a dict per video giving its path, x, y,
+    width and height in the grid, and the filters needed to crop and scale it."""
+
+    presentPaths = [v for v in vidPaths if v]
+    if not presentPaths:
+        raise ValueError("No videos to put in the grid")
+    probes = probe_many(presentPaths, ["width", "height", "framerate", "duration"])
+    for vidPath in presentPaths:
+        if not probes[vidPath].ok:
+            raise ValueError("; ".join(probes[vidPath].errors))
+    first = probes[presentPaths[0]].values
+
+    cellWidth = int(vidWidth) if vidWidth else int(first["width"])
+    if vidHeight:
+        cellHeight = int(vidHeight)
+    elif cropSquare:
+        cellHeight = cellWidth
+    elif vidWidth:
+        cellHeight = int(round(first["height"] * cellWidth / first["width"]))
+        cellHeight += cellHeight % 2
+    else:
+        cellHeight = int(first["height"])
+
+    nRows = int(math.ceil(len(vidPaths) / nCols))
+    width = border * (nCols - 1) + cellWidth * nCols
+    height = border * (nRows - 1) + cellHeight * nRows
+    # yuv420p output needs even dimensions
+    width += width % 2
+    height += height % 2
+
+    tiles = []
+    for (iVid, vidPath) in enumerate(vidPaths):
+        (row, col) = (iVid // nCols, iVid % nCols)
+        tile = {
+            "path": vidPath,
+            "x": col * (cellWidth + border),
+            "y": row * (cellHeight + border),
+            "width": cellWidth,
+            "height": cellHeight,
+            "filters": [],
+        }
+        if vidPath:
+            tileWidth = int(probes[vidPath].values["width"])
+            tileHeight = int(probes[vidPath].values["height"])
+            if cropSquare:
+                tile["filters"].append("crop=iw:iw:0:0")
+                tileHeight = tileWidth
+            if (tileWidth, tileHeight) != (cellWidth, cellHeight):
+                tile["filters"].append(
+                    "scale={w}:{h}:force_original_aspect_ratio=decrease,"
+                    "pad={w}:{h}:(ow-iw)/2:(oh-ih)/2:color={c}".format(
+                        w=cellWidth, h=cellHeight, c=fillColor
+                    )
+                )
+        tiles.append(tile)
+
+    return {
+        "width": width,
+        "height": height,
+        "nRows": nRows,
+        "nCols": nCols,
+        "border": border,
+        "fillColor": fillColor,
+        "frameRate": first["framerate"],
+        "duration": first["duration"],
+        "tiles": tiles,
+    }
+
+
+def xstack_filter(layout):
+    """Filter graph putting videos into a grid with xstack, ending in [out].
+
+    layout: a grid layout from plan_collage_layout. Input k of the ffmpeg command
+        should be the kth video that is present in the layout."""
+
+    present = [tile for tile in layout["tiles"] if tile["path"]]
+    filters = []
+    for (k, tile) in enumerate(present):
+        filters.append(
+            "[{}:v]".format(k)
+            + ",".join(tile["filters"] + ["format=yuv420p", "setpts=PTS-STARTPTS"])
+            + "[t{}]".format(k)
+        )
+    if len(present) > 1:
+        filters.append(
+            "".join("[t{}]".format(k) for k in range(len(present)))
+            + "xstack=inputs={}:layout={}:fill={}".format(
+                len(present),
+                "|".join("{}_{}".format(tile["x"], tile["y"]) for tile in present),
+                layout["fillColor"],
+            )
+            + "[stacked]"
+        )
+    else:
+        filters.append("[t0]null[stacked]")
+
+    # xstack's output only extends as far as the videos do, e.g. if the last column
+    # is empty, so pad out to the full grid
+    extentX = max(tile["x"] + tile["width"] for tile in present)
+    extentY = max(tile["y"] + tile["height"] for tile in present)
+    if (extentX, extentY) != (layout["width"], layout["height"]):
+        filters.append(
+            "[stacked]pad={}:{}:0:0:color={}[out]".format(
+                layout["width"], layout["height"], layout["fillColor"]
+            )
+        )
+    else:
+        filters.append("[stacked]null[out]")
+    return ";".join(filters)
+
+
+# Basic HTML color names, with the values ffmpeg gives them
+COLOR_NAMES = {
+    "black": "000000",
+    "white": "FFFFFF",
+    "gray": "808080",
+    "grey": "808080",
+    "silver": "C0C0C0",
+    "red": "FF0000",
+    "maroon": "800000",
+    "yellow": "FFFF00",
+    "olive": "808000",
+    "lime": "00FF00",
+    "green": "008000",
+    "aqua": "00FFFF",
+    "cyan": "00FFFF",
+    "teal": "008080",
+    "blue": "0000FF",
+    "navy": "000080",
+    "fuchsia": "FF00FF",
+    "magenta": "FF00FF",
+    "purple": "800080",
+}
+
+
+def color_to_rgb(color):
+    """(r, g, b) for a color given as a name in COLOR_NAMES, '0xRRGGBB' or '#RRGGBB'.
+
+    Raises ValueError for any other color, including other colors ffmpeg
+    understands, so a bad fillColor is caught before any video is decoded."""
+    if color.lower() in COLOR_NAMES:
+        hexColor = COLOR_NAMES[color.lower()]
+    elif color.startswith("0x") or color.startswith("#"):
+        hexColor = color[2:] if color.startswith("0x") else color[1:]
+    else:
+        hexColor = None
+    if hexColor is None or not re.match(r"^[0-9a-fA-F]{6}$", hexColor):
+        raise ValueError(
+            "Unrecognized color {!r}; use 0xRRGGBB, #RRGGBB or one of {}".format(
+                color, ", ".join(sorted(COLOR_NAMES))
+            )
+        )
+    return tuple(int(hexColor[i : i + 2], 16) for i in range(0, 6, 2))
+
+
+def compose_collage_numpy(layout, outPath, doSound=False):
+    """Make a grid of videos by composing raw frames in a numpy array.
+
+    Used by make_collage(..., engine="numpy"). layout is a grid layout from
+    plan_collage_layout and outPath includes the extension. Each video's last frame
+    is held once it ends (like eof_action=repeat), and the collage is as long as
+    the first video.
+
+    Each video is decoded, cropped and scaled by its own ffmpeg process to rgb24
+    frames at the first video's frame rate. For each frame of the collage, one frame
+    of each video is read into a preallocated array for that video and then copied
+    into its slice of a single canvas array (the slice isn't contiguous, so it can't
+    be read into directly). The canvas is written straight to the stdin of one
+    encoding ffmpeg process. If doSound, the encoding process also reads the videos'
+    audio and mixes it."""
+
+    try:
+        import numpy as np
+    except ImportError:
+        raise ImportError("make_collage with engine='numpy' requires numpy")
+
+    present = [tile for tile in layout["tiles"] if tile["path"]]
+    vidPaths = [tile["path"] for tile in present]
+    frameRate = layout["frameRate"]
+    (canvasWidth, canvasHeight) = (layout["width"], layout["height"])
+    canvas = np.empty((canvasHeight, canvasWidth, 3), dtype=np.uint8)
+    canvas[:, :] = color_to_rgb(layout["fillColor"])
+
+    # The decoders and the encoder are started through the runner, so they are
+    # measured and reported like any other ffmpeg process
+    runner = get_ffmpeg_runner()
+    decoders = []
+    tiles = []
+    slices = []
+    for tile in present:
+        filters = ["fps={}".format(frameRate)] + tile["filters"]
+        decodeCommand = [
+            "ffmpeg",
+            "-v",
+            "error",
+            "-i",
+            tile["path"],
+            "-vf",
+            ",".join(filters),
+            "-f",
+            "rawvideo",
+            "-pix_fmt",
+            "rgb24",
+            "pipe:1",
+        ]
+        decoders.append(
+            runner.start(decodeCommand, label="compose_collage_numpy", stdout=sp.PIPE)
+        )
+        tiles.append(np.empty((tile["height"], tile["width"], 3), dtype=np.uint8))
+        slices.append(
+            (
+                slice(tile["y"], tile["y"] + tile["height"]),
+                slice(tile["x"], tile["x"] + tile["width"]),
+            )
+        )
+
+    # -y since stdin is the video, so ffmpeg can't ask before overwriting
+    encodeCommand = [
+        "ffmpeg",
+        "-y",
+        "-v",
+        "error",
+        "-f",
+        "rawvideo",
+        "-pix_fmt",
+        "rgb24",
+        "-s",
+        "{}x{}".format(canvasWidth, canvasHeight),
+        "-r",
+        str(frameRate),
+        "-i",
+        "pipe:0",
+    ]
+    if doSound:
+        for vidPath in vidPaths:
+            encodeCommand = encodeCommand + ["-i", vidPath]
+        encodeCommand = encodeCommand + [
+            "-filter_complex",
+            "".join("[{}:a]".format(iVid + 1) for iVid in range(len(vidPaths)))
+            + "amix=inputs={}:duration=first:dropout_transition=3[aout]".format(
+                len(vidPaths)
+            ),
+            "-map",
+            "0:v",
+            "-map",
+            "[aout]",
+            "-c:a",
+            "libfdk_aac",
+            "-shortest",
+        ]
+    encodeCommand = encodeCommand + ["-c:v", "libx264", "-pix_fmt", "yuv420p", outPath]
+    encoder = runner.start(
+        encodeCommand, [outPath], "compose_collage_numpy", stdin=sp.PIPE
+    )
+
+    def read_frame(decoder, tile):
+        buf = memoryview(tile.reshape(-1))
+        nRead = 0
+        while nRead < len(buf):
+            n = decoder.proc.stdout.readinto(buf[nRead:])
+            if not n:
+                return False
+            nRead += n
+        return True
+
+    running = [True] * len(vidPaths)
+    try:
+        while True:
+            for iVid in range(len(vidPaths)):
+                if running[iVid] and not read_frame(decoders[iVid], tiles[iVid]):
+                    running[iVid] = False
+                if running[iVid]:
+                    canvas[slices[iVid]] = tiles[iVid]
+            # The collage ends with the first video, as the overlay chain does
+            if not running[0]:
+                break
+            try:
+                encoder.proc.stdin.write(canvas.data)
+            except BrokenPipeError:
+                # The encoder has failed; its return code is checked below
+                break
+    except BaseException:
+        # Don't leave the encoder to finish a partial collage
+        runner.kill(encoder)
+        raise
+    finally:
+        # Decoders of videos longer than the first are no longer needed
+        for decoder in decoders:
+            runner.kill(decoder)
+            decoder.proc.stdout.close()
+        try:
+            encoder.proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        for decoder in decoders:
+            runner.finish(decoder)
+        returnCode = runner.finish(encoder).returnCode
+
+    if returnCode:
+        raise sp.CalledProcessError(returnCode, "ffmpeg")
+
+
+StimulusSpec = namedtuple("StimulusSpec", ["name", "factors", "path"])
+StimulusSpec.__doc__ = """One stimulus from a StimulusSpace.
+
+name: filename without extension, e.g. sbs_fall_near_next_duck_c1_b1_NN
+factors: dict mapping each factor name to this stimulus's level
+path: full path to the stimulus file, or None if the space has no outDir"""
+
+
+def ordered_pairs(levels):
+    """All ordered pairs of different levels, e.g. for the two outcomes shown
+    side by side: ordered_pairs(["A", "B"]) == [("A", "B"), ("B", "A")]"""
+    return list(itertools.permutations(levels, 2))
+
+
+class StimulusSpace:
+    """A set of stimuli defined by combinations of factor levels, expanded lazily.
+
+    A space is a union of blocks; each block is the Cartesian product of a list of
+    levels for every factor. Different blocks can use different levels, e.g. when
+    each event has its own outcomes and objects. Stimuli are only created as they
+    are iterated over or indexed, so len() and indexing work without expanding the
+    whole design, and a large design can be split across machines with shard.
+
+    factors: list of factor names, in the order they appear in stimulus names
+    outDir: directory the stimulus files go in, used to set each StimulusSpec.path
+    prefix: string to start each name with, e.g. "sbs_"
+    ext: extension for stimulus paths
+    separator: string to join levels with in names. Levels that are tuples (e.g.
+        from ordered_pairs) are joined with the separator too.
+
+    Example:
+        space = StimulusSpace(["event", "outcomes", "object"], outDir, prefix="sbs_")
+        space.add_block(event=["fall"], outcomes=ordered_pairs(["near", "next"]),
+            object=["duck", "book"])
+        for spec in space.restrict(object=["duck"]):
+            print(spec.name, spec.path)  # sbs_fall_near_next_duck ...
+    """
+
+    def __init__(self, factors, outDir=None, prefix="", ext=VIDEXT, separator="_"):
+        self.factors = list(factors)
+        self.outDir = outDir
+        self.prefix = prefix
+        self.ext = ext
+        self.separator = separator
+        self.blocks = []
+
+    def add_block(self, **levels):
+        """Add the combinations of the given levels; one list of levels per factor."""
+        missing = [f for f in self.factors if f not in levels]
+        extra = [f for f in levels if f not in self.factors]
+        if missing or extra:
+            raise ValueError(
+                "Block must give levels for exactly the factors {} (missing {}, "
+                "unrecognized {})".format(self.factors, missing, extra)
+            )
+        self.blocks.append(tuple(tuple(levels[f]) for f in self.factors))
+        return self
+
+    def restrict(self, **allowed):
+        """A new space with only the stimuli whose levels are allowed.
+
+        Each keyword gives a factor and either a collection of allowed levels or a
+        function taking a level and returning whether it's allowed, e.g.
+        space.restrict(event=["fall", "stay"], object=lambda o: o != "duck").
+        Restricting works on each factor's levels, so the result is still lazy and
+        its len() is still computed without expanding it. For the same reason,
+        constraints across factors (e.g. no duck with the fall event) aren't
+        supported; filter the stimuli when iterating, or build the space from
+        several blocks (see add_block)."""
+        for f in allowed:
+            if f not in self.factors:
+                raise ValueError("Unrecognized factor {}".format(f))
+        restricted = StimulusSpace(
+            self.factors, self.outDir, self.prefix, self.ext, self.separator
+        )
+        for block in self.blocks:
+            newBlock = []
+            for (f, levels) in zip(self.factors, block):
+                if f in allowed:
+                    test = allowed[f]
+                    if not callable(test):
+                        test = test.__contains__
+                    levels = tuple(level for level in levels if test(level))
+                newBlock.append(levels)
+            if all(newBlock):
+                restricted.blocks.append(tuple(newBlock))
+        return restricted
+
+    def _block_size(self, block):
+        # Not math.prod, which needs Python 3.8
+        return reduce(operator.mul, (len(levels) for levels in block), 1)
+
+    def __len__(self):
+        return sum(self._block_size(block) for block in self.blocks)
+
+    def _spec(self, combination):
+        parts = [
+            self.separator.join(str(l) for l in level)
+            if isinstance(level, tuple)
+            else str(level)
+            for level in combination
+        ]
+        name = self.prefix + self.separator.join(parts)
+        path = os.path.join(self.outDir, name + self.ext) if self.outDir else None
+        return StimulusSpec(name, dict(zip(self.factors, combination)), path)
+
+    def __iter__(self):
+        for block in self.blocks:
+            for combination in itertools.product(*block):
+                yield self._spec(combination)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            (start, stop, step) = index.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return list(self.iter_range(start, stop))
+        if index < 0:
+            index += len(self)
+        for block in self.blocks:
+            size = self._block_size(block)
+            if index < size:
+                # Mixed-radix decomposition, last factor varying fastest as in
+                # itertools.product
+                combination = []
+                for levels in reversed(block):
+                    (index, iLevel) = divmod(index, len(levels))
+                    combination.append(levels[iLevel])
+                return self._spec(tuple(reversed(combination)))
+            index -= size
+        raise IndexError("StimulusSpace index out of range")
+
+    def iter_range(self, start, stop):
+        """Iterate over stimuli start to stop-1, in the same order as iterating over
+        the whole space, without generating the ones before start."""
+        stop = min(stop, len(self))
+        for i in range(start, stop):
+            yield self[i]
+
+    def shard(self, iShard, nShards):
+        """Iterate over part iShard (counting from 0) of nShards roughly equal,
+        contiguous parts of the space, e.g. to split work across machines."""
+        if not 0 <= iShard < nShards:
+            raise ValueError("iShard must be between 0 and nShards - 1")
+        n = len(self)
+        return self.iter_range(n * iShard // nShards, n * (iShard + 1) // nShards)
+
+
+FILENAME_FACTORS = ("event", "outcome", "object", "camera", "background")
+
+StimulusFile = namedtuple("StimulusFile", ("filename", "path") + FILENAME_FACTORS)
+
+
+@lru_cache(maxsize=64)
+def _filename_pattern(orderItems):
+    positions = dict(orderItems)
+    missing = [f for f in FILENAME_FACTORS if f not in positions]
+    if missing:
+        raise ValueError("Order dict is missing positions for {}".format(missing))
+    nParts = max(positions.values()) + 1
+    byPosition = {iPart: f for (f, iPart) in positions.items() if f in FILENAME_FACTORS}
+    parts = [
+        "(?P<{}>[^_.]*)".format(byPosition[iPart]) if iPart in byPosition else "[^_.]*"
+        for iPart in range(nParts)
+    ]
+    # Any further _-separated parts and an extension are allowed and ignored
+    return re.compile("_".join(parts) + r"(?:_[^_.]*)*(?:\.[^.]*)?")
+
+
+def parse_video_filename(name, orderDict):
+    """Split a stimulus filename into (event, outcome, object, camera, background).
+
+    name: filename, with or without extension, e.g. "fall_near_duck_c1_b1.mp4"
+    orderDict: dict giving the position of each of 'event', 'outcome', 'object',
+        'camera' and 'background' among the _-separated parts of the name, e.g.
+        {"event": 0, "outcome": 1, "object": 2, "camera": 3, "background": 4}
+
+    The pattern for each orderDict is compiled once and cached. Raises ValueError if
+    the name doesn't have enough parts."""
+    match = _filename_pattern(tuple(sorted(orderDict.items()))).fullmatch(name)
+    if match is None:
+        raise ValueError(
+            "Filename {} doesn't match the order {}".format(name, orderDict)
+        )
+    return tuple(match.group(f) for f in FILENAME_FACTORS)
+
+
+class StimulusIndex:
+    """Table of the stimulus videos in a directory, parsed once.
+
+    directory: directory to index (not searched recursively)
+    orderDict: positions of the factors in the filenames; see parse_video_filename
+    extensions: list of extensions of files to include
+
+    The table is stored by column: columns maps 'filename', 'path' and each of
+    FILENAME_FACTORS to a list with one entry per file. Rows are returned as
+    StimulusFile namedtuples. lookup and groupby build a hash index the first time
+    a combination of factors is used, so later lookups by those factors take
+    constant time. Files whose names can't be parsed are listed in unparsed."""
+
+    def __init__(self, directory, orderDict, extensions=ORIGEXT):
+        self.directory = directory
+        self.columns = {col: [] for col in StimulusFile._fields}
+        self.unparsed = []
+        self._indexes = {}
+        for filename in sorted(os.listdir(directory)):
+            path = os.path.join(directory, filename)
+            if os.path.splitext(filename)[1] not in extensions or os.path.isdir(path):
+                continue
+            try:
+                factors = parse_video_filename(filename, orderDict)
+            except ValueError:
+                self.unparsed.append(filename)
+                continue
+            for (col, value) in zip(StimulusFile._fields, (filename, path) + factors):
+                self.columns[col].append(value)
+        if self.unparsed:
+            warnings.warn(
+                "Could not parse {} filenames in {}, e.g. {}".format(
+                    len(self.unparsed), directory, self.unparsed[0]
+                )
+            )
+
+    def __len__(self):
+        return len(self.columns["filename"])
+
+    def row(self, iRow):
+        return StimulusFile(*(self.columns[col][iRow] for col in StimulusFile._fields))
+
+    def __iter__(self):
+        return (self.row(iRow) for iRow in range(len(self)))
+
+    def _index(self, factors):
+        if factors not in self._indexes:
+            for f in factors:
+                if f not in self.columns:
+                    raise ValueError("Unrecognized factor {}".format(f))
+            index = {}
+            keys = zip(*(self.columns[f] for f in factors))
+            for (iRow, key) in enumerate(keys):
+                index.setdefault(key, []).append(iRow)
+            self._indexes[factors] = index
+        return self._indexes[factors]
+
+    def lookup(self, **factors):
+        """List of StimulusFiles with the given levels, e.g. lookup(event="fall",
+        object="duck")."""
+        names = tuple(sorted(factors))
+        rows = self._index(names).get(tuple(factors[f] for f in names), [])
+        return [self.row(iRow) for iRow in rows]
+
+    def groupby(self, *factors):
+        """Dict mapping each combination of levels of factors present (as a tuple,
+        in the order given) to the list of StimulusFiles with those levels."""
+        return {
+            key: [self.row(iRow) for iRow in rows]
+            for (key, rows) in self._index(tuple(factors)).items()
+        }
+
+
+def make_dummies(
+    outDir,
+    blankVideoPath,
+    vidNames,
+    labelsPerProcess=20,
+    jobs=1,
+    lossless=False,
+    overwrite=True,
+):
+    """Make blank labeled videos.
+    
+    outDir: directory to put the blank videos in
+    blankVideoPath: full path to the mp4 video to use as the starting point
+    vidNames: array of video filenames (no extension). One mp4 video will be created for 
+        each; it will just be the blank video with the vidName written on it. 
+        Can also be a StimulusSpace, in which case names are generated a chunk at a
+        time.
+    labelsPerProcess: number of videos each ffmpeg process makes. The blank video is
+        decoded once per process and split between the labels.
+    jobs: number of ffmpeg processes to run at once
+    lossless: if True, first decode the blank video to a lossless intermediate file
+        with its audio already resampled and encoded, so that each process only
+        needs to decode that and can copy the audio. The intermediate file is
+        named .<blank video name>_lossless.mkv in outDir; it's deleted afterwards
+        unless a build manifest is in use (see set_build_manifest).
+    overwrite: whether to remake videos that already exist (see run_ffmpeg)"""
+
+    make_sure_path_exists(outDir)
+    remakeExisting = overwrite or get_build_manifest() is not None
+
+    sourcePath = blankVideoPath
+    if lossless:
+        sourcePath = os.path.join(
+            outDir,
+            "."
+            + os.path.splitext(os.path.basename(blankVideoPath))[0]
+            + "_lossless.mkv",
+        )
+        run_ffmpeg(
+            [
+                "ffmpeg",
+                "-i",
+                blankVideoPath,
+                "-c:v",
+                "ffv1",
+                "-ar",
+                "22050",
+                "-c:a",
+                "aac",
+                "-loglevel",
+                "error",
+                sourcePath,
+            ],
+            [sourcePath],
+            overwrite=True,
+        )
+        audioArgs = ["-c:a", "copy"]
+    else:
+        audioArgs = ["-ar", "22050"]
+
+    chunks = []
+    for iChunk in range(0, len(vidNames), labelsPerProcess):
+        names = [
+            getattr(name, "name", name)
+            for name in vidNames[iChunk : iChunk + labelsPerProcess]
+        ]
+        outPaths = [
+            os.path.join(outDir, name if os.path.splitext(name)[1] else name + VIDEXT)
+            for name in names
+        ]
+        if not remakeExisting:
+            missing = [not os.path.exists(outPath) for outPath in outPaths]
+            names = list(itertools.compress(names, missing))
+            outPaths = list(itertools.compress(outPaths, missing))
+            if not names:
+                continue
+        labels = ["[o{}]".format(iName) for iName in range(len(names))]
+        if len(names) > 1:
+            filters = [
+                "[0:v]split={}".format(len(names))
+                + "".join("[v{}]".format(iName) for iName in range(len(names)))
+            ]
+            sources = ["[v{}]".format(iName) for iName in range(len(names))]
+        else:
+            filters = []
+            sources = ["[0:v]"]
+        for (iName, name) in enumerate(names):
+            filters.append(
+                sources[iName]
+                + "drawtext='fontfile=/Library/Fonts/Arial Black.ttf:text='"
+                + os.path.splitext(name)[0]
+                + "':fontsize=40:fontcolor=white:x=100:y=40'"
+                + labels[iName]
+            )
+
+        command = ["ffmpeg", "-i", sourcePath, "-filter_complex", ";".join(filters)]
+        for (iName, outPath) in enumerate(outPaths):
+            command = (
+                command
+                + ["-map", labels[iName], "-map", "0:a?"]
+                + audioArgs
+                + ["-q:v", "1", outPath]
+            )
+        chunks.append(
+            (
+                names[0],
+                lambda c=command, o=outPaths: run_ffmpeg(
+                    c, o, inputs=[blankVideoPath], check=False, overwrite=overwrite
+                ),
+            )
+        )
+
+    run_jobs(chunks, jobs)
+
+    if lossless and get_build_manifest() is None:
+        os.remove(sourcePath)
+
+
+def file_fingerprint(path, hashContent=False):
+    """Return a (size, mtime, contentHash) tuple identifying the contents of a file.
+
+    mtime is in nanoseconds. contentHash is a sha256 hex digest of the file if
+    hashContent is True, otherwise None."""
+    stat = os.stat(path)
+    contentHash = None
+    if hashContent:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        contentHash = h.hexdigest()
+    return (stat.st_size, stat.st_mtime_ns, contentHash)
+
+
+class ProbeCache:
+    """Persistent on-disk cache of parsed ffprobe output, stored in a SQLite file.
+
+    Entries are keyed by absolute path and kind of probe (see PROBE_KINDS), and
+    store the size and mtime of the file (plus a sha256 content hash if hashContent
+    is True) at the time it was probed. An entry is thrown away and the file
+    re-probed if any of these have changed. Once there are more than maxEntries
+    entries, the least recently used ones are evicted. Only regular local files
+    are cached; anything else ffprobe can read (e.g. a URL) is never looked up or
+    stored, since it has no size or mtime to check.
+
+    A connection is opened per operation, so one cache file can be shared between
+    threads and processes."""
+
+    def __init__(self, path=PROBE_CACHE_PATH, maxEntries=50000, hashContent=False):
+        self.path = path
+        self.maxEntries = maxEntries
+        self.hashContent = hashContent
+        if os.path.dirname(path):
+            make_sure_path_exists(os.path.dirname(path))
+        with self._connect() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS probes (
+                    path TEXT, kind TEXT, size INTEGER, mtime INTEGER, hash TEXT,
+                    data TEXT, lastUsed REAL, PRIMARY KEY (path, kind))"""
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS probes_lastUsed ON probes (lastUsed)"
+            )
+        conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=60)
+
+    def get(self, vidPath, kind):
+        """Return cached ffprobe output for vidPath, or None if missing or stale."""
+        if not os.path.isfile(vidPath):
+            return None
+        vidPath = os.path.abspath(vidPath)
+        (size, mtime, contentHash) = file_fingerprint(vidPath, self.hashContent)
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT size, mtime, hash, data FROM probes WHERE path=? AND kind=?",
+                (vidPath, kind),
+            ).fetchone()
+            if row is None:
+                result = None
+            elif (row[0], row[1]) != (size, mtime) or (
+                self.hashContent and row[2] != contentHash
+            ):
+                conn.execute(
+                    "DELETE FROM probes WHERE path=? AND kind=?", (vidPath, kind)
+                )
+                result = None
+            else:
+                conn.execute(
+                    "UPDATE probes SET lastUsed=? WHERE path=? AND kind=?",
+                    (time.time(), vidPath, kind),
+                )
+                result = json.loads(row[3])
+        conn.close()
+        return result
+
+    def put(self, vidPath, kind, data):
+        """Store ffprobe output for vidPath, evicting least recently used entries."""
+        if not os.path.isfile(vidPath):
+            return
+        vidPath = os.path.abspath(vidPath)
+        (size, mtime, contentHash) = file_fingerprint(vidPath, self.hashContent)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO probes VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    vidPath,
+                    kind,
+                    size,
+                    mtime,
+                    contentHash,
+                    json.dumps(data),
+                    time.time(),
+                ),
+            )
+            conn.execute(
+                """DELETE FROM probes WHERE rowid IN (SELECT rowid FROM probes
+                    ORDER BY lastUsed DESC LIMIT -1 OFFSET ?)""",
+                (self.maxEntries,),
+            )
+        conn.close()
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM probes")
+        conn.close()
+
+
+_probeCache = None
+
+
+def get_probe_cache():
+    """Return the default ProbeCache, creating it at PROBE_CACHE_PATH if needed."""
+    global _probeCache
+    if _probeCache is None:
+        _probeCache = ProbeCache()
+    return _probeCache
+
+
+def set_probe_cache(cache):
+    """Set the default ProbeCache, or None to use a new one at PROBE_CACHE_PATH."""
+    global _probeCache
+    _probeCache = cache
+
+
+def probe_video(vidPath, kind="streams", useCache=True):
+    """Run ffprobe on a video and return its parsed JSON output (format and streams).
+
+    kind: which ffprobe command to run; see PROBE_KINDS. Output from a
+        "count_frames" or "count_packets" probe is also used to answer "streams"
+        requests.
+    useCache: whether to look up and store results in the probe cache. Paths
+        that aren't regular local files (e.g. URLs) are always probed.
+
+    Raises subprocess.CalledProcessError if ffprobe fails."""
+    if useCache:
+        ffprobeOutput = _cached_probe(vidPath, kind)
+        if ffprobeOutput is not None:
+            return ffprobeOutput
+        cache = get_probe_cache()
+
+    args = shlex.split(PROBE_KINDS[kind]) + [vidPath]
+    # run the ffprobe process, decode stdout into utf-8 & convert to JSON
+    ffprobeOutput = json.loads(
+        get_ffmpeg_runner().output(args, label="probe_" + kind).decode("utf-8")
+    )
+
+    if useCache:
+        cache.put(vidPath, kind, ffprobeOutput)
+    return ffprobeOutput
+
+
+def _cached_probe(vidPath, kind):
+    """Cached ffprobe output that answers a kind of probe request, or None."""
+    cache = get_probe_cache()
+    cachedKinds = [kind]
+    if kind == "streams":
+        cachedKinds = cachedKinds + ["count_packets", "count_frames"]
+    for cachedKind in cachedKinds:
+        ffprobeOutput = cache.get(vidPath, cachedKind)
+        if ffprobeOutput is not None:
+            return ffprobeOutput
+    return None
+
+
+def has_stream(vidPath, codecType):
+    """Whether a video has a stream of codecType, e.g. "audio" or "video".
+
+    Returns False if the video can't be probed."""
+    try:
+        streams = probe_video(vidPath)["streams"]
+    except (sp.CalledProcessError, OSError, ValueError):
+        return False
+    return any(stream["codec_type"] == codecType for stream in streams)
+
+
+# function to find the resolution of the input video file
+# http://stackoverflow.com/a/34356719
+def findVideoResolution(pathToInputVideo):
+    ffprobeOutput = probe_video(pathToInputVideo)
+
+    # find height and width
+    height = ffprobeOutput["streams"][0]["height"]
+    width = ffprobeOutput["streams"][0]["width"]
+
+    return height, width
+
+
+def fade_filter(fadeFrames, fadeColor, duration, frameRate):
+    """Filter string to fade a video in from and out to a solid color.
+
+    fadeFrames: length of each fade in frames
+    fadeColor: color to fade from/to, e.g. 'white' or '0x009EFC'
+    duration: duration of the video the filter is applied to, in seconds
+    frameRate: frame rate of that video, in frames per second
+
+    Fades are specified by time rather than frame number, so the number of frames
+    in the video does not need to be counted."""
+    fadeDuration = fadeFrames / frameRate
+    return "fade=type=in:st={}:d={}:color={},fade=type=out:st={}:d={}:color={}".format(
+        1 / frameRate,
+        fadeDuration,
+        fadeColor,
+        max(0, duration - fadeDuration),
+        fadeDuration,
+        fadeColor,
+    )
+
+
+def time_crop_video(
+    inputPath,
+    outputPath,
+    start=-1,
+    end=-1,
+    padStart=0,
+    padEnd=0,
+    cropStr="",
+    crossFade=False,
+    fadeParams=(),
+):
+    """Trim, crop, pad and fade a video with a single ffmpeg process (video only).
+
+    Arguments:
+    inputPath - full path to the video to crop
+    outputPath - full path to the cropped video to create
+
+    Keyword arguments:
+    start, end - start and stop times in s. If start is -1, the whole video is used;
+        if end is -1, the video is used from start to its end.
+    padStart, padEnd - amount of time to extend first and last frames by, in s.
+    cropStr - filter(s) applied to the trimmed video, e.g. 'crop=...,scale=640:-2'
+    crossFade - if True, instead of holding the first frame at the start, the held
+        last frame cross-fades into the first frame over padEnd s, and the first
+        frame is then held for padStart s, e.g. for seamless looping.
+    fadeParams - (fadeFrames, fadeColor) to fade in from and out to fadeColor over
+        fadeFrames frames, or () not to fade.
+
+    The video is decoded and encoded exactly once, rather than writing the middle,
+    the first and last frames, and the padded pieces to separate files. It is cut
+    by seeking on the input (-ss and -t), so only the part from the keyframe before
+    start is decoded, then padded and faded with the tpad, xfade and fade filters
+    (and trim, to take the first frame to cross-fade into). xfade requires ffmpeg
+    4.3 or later."""
+
+    [vidDuration, frameRate] = get_video_details(
+        inputPath, ["vidduration", "framerate"]
+    )
+
+    # Seek on the input, so that ffmpeg doesn't decode everything before start
+    filters = []
+    seekArgs = []
+    if start == -1:
+        duration = vidDuration
+    else:
+        seekArgs = ["-ss", str(start)]
+        if end == -1:
+            duration = vidDuration - start
+        else:
+            seekArgs = seekArgs + ["-t", str(end - start)]
+            duration = end - start
+    if cropStr:
+        filters.append(cropStr)
+    filters.append("setpts=PTS-STARTPTS")
+
+    if not crossFade:
+        filters.append(
+            "tpad=start_mode=clone:start_duration={}:stop_mode=clone:stop_duration={}".format(
+                padStart, padEnd
+            )
+        )
+        filterStr = "[0:v]" + ",".join(filters)
+    else:
+        # Hold the last frame for padEnd s, fading to the first frame, which is then
+        # held for padStart s more (see crossfade advice at
+        # http://superuser.com/a/778967)
+        filterStr = (
+            "[0:v]"
+            + ",".join(filters)
+            + ",split[main][first];"
+            + "[main]tpad=stop_mode=clone:stop_duration={}[mainheld];".format(padEnd)
+            + "[first]trim=end_frame=1,setpts=PTS-STARTPTS,"
+            + "tpad=stop_mode=clone:stop_duration={}[firstheld];".format(
+                padStart + padEnd
+            )
+            + "[mainheld][firstheld]xfade=transition=fade:duration={}:offset={}".format(
+                padEnd, duration
+            )
+        )
+
+    if fadeParams:
+        (fadeFrames, fadeColor) = fadeParams
+        totalDuration = duration + padStart + padEnd
+        filterStr = (
+            filterStr
+            + ","
+            + fade_filter(fadeFrames, fadeColor, totalDuration, frameRate)
+        )
+
+    command = (
+        ["ffmpeg"]
+        + seekArgs
+        + [
+            "-i",
+            inputPath,
+            "-filter_complex",
+            filterStr + "[out]",
+            "-map",
+            "[out]",
+            "-loglevel",
+            "error",
+            outputPath,
+        ]
+    )
+    return run_ffmpeg(command, [outputPath], check=False)
+
+
+def make_flip_variants(inputPath, outputs, fadeParams=(), audio=True):
+    """Make flipped versions of a video with one ffmpeg process.
+
+    Arguments:
+    inputPath - full path to the video to flip
+    outputs - dict mapping variants to the full paths of the videos to make. A
+        variant is N for the video as it is, V for flipped vertically (upside
+        down), H for flipped horizontally, or VH for both.
+
+    Keyword arguments:
+    fadeParams - (fadeFrames, fadeColor) to fade in from and out to fadeColor over
+        fadeFrames frames, or () not to fade. Fade times are worked out from the
+        (cached) duration of the video, so its frames don't need to be counted.
+    audio - whether to copy the audio (if any) to each output
+
+    The video is decoded and faded once, then split between all the variants."""
+
+    variants = list(outputs.keys())
+    for variant in variants:
+        if variant != "N" and not (variant and set(variant) <= set("VH")):
+            raise ValueError("Unrecognized flip variant {}".format(variant))
+    nOut = len(variants)
+
+    filters = ["setpts=PTS-STARTPTS"]
+    if fadeParams:
+        (fadeFrames, fadeColor) = fadeParams
+        [duration, frameRate] = get_video_details(
+            inputPath, ["vidduration", "framerate"]
+        )
+        filters.append(fade_filter(fadeFrames, fadeColor, duration, frameRate))
+    if nOut > 1:
+        filters.append(
+            "split={}".format(nOut) + "".join("[s{}]".format(i) for i in range(nOut))
+        )
+        filterStr = "[0:v]" + ",".join(filters) + ";"
+    else:
+        filterStr = "[0:v]" + ",".join(filters) + "[s0];"
+
+    for (i, variant) in enumerate(variants):
+        flips = [f for (c, f) in [("V", "vflip"), ("H", "hflip")] if c in variant]
+        filterStr = filterStr + "[s{i}]{f}[out{i}];".format(
+            i=i, f=",".join(flips) or "null"
+        )
+
+    command = [
+        "ffmpeg",
+        "-i",
+        inputPath,
+        "-filter_complex",
+        filterStr[:-1],
+        "-loglevel",
+        "error",
+    ]
+    for (i, variant) in enumerate(variants):
+        command = command + ["-map", "[out{}]".format(i)]
+        if audio:
+            command = command + ["-map", "0:a?"]
+        command = command + [outputs[variant]]
+
+    return run_ffmpeg(command, list(outputs.values()), check=False)
+
+
+def get_keyframe_times(vidPath, useCache=True):
+    """Sorted times in s of the keyframes of a video's first video stream, from
+    the start of the video (as used by -ss).
+
+    Only keyframes are decoded, and the list is kept in the probe cache (kind
+    "keyframes"), so this is cheap after the first call for a file."""
+    frames = probe_video(vidPath, "keyframes", useCache=useCache).get("frames", [])
+    startTime = get_video_details(vidPath, "starttime", useCache=useCache)
+    times = []
+    for frame in frames:
+        t = frame.get("pts_time", frame.get("best_effort_timestamp_time"))
+        if t is not None:
+            times.append(float(t) - startTime)
+    return sorted(times)
+
+
+def trim_video(path, outPath, start, end=-1, accurate=True, snap=False):
+    """Cut the part of a video between start and end (in s) into a new file.
+
+    end: -1 to keep everything from start to the end of the video
+    accurate: if re-encoding, whether to start exactly at start (decoding from
+        the keyframe before it) rather than at that keyframe
+    snap: whether start may be moved back and end forward to the nearest
+        keyframes, so that the streams can be copied without re-encoding
+
+    ffmpeg seeks on the input, so only the part of the video from the keyframe
+    before start is read, however long the video is. If start is a keyframe and
+    end is a keyframe or the end of the video (or snap is True), streams are
+    copied with -c copy; keyframes are found with get_keyframe_times. Copied
+    streams are cut by decoding time, so with B-frames a copied part may run a
+    frame or two past end.
+
+    Returns (start, end) of the part that was kept; these differ from the
+    arguments only with snap."""
+
+    [duration, frameRate] = get_video_details(path, ["duration", "framerate"])
+    if end == -1 or end > duration:
+        end = duration
+    if not 0 <= start < end:
+        raise ValueError("Invalid trim from {} to {} s".format(start, end))
+
+    # Times within half a frame of a keyframe count as being on it
+    tolerance = 0.5 / frameRate if frameRate else 0.001
+    keyframes = get_keyframe_times(path)
+    startKey = max([t for t in keyframes if t <= start + tolerance], default=0)
+    endKey = min([t for t in keyframes if t >= end - tolerance], default=duration)
+    onKeyframes = start - startKey < tolerance and (
+        endKey - end < tolerance or end >= duration - tolerance
+    )
+
+    inputArgs = []
+    outputArgs = []
+    if onKeyframes or snap:
+        (start, end) = (startKey, endKey)
+        outputArgs = ["-c", "copy", "-avoid_negative_ts", "make_zero"]
+    elif not accurate:
+        inputArgs = ["-noaccurate_seek"]
+
+    inputArgs = inputArgs + ["-ss", str(start)]
+    if end < duration:
+        inputArgs = inputArgs + ["-t", str(end - start)]
+    command = (
+        ["ffmpeg"]
+        + inputArgs
+        + ["-i", path]
+        + outputArgs
+        + ["-loglevel", "error", outPath]
+    )
+    run_ffmpeg(command, [outPath])
+    return (start, end)
+
+
+# Video stream properties that must match to concatenate videos without re-encoding
+CONCAT_COPY_KEYS = [
+    "codec_name",
+    "profile",
+    "level",
+    "width",
+    "height",
+    "pix_fmt",
+    "sample_aspect_ratio",
+    "field_order",
+    "color_range",
+    "color_space",
+    "color_transfer",
+    "color_primaries",
+    "time_base",
+    "r_frame_rate",
+    "extradata_hash",
+]
+
+
+def can_stream_copy_concat(vidPaths):
+    """Whether videos' video streams match, so they can be joined with -c copy."""
+    probes = []
+    for vid in vidPaths:
+        try:
+            probes.append(probe_video(vid))
+        except (sp.CalledProcessError, OSError, ValueError):
+            return False
+    return _streams_match(probes)
+
+
+def _streams_match(probes):
+    """Whether the first video streams in a list of ffprobe outputs match.
+
+    False if in doubt: if a stream has codec extradata but the probe doesn't give
+    its hash (e.g. output cached by an older version of this module)."""
+    params = []
+    for ffprobeOutput in probes:
+        videoStreams = [
+            s for s in ffprobeOutput["streams"] if s["codec_type"] == "video"
+        ]
+        if not videoStreams:
+            return False
+        stream = videoStreams[0]
+        if int(stream.get("extradata_size", 0)) and "extradata_hash" not in stream:
+            return False
+        params.append([stream.get(key) for key in CONCAT_COPY_KEYS])
+    return all(p == params[0] for p in params)
+
+
+def concat_mp4s(concatPath, vidPaths, mode="auto"):
+    """Concatenate a list of mp4s into a single new mp4, video only.
+
+    concatPath: full path to the desired new mp4 file, including
+        extension 
+    vidPaths: full paths to the videos to concatenate. 
+    mode: "reencode" to decode and re-encode the videos with the concat filter,
+        "copy" to join them with the concat demuxer without re-encoding (only works
+        if their video streams match; see CONCAT_COPY_KEYS), or "auto" to copy if
+        the videos are compatible and re-encode otherwise, or if unsure.
+    
+    Videos will be concatenated in the order they appear in this list."""
+
+    # If there are no files to concat, immediately return 0.
+    if not len(vidPaths):
+        return 0
+
+    if mode not in ["auto", "copy", "reencode"]:
+        raise ValueError("Unrecognized concatenation mode {}".format(mode))
+    if mode == "copy" or (mode == "auto" and can_stream_copy_concat(vidPaths)):
+        return concat_mp4s_copy(concatPath, vidPaths)
+
+    return run_ffmpeg(_concat_command(concatPath, vidPaths), [concatPath], check=False)
+
+
+def _concat_command(concatPath, vidPaths):
+    """concat_mp4s command for re-encoding with the concat filter."""
+    concat = ["ffmpeg"]
+    inputList = ""
+
+    # Build the concatenate command
+    for (iVid, vid) in enumerate(vidPaths):
+        concat = concat + ["-i", vid]
+        inputList = inputList + "[{}:v:0]".format(iVid)
+
+    # Concatenate the videos. See https://trac.ffmpeg.org/wiki/Concatenate (concat filter)
+    # for more information about concatenation options and other approaches
+    concat = concat + [
+        "-filter_complex",
+        inputList + "concat=n={}:v=1:a=0".format(len(vidPaths)) + "[out]",
+        "-map",
+        "[out]",
+        "-loglevel",
+        "error",
+        "-c:v",
+        "libx264",
+        "-preset",
+        "slow",
+        "-b:v",
+        "1000k",
+        "-maxrate",
+        "1000k",
+        "-bufsize",
+        "2000k",
+        concatPath,
+    ]
+    return concat
+
+
+def concat_mp4s_copy(concatPath, vidPaths):
+    """Concatenate mp4s with matching video streams, without re-encoding (video only).
+
+    Uses the concat demuxer with stream copy, so this is about as fast as copying
+    the files. The list of files to join is written next to concatPath while
+    ffmpeg runs. See concat_mp4s."""
+
+    listPath = _write_concat_list(concatPath, vidPaths)
+    try:
+        return run_ffmpeg(
+            _concat_copy_command(concatPath, listPath),
+            [concatPath],
+            inputs=vidPaths,
+            check=False,
+        )
+    finally:
+        os.remove(listPath)
+
+
+def stream_concat(concatPath, sources, intermediates="fifo"):
+    """Concatenate the video made by several ffmpeg commands, without writing each
+    part to disk first.
+
+    concatPath: full path to the new mp4 file
+    sources: list of ffmpeg commands without an output file, e.g.
+        ["ffmpeg", "-i", rawPath, "-vf", cropStr] to concatenate cropped clips
+        without saving the cropped clips
+    intermediates: "fifo" to stream each part (as lossless FFV1 video in NUT)
+        through a named pipe into the concatenating process, running all of the
+        commands at once, or "files" to write the parts to temporary files one at
+        a time. Uses files where named pipes aren't available.
+
+    The parts are joined with the concat filter and encoded as by concat_mp4s,
+    video only."""
+
+    if intermediates not in ["files", "fifo"]:
+        raise ValueError("Unrecognized intermediates {}".format(intermediates))
+    useFifos = intermediates == "fifo" and can_use_fifos()
+    partPaths = [
+        fifo_path(concatPath, "part{}.nut".format(iPart))
+        for iPart in range(len(sources))
+    ]
+    producers = [
+        list(source) + ["-an", "-c:v", "ffv1", "-f", "nut", partPath]
+        for (source, partPath) in zip(sources, partPaths)
+    ]
+    steps = producers + [_concat_command(concatPath, partPaths)]
+    inputs = [i for source in sources for i in command_inputs(source)]
+
+    if useFifos:
+        return run_pipeline(steps, [concatPath], partPaths, inputs)
+
+    manifest = get_build_manifest()
+    if manifest is not None and manifest.is_fresh(steps, inputs, [concatPath]):
+        return 0
+    try:
+        for command in steps:
+            run_ffmpeg(command, [command[-1]], incremental=False, overwrite=True)
+    finally:
+        for partPath in partPaths:
+            if os.path.exists(partPath):
+                os.remove(partPath)
+    if manifest is not None:
+        manifest.record(steps, inputs, [concatPath])
+    return 0
+
+
+def _write_concat_list(concatPath, vidPaths):
+    """Write the concat demuxer's list of files next to concatPath; return its path."""
+    listPath = os.path.splitext(concatPath)[0] + "_concat.txt"
+    with open(listPath, "w") as f:
+        for vid in vidPaths:
+            escaped = os.path.abspath(vid).replace("'", "'\\''")
+            f.write("file '{}'\n".format(escaped))
+    return listPath
+
+
+def _concat_copy_command(concatPath, listPath):
+    return [
+        "ffmpeg",
+        "-f",
+        "concat",
+        "-safe",
+        "0",
+        "-i",
+        listPath,
+        "-map",
+        "0:v",
+        "-c",
+        "copy",
+        "-loglevel",
+        "error",
+        concatPath,
+    ]
+
+
+def frames_from_probe(streamInfo, method="fast", duration=None):
+    """Number of frames in a video stream according to ffprobe output, or None.
+
+    streamInfo: one entry of the "streams" list from ffprobe JSON output
+    method: "exact" (decoded frame count, needs a "count_frames" probe), "packets"
+        (packet count, needs a "count_packets" probe), "fast" (nb_frames from the
+        container header, or else duration * average frame rate), or "auto"
+        (nb_frames from the container header only).
+    duration: duration to use with "fast" if the stream doesn't give its own, as
+        in webm and mkv files; typically the format duration."""
+    if method == "exact":
+        key = "nb_read_frames"
+    elif method == "packets":
+        key = "nb_read_packets"
+    elif method in ["fast", "auto"]:
+        key = "nb_frames"
+    else:
+        raise ValueError("Unrecognized frame counting method {}".format(method))
+
+    if key in streamInfo and int(streamInfo[key]) > 0:
+        return float(streamInfo[key])
+
+    duration = streamInfo.get("duration", duration)
+    if method == "fast" and duration is not None:
+        (num, den) = streamInfo.get("avg_frame_rate", "0/0").split("/")
+        if float(den) > 0 and float(num) > 0:
+            return float(round(float(duration) * float(num) / float(den)))
+
+    return None
+
+
+def _needs_packet_count(ffprobeOutput, method):
+    """Whether counting frames in ffprobe output with method "auto" has to fall
+    back to a "count_packets" probe, because the header of the (last) video
+    stream gives no frame count."""
+    if method != "auto":
+        return False
+    videoStreams = [
+        stream for stream in ffprobeOutput["streams"] if stream["codec_type"] == "video"
+    ]
+    return bool(videoStreams) and frames_from_probe(videoStreams[-1], "auto") is None
+
+
+# function to find the resolution of the input video file
+# http://stackoverflow.com/a/34356719
+def get_video_details(vidPath, whichAttr, useCache=True, method="auto"):
+    """Uses ffprobe to retrieve details about a video.
+
+    get_video_details(vidPath, whichAttr, useCache=True, method="auto")
+
+    vidPath: full path to video file
+
+    whichAttr: single attribute or list of attributes to retrieve. Options are:
         duration - duration of video in seconds
         bitrate - bit rate of video
         starttime - start time of video
@@ -461,25 +3131,38 @@ def get_video_details(vidPath, whichAttr):
         nframes - number of frames
         vidduration - duration of video stream in seconds
         audduration - duration of audio stream in seconds
+        framerate - average frame rate of video stream in frames per second
 
         Returns a single value if whichAttr is a string, or a list of values
         corresponding to those requested if whichAttr is a list of strings.
+
+    useCache: whether to use the persistent probe cache (see ProbeCache). Cached
+        results are discarded automatically if the file has changed.
+
+    method: how to get nframes.
+        auto - use the frame count in the container header if there is one (e.g.
+            mp4, mov), otherwise count packets
+        fast - use the frame count in the container header, or estimate it from
+            duration and average frame rate. Does not read the video data at all.
+        packets - count packets without decoding them
+        exact - decode the whole video and count frames (slow for long videos)
         """
 
     # Ensure whichAttr is a list
     if isinstance(whichAttr, str):
         whichAttr = [whichAttr]
 
-    # Run ffprobe and collect output with data about video
-    cmd = "ffprobe -v quiet -show_format -print_format json -show_streams -count_frames"
-    args = shlex.split(cmd)
-    args.append(vidPath)
+    # Run ffprobe (or look up cached output) with data about video. Packets or frames
+    # are only counted if nframes is requested using a method that needs them.
+    if method not in FRAME_COUNT_KINDS:
+        raise ValueError("Unrecognized frame counting method {}".format(method))
+    kind = FRAME_COUNT_KINDS[method] if "nframes" in whichAttr else "streams"
     try:
-        ffprobeOutput = sp.check_output(args).decode("utf-8")
+        ffprobeOutput = probe_video(vidPath, kind, useCache=useCache)
     except:
         warnings.warn(
             "Error running ffprobe command {} to get video details about {}, returning -1".format(
-                " ".join(args), vidPath
+                PROBE_KINDS[kind] + " " + vidPath, vidPath
             )
         )
         if len(whichAttr) == 1:
@@ -487,7 +3170,45 @@ def get_video_details(vidPath, whichAttr):
         else:
             return [-1] * len(whichAttr)
 
-    ffprobeOutput = json.loads(ffprobeOutput)
+    (attributes, errors) = details_from_probe(
+        ffprobeOutput, whichAttr, vidPath, useCache=useCache, method=method
+    )
+    for err in errors:
+        warnings.warn(err)
+
+    # Return just a string if there's only one return value in the list
+    if len(attributes) == 1:
+        attributes = attributes[0]
+
+    return attributes
+
+
+VIDEO_ATTRIBUTES = [
+    "duration",
+    "bitrate",
+    "starttime",
+    "nframes",
+    "height",
+    "width",
+    "vidduration",
+    "audduration",
+    "framerate",
+]
+
+
+def details_from_probe(ffprobeOutput, whichAttr, vidPath, useCache=True, method="auto"):
+    """Extract attributes from parsed ffprobe output.
+
+    Arguments and attribute options are as for get_video_details, except that
+    whichAttr must be a list. Returns (values, errors), where values is a list with
+    one value per attribute and errors is a list of messages about problems
+    encountered (e.g. a missing video stream), each listed once."""
+
+    errors = []
+
+    def note(message):
+        if message not in errors:
+            errors.append(message)
 
     # Loop through attributes and collect specific information
     attributes = []
@@ -500,7 +3221,14 @@ def get_video_details(vidPath, whichAttr):
         elif attr == "starttime":
             returnVal = float(ffprobeOutput["format"]["start_time"])
         # Attributes that require a video/audio stream...
-        elif attr in ["nframes", "height", "width", "vidduration", "audduration"]:
+        elif attr in [
+            "nframes",
+            "height",
+            "width",
+            "vidduration",
+            "audduration",
+            "framerate",
+        ]:
             audioStream = -1
             videoStream = -1
             for iStream in range(len(ffprobeOutput["streams"])):
@@ -510,41 +3238,1166 @@ def get_video_details(vidPath, whichAttr):
                     videoStream = iStream
 
             if videoStream == -1:
-                warnings.warn("Missing video stream for video {}".format(vidPath))
-                if attr in ["nframes", "height", "width", "vidduration"]:
+                note("Missing video stream for video {}".format(vidPath))
+                if attr in ["nframes", "height", "width", "vidduration", "framerate"]:
                     returnVal = 0
                     attributes.append(returnVal)
                     continue
 
             if audioStream == -1:
-                # warnings.warn('Missing audio stream for video {}'.format(vidPath))
+                # note('Missing audio stream for video {}'.format(vidPath))
                 if attr in ["audduration"]:
                     returnVal = 0
                     attributes.append(returnVal)
                     continue
 
             if attr == "nframes":
-                if "nb_read_frames" in ffprobeOutput["streams"][videoStream].keys():
-                    returnVal = float(
-                        ffprobeOutput["streams"][videoStream]["nb_read_frames"]
-                    )
+                if _needs_packet_count(ffprobeOutput, method):
+                    # No trustworthy count in the header; count packets instead
+                    try:
+                        packetOutput = probe_video(
+                            vidPath, "count_packets", useCache=useCache
+                        )
+                        returnVal = frames_from_probe(
+                            packetOutput["streams"][videoStream], "packets"
+                        )
+                    except sp.CalledProcessError:
+                        returnVal = None
                 else:
+                    returnVal = frames_from_probe(
+                        ffprobeOutput["streams"][videoStream],
+                        method,
+                        ffprobeOutput.get("format", {}).get("duration"),
+                    )
+                if returnVal is None:
                     returnVal = 0
-                    warnings.warn("No frame data for {}".format(vidPath))
+                    note("No frame data for {}".format(vidPath))
             elif attr == "width":
                 returnVal = float(ffprobeOutput["streams"][videoStream]["width"])
             elif attr == "height":
                 returnVal = float(ffprobeOutput["streams"][videoStream]["height"])
-            elif attr == "vidduration":
-                returnVal = float(ffprobeOutput["streams"][videoStream]["duration"])
-            elif attr == "audduration":
-                returnVal = float(ffprobeOutput["streams"][audioStream]["duration"])
+            elif attr in ["vidduration", "audduration"]:
+                stream = ffprobeOutput["streams"][
+                    videoStream if attr == "vidduration" else audioStream
+                ]
+                # Some containers (e.g. webm) only give the overall duration
+                if "duration" in stream:
+                    returnVal = float(stream["duration"])
+                else:
+                    returnVal = float(ffprobeOutput["format"]["duration"])
+            elif attr == "framerate":
+                (num, den) = ffprobeOutput["streams"][videoStream][
+                    "avg_frame_rate"
+                ].split("/")
+                returnVal = float(num) / float(den) if float(den) else 0
         else:
             raise ValueError("Unrecognized attribute requested")
         attributes.append(returnVal)
 
-    # Return just a string if there's only one return value in the list
-    if len(attributes) == 1:
-        attributes = attributes[0]
+    return (attributes, errors)
 
-    return attributes
+
+@dataclass
+class ProbeResult:
+    """Details about one video from probe_many.
+
+    values: dict mapping each requested attribute to its value (-1 if ffprobe
+        failed; see get_video_details for other defaults)
+    errors: list of messages about problems probing this video"""
+
+    path: str
+    values: dict = field(default_factory=dict)
+    errors: list = field(default_factory=list)
+
+    @property
+    def ok(self):
+        return not self.errors
+
+
+def probe_many(paths, whichAttr, workers=8, useCache=True, method="auto"):
+    """Retrieve details about many videos, running several ffprobes at once.
+
+    paths: list of full paths to video files
+    whichAttr: single attribute or list of attributes to retrieve for each video;
+        see get_video_details for options
+    workers: maximum number of ffprobe processes to run at the same time
+
+    Each file is probed once no matter how many attributes are requested, and
+    results are shared with get_video_details through the probe cache. Rather than
+    warning, problems are collected per file. Returns a dict mapping each path to
+    a ProbeResult."""
+
+    if isinstance(whichAttr, str):
+        whichAttr = [whichAttr]
+    for attr in whichAttr:
+        if attr not in VIDEO_ATTRIBUTES:
+            raise ValueError("Unrecognized attribute requested: {}".format(attr))
+    if method not in FRAME_COUNT_KINDS:
+        raise ValueError("Unrecognized frame counting method {}".format(method))
+    kind = FRAME_COUNT_KINDS[method] if "nframes" in whichAttr else "streams"
+
+    def probe_one(vidPath):
+        result = ProbeResult(vidPath)
+        try:
+            ffprobeOutput = probe_video(vidPath, kind, useCache=useCache)
+        except (sp.CalledProcessError, OSError, ValueError) as e:
+            result.values = {attr: -1 for attr in whichAttr}
+            result.errors.append("Error running ffprobe on {}: {}".format(vidPath, e))
+            return result
+        try:
+            (values, result.errors) = details_from_probe(
+                ffprobeOutput, whichAttr, vidPath, useCache=useCache, method=method
+            )
+        except (KeyError, IndexError, ValueError, ZeroDivisionError) as e:
+            # Output missing something an attribute needs (e.g. a stream's size)
+            result.values = {attr: -1 for attr in whichAttr}
+            result.errors.append(
+                "Unexpected ffprobe output for {}: {!r}".format(vidPath, e)
+            )
+            return result
+        result.values = dict(zip(whichAttr, values))
+        return result
+
+    # Threads only wait on ffprobe subprocesses, so this bounds the number of
+    # concurrent ffprobe processes to workers.
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        return dict(zip(paths, pool.map(probe_one, paths)))
+
+
+# Lazy filter graphs: a Clip records the operations applied to a video and only
+# runs ffmpeg when rendered, so a whole chain of operations (and several outputs
+# sharing parts of it) is done by one ffmpeg process.
+
+
+class _ClipNode:
+    """One stream in a Clip graph: an input file's video or audio ("v" or "a"), or
+    the output of a filter applied to parent nodes."""
+
+    def __init__(self, kind, filter=None, parents=(), source=None):
+        self.kind = kind
+        self.filter = filter
+        self.parents = list(parents)
+        self.source = source
+
+    def key(self):
+        # Nodes reading the same stream of the same file share one decode
+        if self.source is not None:
+            return ("input", os.path.abspath(self.source), self.kind)
+        return id(self)
+
+
+class Clip:
+    """A video (and optionally its audio) described by operations on input files.
+
+    Nothing is run until render is called; then all of the operations leading to
+    one or more outputs are compiled into a single ffmpeg filter_complex, and each
+    input file is decoded once however many times it is used. For example, to make
+    a cropped, flipped, faded clip and a side-by-side of it with the original:
+
+        orig = Clip("raw.mp4").crop(640, 640)
+        flipped = orig.hflip().fade(0.5, 0.5, color="0x009EFC")
+        sbs = orig.pad("iw*2", "ih").overlay_with(flipped, x="w")
+        render_clips([flipped.export("flipped.mp4"), sbs.export("sbs.mp4", width=640)])
+
+    Clip(path, audio=None): audio is whether to use the file's audio; by default it's
+    used if the file has an audio stream. Operations that change timing (trim,
+    concat) are applied to the audio too; others only affect the video."""
+
+    def __init__(self, path, audio=None):
+        if audio is None:
+            audio = has_stream(path, "audio")
+        self.video = _ClipNode("v", source=path)
+        self.audio = _ClipNode("a", source=path) if audio else None
+        self._duration = lambda: get_video_details(path, "vidduration")
+
+    @classmethod
+    def _from_nodes(cls, video, audio, duration):
+        clip = cls.__new__(cls)
+        clip.video = video
+        clip.audio = audio
+        clip._duration = duration
+        return clip
+
+    @property
+    def duration(self):
+        """Duration in seconds (probed from the input files as needed)."""
+        return self._duration()
+
+    def filter(self, videoFilter, audioFilter=None):
+        """Apply any ffmpeg video filter string (and audio filter string, if given
+        and the clip has audio). The filters must not change the duration."""
+        video = _ClipNode("v", videoFilter, [self.video]) if videoFilter else self.video
+        audio = self.audio
+        if audioFilter and audio is not None:
+            audio = _ClipNode("a", audioFilter, [audio])
+        return Clip._from_nodes(video, audio, self._duration)
+
+    def crop(self, width, height, x="(in_w-out_w)/2", y="(in_h-out_h)/2"):
+        """Crop to width x height pixels with top left corner at (x, y); centered by
+        default. Any value can be an ffmpeg expression such as 'iw/2'."""
+        return self.filter("crop={}:{}:{}:{}".format(width, height, x, y))
+
+    def scale(self, width, height=-2):
+        """Scale to width x height pixels; height -2 keeps the aspect ratio."""
+        return self.filter("scale={}:{}".format(width, height))
+
+    def hflip(self):
+        return self.filter("hflip")
+
+    def vflip(self):
+        return self.filter("vflip")
+
+    def pad(self, width, height, x=0, y=0, color="black"):
+        """Pad to width x height pixels, placing the video at (x, y)."""
+        return self.filter(
+            "pad=width={}:height={}:x={}:y={}:color={}".format(
+                width, height, x, y, color
+            )
+        )
+
+    def fade(self, fadeIn=0, fadeOut=0, color="black", audio=True):
+        """Fade in from color over the first fadeIn seconds and out to color over
+        the last fadeOut seconds. The fade out starts from the clip's duration,
+        which is probed from the inputs and cached. If audio, the sound fades too."""
+        videoFilters = []
+        audioFilters = []
+        if fadeIn:
+            videoFilters.append("fade=t=in:st=0:d={}:color={}".format(fadeIn, color))
+            audioFilters.append("afade=t=in:st=0:d={}".format(fadeIn))
+        if fadeOut:
+            start = max(0, self.duration - fadeOut)
+            videoFilters.append(
+                "fade=t=out:st={}:d={}:color={}".format(start, fadeOut, color)
+            )
+            audioFilters.append("afade=t=out:st={}:d={}".format(start, fadeOut))
+        return self.filter(
+            ",".join(videoFilters), ",".join(audioFilters) if audio else None
+        )
+
+    def trim(self, start=0, end=None):
+        """Keep only the part of the clip from start to end seconds (end None for the
+        rest of the clip), starting the result at time 0."""
+        bounds = "start={}".format(start) + (":end={}".format(end) if end else "")
+        clip = self.filter(
+            "trim={},setpts=PTS-STARTPTS".format(bounds),
+            "atrim={},asetpts=PTS-STARTPTS".format(bounds),
+        )
+        if end:
+            clip._duration = lambda: end - start
+        else:
+            clip._duration = lambda: self.duration - start
+        return clip
+
+    def overlay_with(self, other, x=0, y=0, audio="self"):
+        """Overlay other on this clip with other's top left corner at (x, y), which
+        can be ffmpeg overlay expressions (e.g. 'W-w'). The result lasts as long as
+        this clip; other's last frame is held if it is shorter.
+
+        audio: 'self' or 'other' to use the audio of one clip, 'mix' to mix both,
+            or None for no audio"""
+        video = _ClipNode(
+            "v",
+            "overlay=x={}:y={}:eof_action=repeat:shortest=0".format(x, y),
+            [self.video, other.video],
+        )
+        if audio == "mix" and self.audio is not None and other.audio is not None:
+            audioNode = _ClipNode(
+                "a",
+                "amix=inputs=2:duration=first:dropout_transition=0",
+                [self.audio, other.audio],
+            )
+        elif audio == "mix":
+            audioNode = self.audio or other.audio
+        elif audio == "other":
+            audioNode = other.audio
+        elif audio == "self":
+            audioNode = self.audio
+        else:
+            audioNode = None
+        return Clip._from_nodes(video, audioNode, self._duration)
+
+    def concat(self, *others):
+        """This clip followed by each of others. They must have the same size. Audio
+        is kept only if every clip has audio."""
+        clips = [self] + list(others)
+        video = _ClipNode(
+            "v",
+            "concat=n={}:v=1:a=0".format(len(clips)),
+            [clip.video for clip in clips],
+        )
+        audio = None
+        if all(clip.audio is not None for clip in clips):
+            audio = _ClipNode(
+                "a",
+                "concat=n={}:v=0:a=1".format(len(clips)),
+                [clip.audio for clip in clips],
+            )
+        return Clip._from_nodes(
+            video, audio, lambda: sum(clip.duration for clip in clips)
+        )
+
+    def export(self, path, format=None, width="original", rate=1000, outputArgs=()):
+        """Describe an output file made from this clip, to pass to render_clips.
+
+        format: None to let ffmpeg choose codecs from the extension, or "mp4" or
+            "webm" to encode for the web as make_mp4 and make_webm do (at bitrate
+            rate, in kbps), in yuv420p for browsers that can't play other pixel
+            formats
+        width: 'original' or width in pixels to scale to
+        outputArgs: further ffmpeg output options"""
+        clip = self if width == "original" else self.scale(width)
+        options = []
+        if format:
+            options = web_codec_args(format, rate) + ["-pix_fmt", "yuv420p"]
+        return ClipOutput(clip, path, options + list(outputArgs))
+
+    def render(self, path, **exportOptions):
+        """Make a single output from this clip; see export for options."""
+        return render_clips([self.export(path, **exportOptions)])
+
+
+ClipOutput = namedtuple("ClipOutput", ["clip", "path", "options"])
+
+
+def compile_clips(outputs):
+    """The ffmpeg command making a list of ClipOutputs (from Clip.export)."""
+    order = []
+    seen = set()
+
+    def visit(node):
+        if node.key() in seen:
+            return
+        seen.add(node.key())
+        for parent in node.parents:
+            visit(parent)
+        order.append(node)
+
+    streams = []
+    for output in outputs:
+        streams.append(
+            [output.clip.video] + ([output.clip.audio] if output.clip.audio else [])
+        )
+        for node in streams[-1]:
+            visit(node)
+
+    # Streams used more than once are split
+    nUses = {node.key(): 0 for node in order}
+    for node in order:
+        for parent in node.parents:
+            nUses[parent.key()] += 1
+    for nodes in streams:
+        for node in nodes:
+            nUses[node.key()] += 1
+
+    inputs = []
+    inputKeys = []
+    filters = []
+    labels = {}
+    for (iNode, node) in enumerate(order):
+        if node.source is not None:
+            if os.path.abspath(node.source) not in inputKeys:
+                inputKeys.append(os.path.abspath(node.source))
+                inputs.append(node.source)
+            label = "[{}:{}]".format(
+                inputKeys.index(os.path.abspath(node.source)), node.kind
+            )
+        else:
+            label = "[{}{}]".format(node.kind, iNode)
+            filters.append(
+                "".join(labels[parent.key()].pop(0) for parent in node.parents)
+                + node.filter
+                + label
+            )
+        n = nUses[node.key()]
+        if n > 1:
+            splitLabels = ["[{}{}_{}]".format(node.kind, iNode, i) for i in range(n)]
+            filters.append(
+                label
+                + ("split" if node.kind == "v" else "asplit")
+                + "={}".format(n)
+                + "".join(splitLabels)
+            )
+            labels[node.key()] = splitLabels
+        else:
+            labels[node.key()] = [label]
+
+    command = ["ffmpeg"]
+    for path in inputs:
+        command = command + ["-i", path]
+    if filters:
+        command = command + ["-filter_complex", ";".join(filters)]
+    for (output, nodes) in zip(outputs, streams):
+        for node in nodes:
+            label = labels[node.key()].pop(0)
+            # Unfiltered input streams are mapped as e.g. 0:v rather than [0:v]
+            command = command + [
+                "-map",
+                label.strip("[]")
+                if node.source is not None and nUses[node.key()] == 1
+                else label,
+            ]
+        command = command + output.options + [output.path]
+    return command
+
+
+def render_clips(outputs, check=True, overwrite=True):
+    """Make the outputs (ClipOutputs from Clip.export) with one ffmpeg process.
+
+    overwrite: whether to overwrite existing output files
+
+    Returns the ffmpeg return code (raises subprocess.CalledProcessError on failure
+    if check)."""
+    for output in outputs:
+        if os.path.dirname(output.path):
+            make_sure_path_exists(os.path.dirname(output.path))
+    return run_ffmpeg(
+        compile_clips(outputs),
+        [output.path for output in outputs],
+        check=check,
+        overwrite=overwrite,
+    )
+
+
+# Async versions of the main functions, for use from an asyncio event loop. They
+# build the same commands as the functions above, but wait for ffmpeg and ffprobe
+# without blocking the loop or needing a thread per process.
+
+_asyncLimit = os.cpu_count() or 1
+_asyncSemaphores = weakref.WeakKeyDictionary()
+# Set while starting the processes of an arun_pipeline, which share one slot
+_asyncInPipeline = contextvars.ContextVar("_asyncInPipeline", default=False)
+
+
+def set_async_concurrency(limit):
+    """Set the maximum number of ffmpeg and ffprobe processes that the async
+    functions (amake_mp4, aget_video_details, etc.) run at once in each event loop.
+    Defaults to the number of CPUs. Set it before starting any async work."""
+    global _asyncLimit
+    _asyncLimit = max(1, limit)
+    _asyncSemaphores.clear()
+
+
+def _async_semaphore():
+    loop = asyncio.get_running_loop()
+    if loop not in _asyncSemaphores:
+        _asyncSemaphores[loop] = asyncio.Semaphore(_asyncLimit)
+    return _asyncSemaphores[loop]
+
+
+async def _run_process_async(command, label, outputs=(), captureOutput=False):
+    """Run a process once the shared semaphore allows, reporting it to the current
+    FFmpegRunner. If the task is cancelled, the process is killed.
+
+    Returns (return code, stdout if captureOutput else None)."""
+    runner = get_ffmpeg_runner()
+    progress = False
+    runCommand = command
+    if not captureOutput:
+        (runCommand, progress) = runner.progress_command(command)
+
+    # Pipeline stages must all run at once, so they don't wait for a slot each
+    semaphore = None if _asyncInPipeline.get() else _async_semaphore()
+    if semaphore is not None:
+        await semaphore.acquire()
+    try:
+        startTime = time.time()
+        proc = await asyncio.create_subprocess_exec(
+            *runCommand,
+            stdin=sp.DEVNULL,
+            stdout=sp.PIPE if (progress or captureOutput) else None,
+        )
+        try:
+            out = None
+            latest = {}
+            if progress:
+                report = {}
+                async for line in proc.stdout:
+                    if runner.progress_line(line.decode("utf-8", "replace"), report):
+                        (latest, report) = (report, {})
+            elif captureOutput:
+                out = await proc.stdout.read()
+            returnCode = await proc.wait()
+        except asyncio.CancelledError:
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            raise
+    finally:
+        if semaphore is not None:
+            semaphore.release()
+
+    # CPU time and memory aren't measured, since the event loop reaps the process
+    stats = FFmpegJobStats(
+        label, list(command), list(outputs), returnCode, time.time() - startTime
+    )
+    runner.report(stats, latest)
+    return (returnCode, out)
+
+
+async def arun_ffmpeg(
+    command,
+    outputs,
+    inputs=None,
+    check=True,
+    incremental=True,
+    overwrite=False,
+    label=None,
+):
+    """Async version of run_ffmpeg. Cancelling it kills ffmpeg."""
+
+    manifest = get_build_manifest() if incremental else None
+    if inputs is None:
+        inputs = command_inputs(command)
+    if label is None:
+        label = sys._getframe(1).f_code.co_name
+
+    # The manifest hashes files and writes JSON, so use it in a worker thread
+    loop = asyncio.get_running_loop()
+    if manifest is not None and await loop.run_in_executor(
+        None, manifest.is_fresh, command, inputs, outputs
+    ):
+        get_ffmpeg_runner().skipped(command, outputs, label)
+        return 0
+
+    if overwrite or manifest is not None:
+        runCommand = command[:1] + ["-y"] + command[1:]
+    else:
+        runCommand = command
+
+    (returnCode, out) = await _run_process_async(runCommand, label, outputs)
+    if returnCode:
+        if check:
+            raise sp.CalledProcessError(returnCode, runCommand)
+        warnings.warn(
+            "ffmpeg exited with code {} making {}".format(returnCode, outputs)
+        )
+
+    if manifest is not None and returnCode == 0:
+        await loop.run_in_executor(None, manifest.record, command, inputs, outputs)
+    return returnCode
+
+
+async def arun_pipeline(commands, outputs, fifos, inputs=None, incremental=True):
+    """Async version of run_pipeline. If any command fails (or the pipeline is
+    cancelled), the other processes are killed."""
+
+    manifest = get_build_manifest() if incremental else None
+    if inputs is None:
+        inputs = [i for command in commands for i in command_inputs(command)]
+    loop = asyncio.get_running_loop()
+    if manifest is not None and await loop.run_in_executor(
+        None, manifest.is_fresh, commands, inputs, outputs
+    ):
+        return 0
+
+    async with _async_semaphore():
+        (runCommands, pipes, fifoDir) = _make_fifos(commands, fifos)
+        # The whole pipeline counts as one process towards set_async_concurrency
+        token = _asyncInPipeline.set(True)
+        tasks = [
+            asyncio.ensure_future(
+                arun_ffmpeg(
+                    command,
+                    [command[-1]],
+                    incremental=False,
+                    overwrite=True,
+                    label="arun_pipeline",
+                )
+            )
+            for command in runCommands
+        ]
+        _asyncInPipeline.reset(token)
+        try:
+            # Wait for the last command; earlier ones failing before it finishes
+            # is an error, but once it's done they may be cut off (see run_pipeline)
+            pending = set(tasks)
+            while not tasks[-1].done():
+                (done, pending) = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                if tasks[-1] in done:
+                    break
+                for task in done:
+                    if task.exception():
+                        raise task.exception()
+            if tasks[-1].exception():
+                raise tasks[-1].exception()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            _remove_fifos(pipes, fifoDir)
+
+    if manifest is not None:
+        await loop.run_in_executor(None, manifest.record, commands, inputs, outputs)
+    return 0
+
+
+async def aprobe_video(vidPath, kind="streams", useCache=True):
+    """Async version of probe_video."""
+    loop = asyncio.get_running_loop()
+    if useCache:
+        # The cache is an SQLite file, so read and write it in a worker thread
+        ffprobeOutput = await loop.run_in_executor(None, _cached_probe, vidPath, kind)
+        if ffprobeOutput is not None:
+            return ffprobeOutput
+
+    args = shlex.split(PROBE_KINDS[kind]) + [vidPath]
+    (returnCode, out) = await _run_process_async(
+        args, "probe_" + kind, captureOutput=True
+    )
+    if returnCode:
+        raise sp.CalledProcessError(returnCode, args, output=out)
+    ffprobeOutput = json.loads(out.decode("utf-8"))
+
+    if useCache:
+        await loop.run_in_executor(
+            None, get_probe_cache().put, vidPath, kind, ffprobeOutput
+        )
+    return ffprobeOutput
+
+
+async def aget_video_details(vidPath, whichAttr, useCache=True, method="auto"):
+    """Async version of get_video_details."""
+
+    if isinstance(whichAttr, str):
+        whichAttr = [whichAttr]
+    if method not in FRAME_COUNT_KINDS:
+        raise ValueError("Unrecognized frame counting method {}".format(method))
+    kind = FRAME_COUNT_KINDS[method] if "nframes" in whichAttr else "streams"
+    try:
+        ffprobeOutput = await aprobe_video(vidPath, kind, useCache=useCache)
+        if "nframes" in whichAttr and _needs_packet_count(ffprobeOutput, method):
+            # Count packets here rather than letting details_from_probe do it
+            # with a blocking ffprobe call
+            ffprobeOutput = await aprobe_video(
+                vidPath, "count_packets", useCache=useCache
+            )
+            method = "packets"
+    except (sp.CalledProcessError, OSError, ValueError):
+        warnings.warn(
+            "Error running ffprobe command {} to get video details about {}, returning -1".format(
+                PROBE_KINDS[kind] + " " + vidPath, vidPath
+            )
+        )
+        return -1 if len(whichAttr) == 1 else [-1] * len(whichAttr)
+
+    (attributes, errors) = details_from_probe(
+        ffprobeOutput, whichAttr, vidPath, useCache=useCache, method=method
+    )
+    for err in errors:
+        warnings.warn(err)
+    return attributes[0] if len(attributes) == 1 else attributes
+
+
+async def _ahas_stream(vidPath, codecType):
+    try:
+        streams = (await aprobe_video(vidPath))["streams"]
+    except (sp.CalledProcessError, OSError, ValueError):
+        return False
+    return any(stream["codec_type"] == codecType for stream in streams)
+
+
+async def amake_mp4(
+    inputpath, mp4dir, width="original", overwrite=True, rate=1000, threads=None
+):
+    """Async version of make_mp4."""
+    (command, outpath) = web_export_command(
+        "mp4", inputpath, mp4dir, width, rate, threads
+    )
+    if overwrite or not os.path.exists(outpath) or get_build_manifest() is not None:
+        await arun_ffmpeg(command, [outpath], overwrite=overwrite)
+
+
+async def amake_webm(
+    inputpath, webmdir, width="original", overwrite=True, rate=1000, threads=None
+):
+    """Async version of make_webm."""
+    (command, outpath) = web_export_command(
+        "webm", inputpath, webmdir, width, rate, threads
+    )
+    if overwrite or not os.path.exists(outpath) or get_build_manifest() is not None:
+        await arun_ffmpeg(command, [outpath], overwrite=overwrite)
+
+
+async def amake_web_exports(
+    inputpath, outdir, targets=None, overwrite=True, threads=None
+):
+    """Async version of make_web_exports."""
+    (outpaths, todo) = _web_export_targets(inputpath, outdir, targets, overwrite)
+    if not todo:
+        return outpaths
+    command = _web_exports_command(
+        inputpath, todo, await _ahas_stream(inputpath, "audio"), threads
+    )
+    await arun_ffmpeg(
+        command, [outpath for (target, outpath) in todo], overwrite=overwrite
+    )
+    return outpaths
+
+
+async def aconcat_mp4s(concatPath, vidPaths, mode="auto"):
+    """Async version of concat_mp4s."""
+    if not len(vidPaths):
+        return 0
+    if mode not in ["auto", "copy", "reencode"]:
+        raise ValueError("Unrecognized concatenation mode {}".format(mode))
+
+    if mode == "auto":
+        try:
+            probes = await asyncio.gather(*(aprobe_video(vid) for vid in vidPaths))
+            mode = "copy" if _streams_match(probes) else "reencode"
+        except (sp.CalledProcessError, OSError, ValueError):
+            mode = "reencode"
+
+    if mode == "copy":
+        listPath = _write_concat_list(concatPath, vidPaths)
+        try:
+            return await arun_ffmpeg(
+                _concat_copy_command(concatPath, listPath),
+                [concatPath],
+                inputs=vidPaths,
+                check=False,
+            )
+        finally:
+            os.remove(listPath)
+    return await arun_ffmpeg(
+        _concat_command(concatPath, vidPaths), [concatPath], check=False
+    )
+
+
+async def amake_collage(
+    videoDir,
+    videoList,
+    nCols,
+    outPath,
+    doSound,
+    exportWidth,
+    vidHeight=[],
+    cropSquare=False,
+    engine="overlay",
+    tempFiles=False,
+    fillColor="black",
+    intermediates="files",
+    vidWidth=None,
+):
+    """Async version of make_collage.
+
+    The numpy engine composes frames in a worker thread (holding one slot of the
+    async concurrency limit), and its decoders are not killed if cancelled."""
+
+    if engine not in ["overlay", "xstack", "numpy"]:
+        raise ValueError("Unrecognized collage engine {}".format(engine))
+    if engine != "overlay":
+        # Probe the inputs concurrently, under the async concurrency limit, so
+        # that planning the layout finds them in the cache
+        await asyncio.gather(
+            *(aprobe_video(os.path.join(videoDir, v)) for v in videoList if v),
+            return_exceptions=True,
+        )
+    # Planning reads the probe cache, an SQLite file, so run it in a worker
+    # thread, as with the build manifest below
+    loop = asyncio.get_running_loop()
+    plan = await loop.run_in_executor(
+        None,
+        _collage_steps,
+        videoDir,
+        videoList,
+        nCols,
+        outPath,
+        doSound,
+        vidHeight,
+        cropSquare,
+        engine,
+        tempFiles,
+        fillColor,
+        intermediates,
+        vidWidth,
+    )
+    (steps, layout, outPath) = (plan["steps"], plan["layout"], plan["outPath"])
+
+    manifest = get_build_manifest()
+    inputs = plan["inputs"]
+    if plan["fifos"]:
+        await arun_pipeline(steps, [outPath], plan["fifos"], inputs)
+    elif manifest is None or not await loop.run_in_executor(
+        None, manifest.is_fresh, steps, inputs, [outPath]
+    ):
+        for command in steps:
+            if command[0] == "videotools.compose_collage_numpy":
+                async with _async_semaphore():
+                    await loop.run_in_executor(
+                        None,
+                        compose_collage_numpy,
+                        layout,
+                        command[-1],
+                        plan["mixSound"],
+                    )
+                continue
+            await arun_ffmpeg(command, [command[-1]], incremental=False, overwrite=True)
+
+        for intermediate in plan["intermediates"]:
+            os.remove(intermediate)
+
+        if manifest is not None:
+            await loop.run_in_executor(None, manifest.record, steps, inputs, [outPath])
+
+    if exportWidth != 0:
+        (exportDir, baseFilename) = os.path.split(outPath)
+        exportDir = os.path.join(exportDir, "export")
+        make_sure_path_exists(exportDir)
+        await amake_web_exports(
+            outPath, exportDir, _collage_export_targets(exportWidth)
+        )
+
+
+# Render queue: videotools operations stored as jobs in a shared SQLite file, so
+# that several machines can work through a large build together.
+
+RENDER_OPS = {
+    "make_mp4": make_mp4,
+    "make_webm": make_webm,
+    "make_web_exports": make_web_exports,
+    "make_collage": make_collage,
+    "makeSideBySide": makeSideBySide,
+    "make_side_by_side_variants": make_side_by_side_variants,
+    "concat_mp4s": concat_mp4s,
+    "time_crop_video": time_crop_video,
+    "make_calibration_videos": make_calibration_videos,
+}
+
+
+# For each operation, a function of its arguments (by name, defaults included)
+# giving the paths of the files it reads
+RENDER_OP_INPUTS = {
+    "make_mp4": lambda a: [a["inputpath"]],
+    "make_webm": lambda a: [a["inputpath"]],
+    "make_web_exports": lambda a: [a["inputpath"]],
+    "make_collage": lambda a: [
+        os.path.join(a["videoDir"], v) for v in a["videoList"] if v
+    ],
+    "makeSideBySide": lambda a: [a["leftVideoPath"], a["rightVideoPath"]],
+    "make_side_by_side_variants": lambda a: [a["leftVideoPath"], a["rightVideoPath"]],
+    "concat_mp4s": lambda a: list(a["vidPaths"]),
+    "time_crop_video": lambda a: [a["inputPath"]],
+    "make_calibration_videos": lambda a: [a["source"]],
+}
+
+
+def _job_input_hashes(op, args, kwargs):
+    """Dict mapping each input file of a job to a hash of its contents (None if
+    the file doesn't exist)."""
+    if op not in RENDER_OP_INPUTS:
+        raise ValueError("No inputs declared for render operation {}".format(op))
+    bound = inspect.signature(RENDER_OPS[op]).bind(*args, **kwargs)
+    bound.apply_defaults()
+    hashes = {}
+    for path in RENDER_OP_INPUTS[op](bound.arguments):
+        if os.path.isfile(path):
+            hashes[path] = file_fingerprint(path, hashContent=True)[2]
+        else:
+            hashes[path] = None
+    return hashes
+
+
+class RenderQueue:
+    """Queue of videotools operations to be run by RenderWorkers, stored in SQLite.
+
+    Each job is a descriptor {"op": name, "args": [...], "kwargs": {...}} naming an
+    operation in RENDER_OPS; arguments must be JSON-serializable, and paths must be
+    valid on the machines running workers (e.g. on a shared filesystem). A job's
+    key is a sha256 hash of its descriptor and the contents of its input files
+    (as listed by RENDER_OP_INPUTS; outputs aren't included), so submitting the
+    same job twice only queues it once, while changing an input makes a new job.
+    To add an operation, add it to both RENDER_OPS and RENDER_OP_INPUTS.
+
+    Workers claim jobs for leaseSeconds, and renew the lease while a job runs; a
+    job whose worker dies is claimed again once its lease runs out. A job is
+    tried up to maxAttempts times in all, whether it failed or its worker died.
+    Outputs go to the paths given in the job, so a retry simply overwrites them.
+    Only the worker holding a job's lease can record its outcome, so a worker
+    that lost its lease can't overwrite the status set by the job's new owner.
+
+    The SQLite file can be used by several processes on one machine, or shared
+    between machines on a filesystem with working file locks. A connection is
+    opened per operation, as in ProbeCache."""
+
+    def __init__(self, path, leaseSeconds=3600):
+        self.path = path
+        self.leaseSeconds = leaseSeconds
+        if os.path.dirname(path):
+            make_sure_path_exists(os.path.dirname(path))
+        with self._connect() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    key TEXT PRIMARY KEY, op TEXT, descriptor TEXT, status TEXT,
+                    attempts INTEGER, maxAttempts INTEGER, worker TEXT,
+                    leaseUntil REAL, submitted REAL, started REAL, finished REAL,
+                    result TEXT, error TEXT, metrics TEXT)"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)")
+        conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=60, isolation_level=None)
+
+    def submit(self, op, args=(), kwargs=None, maxAttempts=3):
+        """Queue a job running RENDER_OPS[op](*args, **kwargs); return its key.
+
+        If the same job is already in the queue (whatever its status), it is not
+        added again."""
+        if op not in RENDER_OPS:
+            raise ValueError("Unrecognized render operation {}".format(op))
+        descriptor = {"op": op, "args": list(args), "kwargs": dict(kwargs or {})}
+        descriptorJson = json.dumps(descriptor, sort_keys=True)
+        inputHashes = _job_input_hashes(op, descriptor["args"], descriptor["kwargs"])
+        key = hashlib.sha256(
+            (descriptorJson + json.dumps(inputHashes, sort_keys=True)).encode("utf-8")
+        ).hexdigest()
+        with self._connect() as conn:
+            conn.execute(
+                """INSERT OR IGNORE INTO jobs (key, op, descriptor, status, attempts,
+                    maxAttempts, submitted) VALUES (?, ?, ?, 'queued', 0, ?, ?)""",
+                (key, op, descriptorJson, maxAttempts, time.time()),
+            )
+        conn.close()
+        return key
+
+    def claim(self, worker):
+        """Take the oldest job that's ready to run. Returns (key, descriptor), or
+        None if there is nothing to do."""
+        now = time.time()
+        conn = self._connect()
+        try:
+            # Take the write lock first so two workers can't claim the same job
+            conn.execute("BEGIN IMMEDIATE")
+            # A job whose worker died on its last attempt isn't run again
+            conn.execute(
+                """UPDATE jobs SET status='failed', finished=?,
+                    error='Lease ran out on the last attempt'
+                    WHERE status='running' AND leaseUntil < ?
+                    AND attempts >= maxAttempts""",
+                (now, now),
+            )
+            row = conn.execute(
+                """SELECT key, descriptor FROM jobs WHERE status='queued' OR
+                    (status='running' AND leaseUntil < ?)
+                    ORDER BY submitted LIMIT 1""",
+                (now,),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    """UPDATE jobs SET status='running', attempts=attempts+1,
+                        worker=?, leaseUntil=?, started=? WHERE key=?""",
+                    (worker, now + self.leaseSeconds, now, row[0]),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        return (row[0], json.loads(row[1]))
+
+    def renew(self, key, worker):
+        """Extend worker's lease on a running job by leaseSeconds from now.
+
+        Returns False if worker no longer holds the job (e.g. the lease ran out
+        and another worker claimed it)."""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                """UPDATE jobs SET leaseUntil=? WHERE key=? AND worker=?
+                    AND status='running'""",
+                (time.time() + self.leaseSeconds, key, worker),
+            )
+        conn.close()
+        return cursor.rowcount > 0
+
+    def complete(self, key, worker, result=None, metrics=None):
+        """Record that worker's job succeeded, with its return value and metrics.
+
+        Returns False, changing nothing, if worker no longer holds the job."""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                """UPDATE jobs SET status='done', finished=?, result=?, metrics=?,
+                    error=NULL WHERE key=? AND worker=? AND status='running'""",
+                (
+                    time.time(),
+                    json.dumps(result, default=str),
+                    json.dumps(metrics),
+                    key,
+                    worker,
+                ),
+            )
+        conn.close()
+        return cursor.rowcount > 0
+
+    def fail(self, key, worker, error, metrics=None):
+        """Record that worker's job failed. It's queued again unless it has used up
+        its attempts, in which case its status becomes 'failed'.
+
+        Returns False, changing nothing, if worker no longer holds the job."""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                """UPDATE jobs SET status=CASE WHEN attempts < maxAttempts
+                    THEN 'queued' ELSE 'failed' END, finished=?, error=?, metrics=?
+                    WHERE key=? AND worker=? AND status='running'""",
+                (time.time(), error, json.dumps(metrics), key, worker),
+            )
+        conn.close()
+        return cursor.rowcount > 0
+
+    def job(self, key):
+        """Dict describing a job (status, attempts, result, metrics, etc.), or None."""
+        conn = self._connect()
+        conn.row_factory = sqlite3.Row
+        row = conn.execute("SELECT * FROM jobs WHERE key=?", (key,)).fetchone()
+        conn.close()
+        if row is None:
+            return None
+        job = dict(row)
+        for col in ["descriptor", "result", "metrics"]:
+            if job[col] is not None:
+                job[col] = json.loads(job[col])
+        return job
+
+    def counts(self):
+        """Dict mapping each status ('queued', 'running', 'done', 'failed') to the
+        number of jobs with that status."""
+        conn = self._connect()
+        rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")
+        counts = {"queued": 0, "running": 0, "done": 0, "failed": 0}
+        counts.update(dict(rows.fetchall()))
+        conn.close()
+        return counts
+
+    def retry_failed(self):
+        """Queue all failed jobs again, each with one more attempt."""
+        with self._connect() as conn:
+            conn.execute(
+                """UPDATE jobs SET status='queued', maxAttempts=attempts+1
+                    WHERE status='failed'"""
+            )
+        conn.close()
+
+
+class RenderWorker:
+    """Runs jobs from a RenderQueue until there are none left.
+
+    queue: RenderQueue (or path to its SQLite file)
+    name: name recorded with each job claimed; defaults to hostname:pid
+    manifest: BuildManifest or path to one, used while running jobs so that
+        outputs that are already up to date (e.g. from an earlier attempt that
+        failed later on) aren't remade and stale ones are overwritten. Defaults
+        to a manifest next to the queue file, named for this worker. Workers
+        running at the same time must not share a manifest.
+
+    While a job runs, its lease is renewed every third of the queue's
+    leaseSeconds, so long encodes aren't handed to another worker. If the lease
+    is lost anyway, the job's outcome isn't recorded.
+
+    The ffmpeg processes a job starts are measured as by FFmpegRunner (in
+    addition to any sinks already set), and a summary is stored with the job's
+    result. A job fails if its operation raises an exception or
+    any ffmpeg process it runs fails."""
+
+    def __init__(self, queue, name=None, manifest=None):
+        if isinstance(queue, str):
+            queue = RenderQueue(queue)
+        self.queue = queue
+        self.name = name or "{}:{}".format(socket.gethostname(), os.getpid())
+        if manifest is None:
+            manifest = "{}.{}.manifest.json".format(
+                os.path.splitext(queue.path)[0], re.sub(r"[^\w.-]", "_", self.name)
+            )
+        if isinstance(manifest, str):
+            manifest = BuildManifest(manifest)
+        self.manifest = manifest
+
+    def _renew_lease(self, key, stop):
+        while not stop.wait(self.queue.leaseSeconds / 3):
+            if not self.queue.renew(key, self.name):
+                warnings.warn("Lost the lease on render job {}".format(key))
+                return
+
+    def run_job(self, key, descriptor):
+        """Run one claimed job and record the outcome in the queue. Returns whether
+        it succeeded."""
+        stopRenewing = threading.Event()
+        renewer = threading.Thread(
+            target=self._renew_lease, args=(key, stopRenewing), daemon=True
+        )
+        renewer.start()
+        stats = []
+        previousRunner = get_ffmpeg_runner()
+        previousManifest = get_build_manifest()
+        set_ffmpeg_runner(
+            FFmpegRunner(
+                previousRunner.sinks + [stats.append],
+                progress=True,
+                onProgress=previousRunner.onProgress,
+            )
+        )
+        set_build_manifest(self.manifest)
+        startTime = time.time()
+        error = None
+        result = None
+        try:
+            result = RENDER_OPS[descriptor["op"]](
+                *descriptor["args"], **descriptor["kwargs"]
+            )
+        except Exception as e:
+            error = "{}: {}".format(type(e).__name__, e)
+        finally:
+            set_ffmpeg_runner(previousRunner)
+            set_build_manifest(previousManifest)
+            # Save what was made before reporting the job, in case this worker
+            # is stopped afterwards
+            self.manifest.flush()
+            stopRenewing.set()
+            renewer.join()
+
+        failed = [s for s in stats if s.returnCode]
+        if error is None and failed:
+            error = "ffmpeg exited with code {} making {}".format(
+                failed[0].returnCode, failed[0].outputs
+            )
+        metrics = {
+            "worker": self.name,
+            "wallTime": time.time() - startTime,
+            "processes": len([s for s in stats if not s.skipped]),
+            "skipped": len([s for s in stats if s.skipped]),
+            "cpuTime": sum((s.cpuUser or 0) + (s.cpuSystem or 0) for s in stats),
+            "maxRSS": max([s.maxRSS or 0 for s in stats] + [0]),
+            "frames": sum(s.frames or 0 for s in stats),
+        }
+        if error is None:
+            self.queue.complete(key, self.name, result, metrics)
+        else:
+            self.queue.fail(key, self.name, error, metrics)
+        return error is None
+
+    def run(self, maxJobs=None, idleTimeout=0, pollInterval=5):
+        """Claim and run jobs one at a time.
+
+        maxJobs: stop after this many jobs (None for no limit)
+        idleTimeout: when the queue is empty, keep checking for new jobs every
+            pollInterval seconds for this long before stopping
+
+        Returns the number of jobs run."""
+        nJobs = 0
+        idleSince = None
+        while maxJobs is None or nJobs < maxJobs:
+            claimed = self.queue.claim(self.name)
+            if claimed is None:
+                idleSince = idleSince or time.time()
+                if time.time() - idleSince >= idleTimeout:
+                    break
+                time.sleep(pollInterval)
+                continue
+            idleSince = None
+            self.run_job(*claimed)
+            nJobs += 1
+        return nJobs